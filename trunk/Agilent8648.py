@@ -3,6 +3,7 @@ import re
 import numpy as np
 #pylint: disable=import-error
 from VisaHandler import Visa_Device
+from AsyncVisaHandler import AsyncVisaDevice
 
 MAX_POWER = 20
 POWER_UNITS = ["dbm", "db"] # more can be added but I think these are the common ones
@@ -10,9 +11,11 @@ POWER_UNITS = ["dbm", "db"] # more can be added but I think these are the common
 class SignalGenerator(Visa_Device):
     """ Creates Visa_Device SignalGenerator """
 
-    def __init__(self, gpib_address):
-        """ Creates the actual device """
-        super().__init__(gpib_address)
+    SIM_MODEL = "8648"
+
+    def __init__(self, gpib_address, **kwargs):
+        """ Creates the actual device, <kwargs> are passed through to Visa_Device """
+        super().__init__(gpib_address, **kwargs)
 
     def convert_frequency(self, raw_freq: str, prefix: str):
         """ Converts string rsp frequency to int with base prefix """
@@ -88,3 +91,7 @@ class SignalGenerator(Visa_Device):
         return self.write("POW:AMPL {0} {1}".format(power, unit))
 
 
+class AsyncSignalGenerator(AsyncVisaDevice):
+    """ Async SignalGenerator, see AsyncVisaHandler.AsyncVisaDevice """
+
+    DEVICE_CLASS = SignalGenerator
@@ -1,4 +1,6 @@
+import numpy as np
 from VisaHandler import Visa_Device
+from AsyncVisaHandler import AsyncVisaDevice
 import time
 
 class NetworkAnalzyer(Visa_Device):
@@ -8,13 +10,20 @@ class NetworkAnalzyer(Visa_Device):
         Visa_Device ([class]): [Network Analzyer class object that extends Visa_Device]
     """
 
-    def __init__(self, gpib_address:int):
+    # HP native command set, batched commands are just joined with ";"
+    COMPOUND_ROOT = ""
+    # The OPC prefix sets operation complete once the command that follows it finishes
+    OPC_COMMAND = "OPC;{0}"
+    SIM_MODEL = "8753ES"
+
+    def __init__(self, gpib_address:int, **kwargs):
         """[Initializes said device using <gpib_address>]
 
         Args:
             gpib_address ([int]): [The GPIB address of the NWA]
+            kwargs: [passed through to Visa_Device, ex: interface]
         """
-        super().__init__(gpib_address)
+        super().__init__(gpib_address, **kwargs)
 
     def get_start_freq(self):
         """[returns start frequency of NWA sweep]
@@ -103,6 +112,26 @@ class NetworkAnalzyer(Visa_Device):
             return self.write(f"AVERO {int(averaging)}")
         return 0
 
+    def start_averaged_sweep(self, count:int=16, callback=None):
+        """ Restarts averaging and takes <count> sweeps without blocking, completion is signalled by
+            service request
+
+        Args:
+            count (int): number of sweeps (NUMG) and averaging factor
+            callback ([function], optional): called with the device once the sweeps are complete
+
+        Returns:
+            [threading.Event]: [set once the averaged sweep is complete, None on failure]
+        """
+        with self.batch() as batch:
+            self.write(f"AVERFACT {count}")
+            self.write("AVERO ON")
+            self.write("AVERREST")
+        if batch.status:
+            print("Failed setting up averaging")
+            return None
+        return self.start_operation(f"NUMG {count}", callback)
+
     def get_reference_position(self):
         """ Returns the reference position of the measurement sweep
         """
@@ -129,3 +158,43 @@ class NetworkAnalzyer(Visa_Device):
         """
         return self.write(f"REFV {value}")
 
+    def get_formatted_data(self):
+        """ Returns the formatted trace data of the active channel as a (points x 2) numpy array
+
+        Returns:
+            [numpy.ndarray]: [one row per point - (primary, secondary) value, secondary is 0 for log mag]
+        """
+        response = self.query("POIN?")
+        points = self.get_num(response) if isinstance(response, str) else None
+        if not isinstance(points, float):
+            print(f"Could not read the number of points: {response}")
+            return 1
+        expected = 2 * int(points)
+        fail = self.write("FORM4;OUTPFORM")
+        if fail:
+            return fail
+        # FORM4 sends one line per point, a read returns one line or several (the whole dump without a
+        # termination character), so keep reading until every value has arrived
+        chunks = []
+        received = 0
+        while received < expected:
+            response = self.read()
+            if response == 0:
+                print(f"Formatted data ended early, received {received // 2} of {expected // 2} points")
+                return 1
+            values = self.get_nums(response)
+            chunks.append(values)
+            received += len(values)
+        if received != expected:
+            print(f"Formatted data has {received} values, expected {expected}")
+            return 1
+        return np.concatenate(chunks).reshape(-1, 2)
+
+class AsyncNetworkAnalzyer(AsyncVisaDevice):
+    """ Async NetworkAnalzyer, every NetworkAnalzyer method is awaitable
+
+    Args:
+        AsyncVisaDevice ([class]): [see AsyncVisaHandler.AsyncVisaDevice]
+    """
+
+    DEVICE_CLASS = NetworkAnalzyer
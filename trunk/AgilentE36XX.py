@@ -1,6 +1,8 @@
 # Power Supply E36XX Handler
 #pylint: disable=import-error
 from VisaHandler import Visa_Device
+from AsyncVisaHandler import AsyncVisaDevice
+from BusScheduler import PRIORITY_CRITICAL
 
 MAX_VOLTAGE = 12
 MAX_CURRENT = 3
@@ -11,19 +13,25 @@ AVAILABLE_OUTPUTS = ["P6V", "P25V", "N25V"]
 class PowerSupply(Visa_Device):
     """ Creates Visa_Device SignalGenerator """
 
-    def __init__(self, gpib_address):
-        """ Creates the actual device """
-        super().__init__(gpib_address)
+    # Voltage and current settings belong to the selected output
+    STATE_COUPLING = {"INST": ("OUPT:VOLT", "VOLT", "CURR")}
+    SIM_MODEL = "E36XX"
+    # Supply readbacks are safety checks, they go ahead of everything else on a scheduled bus
+    BUS_PRIORITY = PRIORITY_CRITICAL
+
+    def __init__(self, gpib_address, **kwargs):
+        """ Creates the actual device, <kwargs> are passed through to Visa_Device """
+        super().__init__(gpib_address, **kwargs)
 
     def set_port(self, interface:int=0):
         """ Sets <interface> to num, numbers coorespond to AVAILABLE_OUTPUTS """
-        global AVAILABLE_OUTPUTS
-        if not isinstance(interface, int):
-            if interface not in AVAILABLE_OUTPUTS:
-                print("Invalid Output Selection, please choose [0, 1, 3] or {0}".format(AVAILABLE_OUTPUTS))
-                return 1
-            else:
-                interface = AVAILABLE_OUTPUTS[interface]
+        if isinstance(interface, int) and 0 <= interface < len(AVAILABLE_OUTPUTS):
+            interface = AVAILABLE_OUTPUTS[interface]
+        elif isinstance(interface, str) and interface.upper() in AVAILABLE_OUTPUTS:
+            interface = interface.upper()
+        else:
+            print("Invalid Output Selection, please choose [0, 1, 2] or {0}".format(AVAILABLE_OUTPUTS))
+            return 1
         check = self._check_port(interface)
         if check == 0:
             return 0
@@ -33,7 +41,7 @@ class PowerSupply(Visa_Device):
     def _check_port(self, interface):
         """ Called from set_port to make sure it was set correctly """
         port = self.query("INST?")
-        if interface not in port:
+        if not isinstance(port, str) or interface not in port:
             return 1
         else:
             return 0
@@ -85,6 +93,13 @@ class PowerSupply(Visa_Device):
             return 1
         return self.query("OUTP:VOLT?")
 
+    def get_applied_settings(self, interface:int=0):
+        """ Returns the [voltage, current] settings of <interface> as a numpy array - APPL? """
+        fail = self.set_port(interface)
+        if fail:
+            return 1
+        return self.query_values("APPL?")
+
     def set_current_limit(self, interface:int=0, current:float=1):
         """ Sets <interface> current limit in AMPS """
         current_limit = self.get_current_limit(interface)
@@ -98,4 +113,10 @@ class PowerSupply(Visa_Device):
         fail = self.set_port(interface)
         if fail:
             return 1
-        return float(self.query("CURR?"))
\ No newline at end of file
+        return float(self.query("CURR?"))
+
+
+class AsyncPowerSupply(AsyncVisaDevice):
+    """ Async PowerSupply, see AsyncVisaHandler.AsyncVisaDevice """
+
+    DEVICE_CLASS = PowerSupply
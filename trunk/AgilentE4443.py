@@ -1,16 +1,84 @@
 # Agilent Spectrum Analyzer Handler - Supports E4443A
+import threading
 import time
-from VisaHandler import Visa_Device
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt5agg import FigureCanvasAgg as FigureCanvasAgg
-from matplotlib.figure import Figure
+from contextlib import contextmanager
+import numpy as np
+from VisaHandler import Visa_Device, parse_values
+from AsyncVisaHandler import AsyncVisaDevice
+from BusScheduler import PRIORITY_BULK, PRIORITY_TRIGGER
+from common.averaging import StreamingAverager
+from common.plotting import PlotService
+from common.ring_buffer import TraceRingBuffer
+from common.spectrogram import SpectrogramStore
+
+# Trace data formats: <format>: (numpy dtype, scale to amplitude units), ASC is parsed as text
+TRACE_FORMATS = {"ASC": None, "REAL,32": ("f4", 1), "REAL,64": ("f8", 1), "INT,32": ("i4", 1e-3)}
+# NORM is MSB first (big endian), SWAP is LSB first (little endian)
+BYTE_ORDERS = ["NORM", "SWAP"]
+# Trace modes: clear write, max hold, min hold, view (frozen) and blank
+TRACE_MODES = ["WRIT", "MAXH", "MINH", "VIEW", "BLAN"]
 
 class SpectrumAnalyzer(Visa_Device):
     """ Creates Visa_Device SpectrumAnalyzer """
 
-    def __init__(self, gpib_address):
-        """ Creates device """
-        super().__init__(gpib_address)
+    # Start/Stop and Center/Span are tied together on the instrument
+    STATE_COUPLING = {"FREQ:START": ("FREQ:CENT", "FREQ:SPAN"), "FREQ:STOP": ("FREQ:CENT", "FREQ:SPAN"),
+                      "FREQ:CENT": ("FREQ:START", "FREQ:STOP"), "FREQ:SPAN": ("FREQ:START", "FREQ:STOP")}
+    SIM_MODEL = "E4443"
+    # Settings that move the sweep frequency axis, writing any of them drops the cached axis
+    FREQ_AXIS_HEADERS = ("FREQ", "SWE:POIN")
+
+    def __init__(self, gpib_address, data_format:str="ASC", byte_order:str="NORM", sweep_timeout:int=30000,
+                 **kwargs):
+        """ Creates device, <data_format> selects the trace transfer format (see TRACE_FORMATS)
+            <sweep_timeout> is the longest time (ms) to wait for a triggered sweep to complete
+            <kwargs> are passed through to Visa_Device
+        """
+        # ((start, span, points), read only frequency array) of the last axis read, see get_freq_points
+        self._freq_axis = None
+        super().__init__(gpib_address, **kwargs)
+        self.sweep_timeout = sweep_timeout
+        self.data_format = "ASC"
+        self.byte_order = "NORM"
+        # True while an acquisition session holds the analyzer in single sweep mode
+        self._acquiring = False
+        # (thread, stop event) of the background acquisition, see start_background_acquisition
+        self._background = None
+        self.ring_buffer = None
+        # Background renderer of plot_sweep_data, started on the first plot
+        self.plotter = None
+        if self.device is not None:
+            self.set_data_format(data_format, byte_order)
+
+    def _write(self, cmd:str):
+        """ Sends <cmd>, dropping the cached frequency axis if it changes start, stop, span or points
+            Writes skipped by the state cache never get here, so they keep the axis
+        """
+        if self._freq_axis is not None and self._moves_freq_axis(cmd):
+            self._freq_axis = None
+        return super()._write(cmd)
+
+    def _query(self, cmd:str):
+        """ Sends query <cmd>, a compound message can carry settings that move the frequency axis too """
+        if self._freq_axis is not None and self._moves_freq_axis(cmd):
+            self._freq_axis = None
+        return super()._query(cmd)
+
+    def _moves_freq_axis(self, cmd:str):
+        """ True if any command in <cmd> could move the frequency axis """
+        for part in cmd.split(";"):
+            header = part.strip().split(" ", 1)[0].lstrip(":").upper()
+            if header.startswith("SENS:"):
+                header = header[len("SENS:"):]
+            if header in self.STATE_RESETS or (not header.endswith("?") and header.startswith(self.FREQ_AXIS_HEADERS)):
+                return True
+        return False
+
+    def invalidate(self, header:str=None):
+        """ Clears the state cache for <header>, or all settings and the frequency axis if None """
+        super().invalidate(header)
+        if header is None:
+            self._freq_axis = None
 
     def get_start_freq(self):
         """ Gets the starting frequency of sweep """
@@ -96,15 +164,125 @@ class SpectrumAnalyzer(Visa_Device):
                 return 1
         return self.write("DISP:WIND:TRAC:Y:RLEV {0}".format(ref_level))
 
-    # NOTE: doesn't work yet
-    def get_marker_peak(self, marker_num:int=1):
-        """ Gets the max amplitude of <marker_num> (defaults to marker 1) """
-        if marker_num not in range(1,5):
+    def set_marker(self, marker_num:int=1, freq:(float, int)=None, prefix:str="GHz"):
+        """ Turns <marker_num> on as a normal (position) marker, at <freq> if given """
+        if marker_num not in range(1, 5):
             print("Invalid marker number: {0}, needs to be [1-4]".format(marker_num))
-        marker_peak = self.query("CALC:MARK{0}:MAX".format(marker_num))
-        return marker_peak
+            return 1
+        fail = self.write("CALC:MARK{0}:MODE POS".format(marker_num))
+        if fail or freq is None:
+            return fail
+        out_freq = self.set_num_freq(freq, prefix)
+        if out_freq is None:
+            print("Marker not set, invalid settings")
+            return 1
+        return self.write("CALC:MARK{0}:X {1}".format(marker_num, out_freq))
+
+    def marker_peak_search(self, marker_num:int=1, next_peak:bool=False, direction:str=None):
+        """ Moves <marker_num> to the highest peak, or with <next_peak> to the next highest peak below it
+            <direction> LEFT|RIGHT moves it to the next peak left or right of where it is instead
+        """
+        if marker_num not in range(1, 5):
+            print("Invalid marker number: {0}, needs to be [1-4]".format(marker_num))
+            return 1
+        if direction is not None and direction.upper() not in ("LEFT", "RIGHT"):
+            print("Invalid direction: {0}, please use LEFT or RIGHT".format(direction))
+            return 1
+        search = ":" + direction.upper() if direction else ":NEXT" if next_peak else ""
+        fail = self.write("CALC:MARK{0}:MAX{1}".format(marker_num, search))
+        # The marker moved, so its cached position no longer applies
+        self.invalidate("CALC:MARK{0}:X".format(marker_num))
+        return fail
+
+    def get_marker_peak(self, marker_num:int=1):
+        """ Runs a peak search with <marker_num> (defaults to marker 1), returns its (freq, amplitude) """
+        fail = self.marker_peak_search(marker_num)
+        if fail:
+            return fail
+        markers = self.get_markers([marker_num])
+        if isinstance(markers, int):
+            return markers
+        return tuple(markers[0])
+
+    def _marker_queries(self, markers):
+        """ Returns the X?/Y? queries of <markers> """
+        return [cmd.format(marker) for marker in markers for cmd in ("CALC:MARK{0}:X?", "CALC:MARK{0}:Y?")]
+
+    def _marker_values(self, responses:list):
+        """ Returns the (markers x 2) array of X/Y responses, 1 if any of them failed """
+        if any(not isinstance(response, str) for response in responses):
+            print("Could not read marker values")
+            return 1
+        return parse_values(",".join(responses)).reshape(-1, 2)
+
+    def get_markers(self, markers=(1, 2, 3, 4)):
+        """ Reads X and Y of every marker in <markers> in one exchange
+            Returns an array (markers x 2) of (freq Hz, amplitude)
+        """
+        return self._marker_values(self.query_many(self._marker_queries(markers)))
+
+    def measure_two_tone(self, freq1:(float, int), freq2:(float, int), prefix:str="GHz", peak_search:bool=True):
+        """ Measures a two tone intermod with markers after a single sweep instead of transferring the trace
+            Returns an array (4 x 2) of (freq Hz, amplitude) at F1, F2, 2F1-F2 and 2F2-F1
+            <peak_search> finds the actual tones with a peak search, then the IM3 products with a peak search
+            left of F1 and right of F2, a product not found within a quarter of the tone spacing of where it
+            should be is read at its frequency instead. Without it the markers read the given frequencies
+        """
+        freq1 = self.set_num_freq(freq1, prefix)
+        freq2 = self.set_num_freq(freq2, prefix)
+        if freq1 is None or freq2 is None:
+            print("Two tone measurement not started, invalid settings")
+            return 1
+        with self.acquisition():
+            fail = self.trigger_sweep()
+            if fail:
+                return fail
+            if peak_search:
+                with self.batch() as batch:
+                    self.marker_peak_search(1)
+                    self.marker_peak_search(2)
+                    self.marker_peak_search(2, next_peak=True)
+                if batch.status:
+                    return batch.status
+                tones = self.get_markers((1, 2))
+                if isinstance(tones, int):
+                    return tones
+                freq1, freq2 = sorted(tones[:, 0])
+            products = (2 * freq1 - freq2, 2 * freq2 - freq1)
+            with self.batch() as batch:
+                self.set_marker(1, freq1, "Hz")
+                self.set_marker(2, freq2, "Hz")
+                for marker_num, freq, direction in zip((3, 4), (freq1, freq2), ("LEFT", "RIGHT")):
+                    if peak_search:
+                        # Start from the tone, the nearest peak outside of it is the product
+                        self.set_marker(marker_num, freq, "Hz")
+                        self.marker_peak_search(marker_num, direction=direction)
+                    else:
+                        self.set_marker(marker_num, products[marker_num - 3], "Hz")
+                responses = [self.query(cmd) for cmd in self._marker_queries(range(1, 5))]
+            if batch.status:
+                return batch.status
+            values = self._marker_values([response.value for response in responses])
+            if not peak_search or isinstance(values, int):
+                return values
+            # A product under the noise floor leaves the search on a noise peak (or on the tone if there was
+            # none), read those at the product frequency instead
+            window = abs(freq2 - freq1) / 4
+            missed = [marker_num for marker_num, freq in zip((3, 4), products)
+                      if abs(values[marker_num - 1, 0] - freq) > window]
+            if missed:
+                with self.batch() as batch:
+                    for marker_num in missed:
+                        self.set_marker(marker_num, products[marker_num - 3], "Hz")
+                    responses = [self.query(cmd) for cmd in self._marker_queries(missed)]
+                if batch.status:
+                    return batch.status
+                retry = self._marker_values([response.value for response in responses])
+                if isinstance(retry, int):
+                    return retry
+                values[[marker_num - 1 for marker_num in missed]] = retry
+        return values
 
-    # NOTE: doesn't work yet
     def set_marker_operation(self, mode:str="MAX"):
         """ Sets marker type to <MAX|PAR> """
         supported_modes = ["MAX", "PAR"]
@@ -113,13 +291,34 @@ class SpectrumAnalyzer(Visa_Device):
             return 1
         return self.write("CALC:MARK:PEAK:SEARC:MODE {0}".format(mode.upper()))
 
-    def set_data_format(self, fmt:str="ASC"):
-        """ sets output data format, default is ascii <ASC> """
-        valid_formats = ["ASC"]
-        if fmt not in valid_formats:
-            print("Invalid data format: {0}".format(fmt))
+    def set_data_format(self, fmt:str="ASC", byte_order:str=None):
+        """ sets trace data format, default is ascii <ASC>
+            Binary formats <REAL,32|REAL,64|INT,32> transfer as definite length blocks,
+            INT,32 is the fastest and is returned in mdBm
+        """
+        fmt = fmt.upper().replace(" ", "")
+        if fmt not in TRACE_FORMATS:
+            print("Invalid data format: {0}, please use one of {1}".format(fmt, list(TRACE_FORMATS)))
+            return 1
+        if byte_order is not None:
+            fail = self.set_byte_order(byte_order)
+            if fail:
+                return fail
+        fail = self.write("FORM:DATA {0}".format(fmt))
+        if not fail:
+            self.data_format = fmt
+        return fail
+
+    def set_byte_order(self, byte_order:str="NORM"):
+        """ Sets the binary data byte order <NORM|SWAP> """
+        byte_order = byte_order.upper()[:4]
+        if byte_order not in BYTE_ORDERS:
+            print("Invalid byte order: {0}, please use one of {1}".format(byte_order, BYTE_ORDERS))
             return 1
-        return self.write("FORM:DATA: {0}".format(fmt))
+        fail = self.write("FORM:BORD {0}".format(byte_order))
+        if not fail:
+            self.byte_order = byte_order
+        return fail
 
     def set_sweep_mode(self, mode:str="single"):
         """ Sets the SA to single sweep mode """
@@ -138,45 +337,317 @@ class SpectrumAnalyzer(Visa_Device):
         points = self.query("SENS:SWE:POIN?")
         return self.get_num(points)
 
-    def get_freq_points(self):
-        """ Returns a list of freq points that are being sampled """
-        span = self.get_freq_span()
-        points = self.get_point_count()
-        start_freq = self.get_start_freq()
-        freq_values = []
-        freq_step = span/points
-        for freq in range(int(points)):
-            freq_values.append(start_freq + freq*freq_step)
-        return freq_values
+    def set_point_count(self, points:int=601):
+        """ Sets the number of points of the sweep """
+        if not 101 <= int(points) <= 8192:
+            print("Invalid point count: {0}, needs to be [101-8192]".format(points))
+            return 1
+        return self.write("SENS:SWE:POIN {0}".format(int(points)))
+
+    def get_freq_points(self, refresh:bool=False):
+        """ Returns the (read only) numpy array of freq points that are being sampled, 1 if they can't be read
+            The axis is cached until a frequency or point count setting is written, <refresh> re-reads it
+        """
+        if self._freq_axis is not None and not refresh:
+            return self._freq_axis[1]
+        responses = self.query_many(["FREQ:SPAN?", "SENS:SWE:POIN?", "FREQ:START?"])
+        if not all(isinstance(response, str) for response in responses):
+            print("Could not read the frequency axis: {0}".format(responses))
+            return 1
+        try:
+            span, points, start_freq = map(float, responses)
+        except ValueError:
+            print("Could not read the frequency axis: {0}".format(responses))
+            return 1
+        key = (start_freq, span, int(points))
+        if self._freq_axis is None or self._freq_axis[0] != key:
+            freq_values = np.linspace(start_freq, start_freq + span, int(points))
+            freq_values.flags.writeable = False
+            self._freq_axis = (key, freq_values)
+        return self._freq_axis[1]
+
+    def get_sweep_time(self):
+        """ Returns the sweep time in seconds """
+        return self.get_num(self.query("SWE:TIME?"))
+
+    def trigger_sweep(self, timeout_ms:int=None):
+        """ Triggers a single sweep (INIT:IMM) and blocks on *OPC? until it has completed, a scheduled device polls
+            the status byte instead so the bus stays free during the sweep
+            <timeout_ms> defaults to self.sweep_timeout, returns 0 on completion
+        """
+        if timeout_ms is None:
+            timeout_ms = self.sweep_timeout
+        with self.bus_priority(PRIORITY_TRIGGER):
+            if self.scheduler is not None:
+                # *OPC? would hold the bus for the whole sweep, polling leaves it to other devices in between
+                fail = self.poll_for_complete("INIT:IMM", timeout_ms)
+            else:
+                fail = self.wait_for_complete("INIT:IMM", timeout_ms)
+        if fail:
+            print("Sweep did not complete within {0}ms".format(timeout_ms))
+        return fail
+
+    def start_sweep(self, callback=None):
+        """ Triggers a single sweep without blocking, completion is signalled by service request
+            Returns a threading.Event set when the sweep (including averaging) has completed,
+            <callback>(device) is called then as well - see Visa_Device.start_operation
+        """
+        if not self._acquiring:
+            fail = self.set_sweep_mode("single")
+            if fail:
+                return None
+        with self.bus_priority(PRIORITY_TRIGGER):
+            return self.start_operation("INIT:IMM", callback)
+
+    def get_averaging(self):
+        """ Returns the trace average count, 0 if averaging is off """
+        with self.batch():
+            state = self.query("AVER?")
+            count = self.query("AVER:COUN?")
+        if self.get_num(state.value) == 0:
+            return 0
+        return int(self.get_num(count.value))
+
+    def set_averaging(self, count:int=16):
+        """ Sets trace averaging to <count> sweeps, 0 or 1 turns averaging off """
+        if not isinstance(count, int) or not 0 <= count <= 8192:
+            print("Invalid average count: {0}, needs to be [0-8192]".format(count))
+            return 1
+        if count <= 1:
+            return self.write("AVER OFF")
+        with self.batch() as batch:
+            self.write("AVER:COUN {0}".format(count))
+            self.write("AVER ON")
+        return batch.status
+
+    @contextmanager
+    def acquisition(self):
+        """ Holds the analyzer in single sweep mode for the with block, so each get_sweep_data inside it only
+            triggers, waits for completion and fetches - continuous sweep is restored when the block exits, ex:
+                with sa.acquisition():
+                    for power in power_levels:
+                        x, y = sa.get_sweep_data()
+            Nested sessions join the outer one
+        """
+        if self._acquiring:
+            yield self
+            return
+        if self.set_sweep_mode("single"):
+            print("Could not switch to single sweep, every acquisition will wait for a free running sweep")
+        self._acquiring = True
+        try:
+            yield self
+        finally:
+            self._acquiring = False
+            self.set_sweep_mode("continuous")
 
     def get_sweep_data(self, trace:int=1):
-        """ Gets the current sweep data """
-        self.set_sweep_mode("single")
-        self.wait()
-        sweep = self.query("TRAC:DATA? TRACE{0}".format(trace))
-        self.wait()
-        y_values = []
-        for value in sweep.split(","):
-            y_values.append(self.get_num(value))
-        x_values = self.get_freq_points()
-        self.set_sweep_mode("continuous")
+        """ Takes a new single sweep, waits for it to complete and returns [freqs, amplitudes], 1 if the sweep failed
+            Outside an acquisition session the analyzer is put back in continuous sweep afterwards
+        """
+        with self.acquisition():
+            fail = self.trigger_sweep()
+            if fail:
+                # The trace still holds the previous sweep
+                return fail
+            y_values = self.get_trace_values(trace)
+            if isinstance(y_values, int):
+                return y_values
+            x_values = self.get_freq_points()
+            if isinstance(x_values, int):
+                return x_values
         return [x_values, y_values]
 
-    def plot_sweep_data(self, data, label:str=None, title:str="Single Sweep"):
-        """ Displays a plot of the sweep data """
+    def get_averaged_sweep_data(self, max_count:int=16, domain:str="power", tolerance_db:float=None,
+                                tones=None, min_count:int=4, trace:int=1):
+        """ Averages up to <max_count> single sweeps on the host in the <domain> "power" or "log"
+            With <tolerance_db> it stops early once the 95% confidence interval of the bins nearest to <tones>
+            (frequencies in Hz, all bins by default) is within +/- <tolerance_db>, after at least <min_count> sweeps
+            Returns [freqs, averaged amplitudes, sweep count], 1 if a sweep failed
+        """
+        averager = StreamingAverager(domain)
+        with self.acquisition():
+            x_values = self.get_freq_points()
+            if isinstance(x_values, int):
+                return x_values
+            bins = None
+            if tones is not None:
+                bins = np.abs(x_values[None, :] - np.asarray(tones, dtype=float)[:, None]).argmin(axis=1)
+            while averager.count < max_count:
+                sweep = self.get_sweep_data(trace)
+                if isinstance(sweep, int):
+                    print("Averaging stopped after {0} sweeps, sweep failed".format(averager.count))
+                    return sweep
+                averager.add(sweep[1])
+                if tolerance_db is not None and averager.converged(tolerance_db, bins, min_count):
+                    break
+        return [x_values, averager.mean(), averager.count]
+
+    def get_sweep_traces(self, traces=(1, 2)):
+        """ Takes a new single sweep and reads all of <traces> from it in one exchange
+            Returns (freqs, amplitudes) where amplitudes is a 2-D array (traces x points) on the shared freq axis,
+            1 if the sweep failed
+        """
+        with self.acquisition():
+            fail = self.trigger_sweep()
+            if fail:
+                # The trace still holds the previous sweep
+                return fail
+            y_values = self.get_traces(traces)
+            if isinstance(y_values, int):
+                return y_values
+            x_values = self.get_freq_points()
+            if isinstance(x_values, int):
+                return x_values
+        return x_values, y_values
+
+    def get_traces(self, traces=(1, 2)):
+        """ Reads the amplitude values of every trace in <traces> with one compound TRAC:DATA? query,
+            returns a 2-D array (traces x points)
+        """
+        cmds = ["TRAC:DATA? TRACE{0}".format(trace) for trace in traces]
+        with self.bus_priority(PRIORITY_BULK):
+            if self.data_format == "ASC":
+                responses = self.query_many(cmds)
+                if any(not isinstance(response, str) for response in responses):
+                    print("Could not read traces {0}".format(list(traces)))
+                    return 1
+                return np.vstack([parse_values(response) for response in responses])
+            dtype, scale = TRACE_FORMATS[self.data_format]
+            y_values = self.query_binary_many(cmds, dtype, big_endian=(self.byte_order == "NORM"))
+        if isinstance(y_values, int):
+            return y_values
+        y_values = np.vstack(y_values)
+        if scale != 1:
+            return y_values * scale
+        return y_values
+
+    def set_trace_mode(self, trace:int=1, mode:str="WRIT"):
+        """ Sets <trace> to <WRIT|MAXH|MINH|VIEW|BLAN>, ex: trace 2 in MAXH next to a clear write trace 1 """
+        mode = mode.upper()[:4]
+        if mode not in TRACE_MODES:
+            print("Invalid trace mode: {0}, please use one of {1}".format(mode, TRACE_MODES))
+            return 1
+        if trace not in range(1, 4):
+            print("Invalid trace: {0}, needs to be [1-3]".format(trace))
+            return 1
+        return self.write("TRAC{0}:MODE {1}".format(trace, mode))
+
+    def get_trace_values(self, trace:int=1):
+        """ Reads the amplitude values of <trace> using the current data format """
+        cmd = "TRAC:DATA? TRACE{0}".format(trace)
+        with self.bus_priority(PRIORITY_BULK):
+            if self.data_format == "ASC":
+                return self.query_values(cmd)
+            dtype, scale = TRACE_FORMATS[self.data_format]
+            y_values = self.query_binary(cmd, dtype, big_endian=(self.byte_order == "NORM"))
+        if isinstance(y_values, int):
+            return y_values
+        if scale != 1:
+            return y_values * scale
+        return y_values
+
+    def start_background_acquisition(self, capacity:int=256, trace:int=1, store:SpectrogramStore=None):
+        """ Starts a thread that triggers and fetches sweeps of <trace> back to back into a TraceRingBuffer of
+            the last <capacity> traces, returns the buffer (also self.ring_buffer) or 1 if the axis can't be read
+            Every sweep is also appended to <store> if given, the acquisition stops once it is full
+            The device lock is held from the trigger to the trace read of each sweep, commands from other threads
+            wait for it and go out between sweeps
+        """
+        if self._background is not None and self._background[0].is_alive():
+            print("Background acquisition already running")
+            return self.ring_buffer
+        freqs = self.get_freq_points()
+        if isinstance(freqs, int):
+            return freqs
+        self.ring_buffer = TraceRingBuffer(capacity, len(freqs))
+        self.ring_buffer.freqs = freqs
+        stop = threading.Event()
+        thread = threading.Thread(target=self._background_acquisition, args=(self.ring_buffer, trace, stop, store),
+                                  name="{0} acquisition".format(self.resource), daemon=True)
+        self._background = (thread, stop)
+        thread.start()
+        return self.ring_buffer
+
+    def stop_background_acquisition(self, timeout:float=None):
+        """ Stops the background acquisition after the sweep in progress, returns its ring buffer """
+        if self._background is None:
+            return self.ring_buffer
+        thread, stop = self._background
+        stop.set()
+        thread.join(timeout)
+        self._background = None
+        return self.ring_buffer
+
+    def _background_acquisition(self, ring_buffer:TraceRingBuffer, trace:int, stop:threading.Event,
+                                store:SpectrogramStore=None):
+        """ Acquisition thread loop, failed sweeps are counted as errors on <ring_buffer> """
+        with self.acquisition():
+            while not stop.is_set():
+                try:
+                    with self.lock:
+                        fail = self.trigger_sweep()
+                        y_values = 1 if fail else self.get_trace_values(trace)
+                except Exception as e:
+                    print("Background acquisition error: {0}".format(e))
+                    y_values = 1
+                timestamp = time.time()
+                if isinstance(y_values, int) or len(y_values) != ring_buffer.points:
+                    ring_buffer.add_error()
+                    # Don't spin on an instrument that keeps failing
+                    stop.wait(0.1)
+                    continue
+                ring_buffer.push(y_values, timestamp)
+                if store is not None and not store.append(y_values, timestamp):
+                    break
+
+    def capture_spectrogram(self, path:str, duration_s:float, max_sweeps:int=None, trace:int=1):
+        """ Records back to back sweeps of <trace> for <duration_s> seconds into a memory mapped SpectrogramStore
+            at <path> (see common.spectrogram), stopping early once <max_sweeps> are stored
+            <max_sweeps> defaults to the most sweeps that fit in <duration_s> at the current sweep time
+            Returns the store, ex: times, freqs, waterfall = sa.capture_spectrogram("limiter", 300).decimated()
+            Returns 1 if a background acquisition is already set up, stop it first
+        """
+        if self._background is not None:
+            print("Background acquisition already running, stop it before capturing a spectrogram")
+            return 1
+        if max_sweeps is None:
+            sweep_time = self.get_sweep_time()
+            if not isinstance(sweep_time, float):
+                return 1
+            max_sweeps = int(duration_s / max(sweep_time, 1e-3)) + 1
+        freqs = self.get_freq_points()
+        if isinstance(freqs, int):
+            return freqs
+        store = SpectrogramStore(path, max_sweeps, freqs)
+        ring_buffer = self.start_background_acquisition(trace=trace, store=store)
+        if isinstance(ring_buffer, int):
+            store.close()
+            return ring_buffer
+        thread, stop = self._background
+        thread.join(duration_s)
+        self.stop_background_acquisition()
+        store.flush()
+        return store
+
+    def plot_sweep_data(self, data, label:str=None, title:str="Single Sweep", path:str="sweep_plot.png"):
+        """ Queues a plot of the sweep data [x, y] on the background PlotService (self.plotter), which renders
+            the latest sweeps to <path> without holding up the measurement
+        """
         if label is None:
             label = self.idn
-        x = data[0]
-        y = data[1]
-        plt.plot(x, y, label=label)
-        plt.draw()
-        plt.xlabel("Freq")
-        plt.ylabel("dBm")
-        plt.title(title)
-        plt.legend()
-        plt.ion()
-        plt.show()
-        time.sleep(0.001)
+        if self.plotter is None:
+            self.plotter = PlotService(path).start()
+        return self.plotter.plot(data[0], data[1], label, title)
+
+    def close_plot(self, save_path:str=None):
+        """ Waits for queued plots to render (also saving the figure to <save_path>) and stops the plot thread """
+        if self.plotter is None:
+            return
+        if save_path is not None:
+            self.plotter.save(save_path)
+        self.plotter.close()
+        self.plotter = None
 
     def get_res_bw(self):
         """ Gets the resolution bandwidth from the spectrum analyzer """
@@ -208,3 +679,9 @@ class SpectrumAnalyzer(Visa_Device):
             accepts <True>/<False>
         """
         return self.write("BAND:BWID:VID:AUTO {0}".format(toggle))
+
+
+class AsyncSpectrumAnalyzer(AsyncVisaDevice):
+    """ Async SpectrumAnalyzer, see AsyncVisaHandler.AsyncVisaDevice """
+
+    DEVICE_CLASS = SpectrumAnalyzer
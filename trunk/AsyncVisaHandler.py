@@ -0,0 +1,87 @@
+# Asyncio interface for VISA devices.
+# Blocking VISA calls run in a single thread executor per device, so commands to one device stay in order
+# while independent devices can be awaited concurrently with asyncio.gather
+
+import asyncio
+import functools
+import inspect
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from VisaHandler import Visa_Device
+
+
+class AsyncVisaDevice():
+    """ Async wrapper around a Visa_Device - every public method of the device becomes awaitable, ex:
+            sa = await AsyncSpectrumAnalyzer.open(18)
+            await asyncio.gather(siggen1.set_power(0), siggen2.set_power(0), sa.set_start_freq(2.3))
+        Context manager methods (batch, acquisition, io_timeout, bus_priority) become async context managers that
+        are entered and exited on the executor thread, where their per thread state applies to the calls awaited
+        inside the block, ex:
+            async with sa.batch() as batch:
+                await sa.set_start_freq(2.3)
+                await sa.set_stop_freq(2.5)
+    """
+
+    # Synchronous driver class created by open, subclasses override this
+    DEVICE_CLASS = Visa_Device
+
+    def __init__(self, device:Visa_Device, executor:ThreadPoolExecutor=None):
+        """ Wraps an already connected <device> """
+        self.device = device
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+
+    @classmethod
+    async def open(cls, gpib_address, **kwargs):
+        """ Creates the DEVICE_CLASS device in the executor so connecting doesn't block the event loop """
+        executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+        device = await loop.run_in_executor(executor, functools.partial(cls.DEVICE_CLASS, gpib_address, **kwargs))
+        return cls(device, executor)
+
+    async def run(self, func, *args, **kwargs):
+        """ Runs blocking <func>(*args, **kwargs) in this device's executor
+            Use this for sequences that must not interleave, ex: run(lambda: device.query_many(cmds))
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        """ Returns device attributes, methods are wrapped in a coroutine that runs in the executor """
+        attr = getattr(self.device, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        if inspect.isgeneratorfunction(getattr(attr, "__wrapped__", None)):
+            # A @contextmanager entered on the event loop thread wouldn't cover the calls made in the executor
+            return functools.partial(self._executor_context, attr)
+
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+    @asynccontextmanager
+    async def _executor_context(self, context_method, *args, **kwargs):
+        """ Enters the context manager returned by <context_method>(*args, **kwargs) on the executor thread """
+        context = context_method(*args, **kwargs)
+        value = await self.run(context.__enter__)
+        try:
+            yield self if value is self.device else value
+        except BaseException as e:
+            if not await self.run(context.__exit__, type(e), e, e.__traceback__):
+                raise
+        else:
+            await self.run(context.__exit__, None, None, None)
+
+    async def close(self):
+        """ Closes the device connection and shuts down the executor """
+        result = await self.run(self.device.close)
+        self.executor.shutdown(wait=False)
+        return result
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
@@ -0,0 +1,175 @@
+# Priority scheduling of transactions on a shared bus.
+# Every instrument on a GPIB board shares it, so a background monitor reading a trace can hold up a power
+# supply safety read or a sweep trigger. Devices with scheduling enabled (Visa_Device.enable_scheduling or
+# VISA_SCHEDULE=1) run each bus transaction through the BusScheduler of their board, which hands the bus to the
+# highest priority waiter first, and read binary blocks in chunks so a long trace transfer can't starve
+# short commands.
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+# Lower runs first
+PRIORITY_CRITICAL = 0   # safety reads, ex: power supply current
+PRIORITY_TRIGGER = 1    # time critical triggers
+PRIORITY_NORMAL = 2
+PRIORITY_BULK = 3       # trace and data dumps
+PRIORITY_NAMES = {PRIORITY_CRITICAL: "critical", PRIORITY_TRIGGER: "trigger", PRIORITY_NORMAL: "normal",
+                  PRIORITY_BULK: "bulk"}
+# Bytes per bus transaction when reading binary blocks of a scheduled device
+BLOCK_CHUNK_SIZE = 4096
+
+
+class BusScheduler():
+    """ Reentrant bus lock handed to waiting threads in priority order (first come first served within a
+        priority), with busy and wait time accounting per priority
+    """
+
+    def __init__(self, name:str="GPIB0"):
+        self.name = name
+        self.condition = threading.Condition()
+        self.owner = None
+        self.depth = 0
+        self.owner_priority = None
+        self.acquired_at = 0.0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.reset()
+
+    def reset(self):
+        """ Restarts the utilization window """
+        with self.condition:
+            self.started = time.perf_counter()
+            self.stats = {priority: {"transactions": 0, "busy_s": 0.0, "wait_s": 0.0, "max_wait_s": 0.0}
+                          for priority in PRIORITY_NAMES}
+
+    def acquire(self, priority:int=PRIORITY_NORMAL):
+        """ Blocks until this thread owns the bus, returns the time spent waiting """
+        thread = threading.get_ident()
+        with self.condition:
+            if self.owner == thread:
+                self.depth += 1
+                return 0.0
+            entry = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, entry)
+            start = time.perf_counter()
+            while self.owner is not None or self.waiting[0] != entry:
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.owner = thread
+            self.depth = 1
+            self.owner_priority = priority
+            self.acquired_at = time.perf_counter()
+            wait = self.acquired_at - start
+            stats = self.stats.setdefault(priority, {"transactions": 0, "busy_s": 0.0, "wait_s": 0.0,
+                                                     "max_wait_s": 0.0})
+            stats["wait_s"] += wait
+            stats["max_wait_s"] = max(stats["max_wait_s"], wait)
+            return wait
+
+    def release(self):
+        with self.condition:
+            if self.owner != threading.get_ident():
+                raise RuntimeError("{0} bus released by a thread that doesn't own it".format(self.name))
+            self.depth -= 1
+            if self.depth:
+                return
+            stats = self.stats[self.owner_priority]
+            stats["transactions"] += 1
+            stats["busy_s"] += time.perf_counter() - self.acquired_at
+            self.owner = None
+            self.condition.notify_all()
+
+    @contextmanager
+    def transaction(self, priority:int=PRIORITY_NORMAL):
+        """ Holds the bus for the enclosed calls, nested transactions of the same thread join the outer one """
+        self.acquire(priority)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def report(self):
+        """ Returns {"bus", "elapsed_s", "busy_s", "utilization", "priorities": {name: counters}} """
+        with self.condition:
+            elapsed = time.perf_counter() - self.started
+            priorities = {PRIORITY_NAMES.get(priority, str(priority)): dict(stats)
+                          for priority, stats in self.stats.items()}
+        busy = sum(stats["busy_s"] for stats in priorities.values())
+        for stats in priorities.values():
+            stats["mean_wait_s"] = stats["wait_s"] / stats["transactions"] if stats["transactions"] else 0.0
+        return {"bus": self.name, "elapsed_s": elapsed, "busy_s": busy,
+                "utilization": busy / elapsed if elapsed else 0.0, "priorities": priorities}
+
+
+SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+def get_bus_scheduler(resource_name:str):
+    """ Returns the shared scheduler of the board <resource_name> is on, ex: GPIB0::19::INSTR -> "GPIB0" """
+    board = resource_name.split("::")[0].upper()
+    with _SCHEDULERS_LOCK:
+        if board not in SCHEDULERS:
+            SCHEDULERS[board] = BusScheduler(board)
+        return SCHEDULERS[board]
+
+
+class ScheduledResource():
+    """ Proxy around a VISA resource that runs every call as a transaction on its bus scheduler
+        <priority> is the device default, bus_priority overrides it for the calling thread
+    """
+
+    def __init__(self, resource, scheduler:BusScheduler, priority:int=PRIORITY_NORMAL):
+        self.__dict__["resource"] = resource
+        self.__dict__["scheduler"] = scheduler
+        self.__dict__["priority"] = priority
+        self.__dict__["block_chunk_size"] = BLOCK_CHUNK_SIZE
+        self.__dict__["local"] = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def __setattr__(self, name, value):
+        if name in ("priority", "block_chunk_size"):
+            self.__dict__[name] = value
+        else:
+            setattr(self.resource, name, value)
+
+    def current_priority(self):
+        priority = getattr(self.local, "priority", None)
+        return self.priority if priority is None else priority
+
+    @contextmanager
+    def bus_priority(self, priority:int):
+        """ Runs the enclosed calls of this thread at <priority> """
+        previous = getattr(self.local, "priority", None)
+        self.local.priority = priority
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+
+    def _call(self, func, args:tuple):
+        with self.scheduler.transaction(self.current_priority()):
+            return func(*args)
+
+    def write(self, message:str):
+        return self._call(self.resource.write, (message,))
+
+    def query(self, message:str):
+        return self._call(self.resource.query, (message,))
+
+    def read(self):
+        return self._call(self.resource.read, ())
+
+    def read_raw(self, *args):
+        return self._call(self.resource.read_raw, args)
+
+    def read_bytes(self, count:int, **kwargs):
+        return self._call(lambda count: self.resource.read_bytes(count, **kwargs), (count,))
+
+    def read_stb(self):
+        return self._call(self.resource.read_stb, ())
@@ -0,0 +1,394 @@
+# Long running instrument server that owns the bus and multiplexes test scripts and monitoring tools.
+# The server keeps one session per instrument open, queues requests from all clients fairly (round robin
+# per instrument), answers identical pending queries with one bus transaction and caches *IDN?.
+# Start it once per bench:
+#   python3 InstrumentServer.py [--address /tmp/visa_instrument_server.sock | 127.0.0.1:5555] [--backend visa]
+# then run any script against it with VISA_BACKEND=server (VISA_SERVER selects the address).
+#
+# Protocol: one json object per line in each direction.
+#   request:  {"op": "list" | "open" | "write" | "query" | "query_raw" | "read" | "read_raw" | "read_stb" |
+#              "clear" | "stats", "resource": name, "data": message, "timeout": ms}
+#   response: {"s" | "b" | "v": result} (see SessionRecorder.encode_response) or {"e": VISA error code}
+
+import argparse
+import collections
+import json
+import os
+import socket
+import socketserver
+import threading
+from concurrent.futures import Future
+
+import visa
+
+from SessionRecorder import decode_response, encode_response
+from SocketTransport import message_length
+
+DEFAULT_ADDRESS = os.environ.get("VISA_SERVER", "/tmp/visa_instrument_server.sock" if hasattr(socket, "AF_UNIX")
+                                 else "127.0.0.1:5555")
+IDN_QUERY = "*IDN?"
+# Queries that read and clear instrument state (error queue, event registers), every client has to get its own answer
+STATEFUL_QUERIES = ("SYST:ERR", "SYSTEM:ERR", "STAT:", "STATUS:", "*ESR?", "*STB?")
+
+
+def is_pure_query(message:str):
+    """ True if every command in <message> is a query that leaves the instrument as it was (not STATEFUL_QUERIES),
+        so answering it twice in a row gives the same result
+    """
+    headers = [cmd.strip().split(" ", 1)[0].lstrip(":").upper() for cmd in message.split(";")]
+    return all(header.endswith("?") and not header.startswith(STATEFUL_QUERIES) for header in headers)
+
+
+def read_message(resource):
+    """ Reads one whole response message, following definite length blocks that contain the termination char """
+    termination = (getattr(resource, "read_termination", None) or "\n").encode()
+    raw = resource.read_raw()
+    while message_length(raw, termination) is None:
+        raw += resource.read_raw()
+    return raw
+
+
+class DeviceWorker():
+    """ Owns one instrument session and runs the requests of all clients on it
+        Each client has its own queue and the worker takes one request per client in turn, so a client
+        streaming trace reads can't starve a monitor polling a power supply
+    """
+
+    def __init__(self, resource_name:str, resource):
+        self.resource_name = resource_name
+        self.resource = resource
+        self.queues = collections.OrderedDict()
+        self.condition = threading.Condition()
+        self.idn = None
+        self.stats = {"requests": 0, "transactions": 0, "coalesced": 0, "idn_cached": 0, "errors": 0}
+        self.thread = threading.Thread(target=self.run, name="worker " + resource_name, daemon=True)
+        self.thread.start()
+
+    def submit(self, client, request:dict):
+        """ Queues <request> for <client>, returns a Future with the response dict """
+        future = Future()
+        with self.condition:
+            self.queues.setdefault(client, collections.deque()).append((request, future))
+            self.condition.notify()
+        return future
+
+    def remove_client(self, client):
+        with self.condition:
+            self.queues.pop(client, None)
+
+    def _next_requests(self):
+        """ Takes the next request in round robin order plus the identical pure queries at the head of the
+            other clients' queues, which are answered by the same transaction
+        """
+        with self.condition:
+            while not any(self.queues.values()):
+                self.condition.wait()
+            client = next(client for client, queue in self.queues.items() if queue)
+            self.queues.move_to_end(client)
+            request, future = self.queues[client].popleft()
+            batch = [future]
+            if request["op"] in ("query", "query_raw") and is_pure_query(request["data"]):
+                for queue in self.queues.values():
+                    if queue and queue[0][0]["op"] == request["op"] and queue[0][0]["data"] == request["data"]:
+                        batch.append(queue.popleft()[1])
+            return request, batch
+
+    def run(self):
+        while True:
+            request, futures = self._next_requests()
+            self.stats["requests"] += len(futures)
+            self.stats["coalesced"] += len(futures) - 1
+            response = self.execute(request)
+            for future in futures:
+                future.set_result(response)
+
+    def execute(self, request:dict):
+        """ Runs one request on the instrument and returns the response dict """
+        op = request["op"]
+        data = request.get("data")
+        if op == "query" and data.strip().upper() == IDN_QUERY and self.idn is not None:
+            self.stats["idn_cached"] += 1
+            return {"s": self.idn}
+        if request.get("timeout") is not None and request["timeout"] != self.resource.timeout:
+            self.resource.timeout = request["timeout"]
+        self.stats["transactions"] += 1
+        try:
+            if op == "write":
+                result = self.resource.write(data)
+            elif op == "query":
+                result = self.resource.query(data)
+                if data.strip().upper() == IDN_QUERY:
+                    self.idn = result
+            elif op == "query_raw":
+                self.resource.write(data)
+                result = read_message(self.resource)
+            elif op == "read":
+                result = self.resource.read()
+            elif op == "read_raw":
+                result = read_message(self.resource)
+            elif op == "read_stb":
+                result = self.resource.read_stb()
+            elif op == "clear":
+                result = self.resource.clear()
+            else:
+                return {"e": int(visa.constants.StatusCode.error_nonsupported_operation)}
+        except visa.VisaIOError as e:
+            self.stats["errors"] += 1
+            return {"e": int(e.error_code)}
+        except Exception as e:
+            # A broken request must not take the worker down for every other client
+            print("{0}: {1} {2} failed - {3!r}".format(self.resource_name, op, data, e))
+            self.stats["errors"] += 1
+            return {"e": int(visa.constants.StatusCode.error_system_error)}
+        return encode_response(result)
+
+
+class InstrumentServer():
+    """ Serves the instruments of <backend> (defaults to VisaHandler.DEFAULT_BACKEND) at <address>,
+        a unix socket path or "host:port"
+    """
+
+    def __init__(self, address:str=None, backend:str=None):
+        import VisaHandler
+        self.address = address or DEFAULT_ADDRESS
+        self.backend = backend or VisaHandler.DEFAULT_BACKEND
+        self.resource_manager = VisaHandler.get_resource_manager(self.backend)
+        self.workers = {}
+        self.lock = threading.Lock()
+        self.resources = None
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.handle_client(self)
+
+        if ":" in self.address:
+            host, port = self.address.rsplit(":", 1)
+            self.server = socketserver.ThreadingTCPServer((host, int(port)), Handler)
+        else:
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self.server = socketserver.ThreadingUnixStreamServer(self.address, Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def list_resources(self, refresh:bool=False):
+        """ Bus scan, done once and shared by every client """
+        if self.resources is None or refresh:
+            self.resources = tuple(self.resource_manager.list_resources())
+        return self.resources
+
+    def get_worker(self, resource_name:str, model:str=None):
+        """ Returns the worker of <resource_name>, opening the session the first time any client asks """
+        with self.lock:
+            worker = self.workers.get(resource_name)
+            if worker is None:
+                options = {"model": model} if self.backend == "sim" and model else {}
+                worker = DeviceWorker(resource_name, self.resource_manager.open_resource(resource_name, **options))
+                self.workers[resource_name] = worker
+            return worker
+
+    def handle_client(self, handler):
+        """ Answers the requests of one client connection until it disconnects """
+        client = object()
+        workers = set()
+        try:
+            for line in handler.rfile:
+                request = json.loads(line)
+                op = request["op"]
+                try:
+                    if op == "list":
+                        response = {"v": list(self.list_resources(request.get("refresh", False)))}
+                    elif op == "open":
+                        workers.add(self.get_worker(request["resource"], request.get("model")))
+                        response = {"v": 0}
+                    elif op == "stats":
+                        response = {"v": {name: dict(worker.stats) for name, worker in self.workers.items()}}
+                    else:
+                        worker = self.get_worker(request["resource"])
+                        workers.add(worker)
+                        response = worker.submit(client, request).result()
+                except visa.VisaIOError as e:
+                    response = {"e": int(e.error_code)}
+                handler.wfile.write((json.dumps(response) + "\n").encode())
+        except (ConnectionError, ValueError) as e:
+            print("Client dropped: {0}".format(e))
+        finally:
+            for worker in workers:
+                worker.remove_client(client)
+
+    def start(self):
+        """ Serves in a daemon thread, returns the server """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        print("Instrument server ({0} backend) listening on {1}".format(self.backend, self.address))
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if ":" not in self.address and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class ServerConnection():
+    """ Json lines connection to an InstrumentServer, one request at a time """
+
+    def __init__(self, address:str=None):
+        address = address or DEFAULT_ADDRESS
+        try:
+            if ":" in address:
+                host, port = address.rsplit(":", 1)
+                self.socket = socket.create_connection((host, int(port)))
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            else:
+                self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.socket.connect(address)
+        except OSError as e:
+            print("Could not connect to the instrument server at {0} - {1}".format(address, e))
+            raise visa.VisaIOError(visa.constants.StatusCode.error_resource_not_found)
+        self.file = self.socket.makefile("rwb")
+        self.lock = threading.Lock()
+
+    def request(self, op:str, **fields):
+        """ Sends one request and returns its result, server side VISA errors are raised as VisaIOError """
+        fields["op"] = op
+        with self.lock:
+            try:
+                self.file.write((json.dumps(fields) + "\n").encode())
+                self.file.flush()
+                line = self.file.readline()
+            except OSError:
+                raise visa.VisaIOError(visa.constants.StatusCode.error_connection_lost)
+        if not line:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_connection_lost)
+        response = json.loads(line)
+        if "e" in response:
+            raise visa.VisaIOError(response["e"])
+        return decode_response(response)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+class ServerResource():
+    """ Client side resource for the "server" backend
+        A write containing a query is held back and sent together with the read that fetches its response,
+        so the server runs them as one transaction that no other client can interleave with
+    """
+
+    def __init__(self, resource_name:str, connection:ServerConnection):
+        self.resource_name = resource_name
+        self.connection = connection
+        self.timeout = 2000
+        self.read_termination = "\n"
+        self.write_termination = "\n"
+        self._pending = None
+        self._buffer = b""
+
+    def _request(self, op:str, data:str=None):
+        return self.connection.request(op, resource=self.resource_name, data=data, timeout=self.timeout)
+
+    def _flush_pending(self):
+        """ Sends a held back query whose response is never read """
+        if self._pending is not None:
+            message, self._pending = self._pending, None
+            self._request("write", message)
+
+    def write(self, message:str):
+        self._flush_pending()
+        self._buffer = b""
+        if "?" in message:
+            self._pending = message
+            return len(message) + len(self.write_termination)
+        return self._request("write", message)
+
+    def read_raw(self, size:int=None):
+        """ Returns one whole response message, <size> limits how many bytes are returned """
+        if not self._buffer:
+            if self._pending is not None:
+                message, self._pending = self._pending, None
+                self._buffer = self._request("query_raw", message)
+            else:
+                self._buffer = self._request("read_raw")
+        end = len(self._buffer) if size is None else min(size, len(self._buffer))
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+    def read_bytes(self, count:int, break_on_termchar:bool=False):
+        if break_on_termchar:
+            # Buffered data is always a whole response, so this stops at its end
+            return self.read_raw(count)
+        data = b""
+        while len(data) < count:
+            data += self.read_raw(count - len(data))
+        return data
+
+    def read(self):
+        return self.read_raw().decode().rstrip(self.read_termination)
+
+    def query(self, message:str):
+        self._flush_pending()
+        self._buffer = b""
+        return self._request("query", message).rstrip(self.read_termination)
+
+    def read_stb(self):
+        return self._request("read_stb")
+
+    def clear(self):
+        self._pending = None
+        self._buffer = b""
+        return self._request("clear")
+
+    def close(self):
+        self._flush_pending()
+        self.connection.close()
+
+
+class ServerResourceManager():
+    """ Resource manager for the "server" backend
+        Every resource gets its own connection, so each is queued separately and concurrent drivers don't wait
+        on each other in the client
+    """
+
+    def __init__(self, address:str=None):
+        self.address = address or DEFAULT_ADDRESS
+        self.connection = ServerConnection(self.address)
+
+    def list_resources(self, query:str="?*::INSTR"):
+        return tuple(self.connection.request("list"))
+
+    def open_resource(self, resource_name:str, model:str=None, **kwargs):
+        connection = ServerConnection(self.address)
+        connection.request("open", resource=resource_name, model=model)
+        resource = ServerResource(resource_name, connection)
+        for name, value in kwargs.items():
+            setattr(resource, name, value)
+        return resource
+
+    def stats(self):
+        """ Returns the request/transaction/coalescing counters of every instrument on the server """
+        return self.connection.request("stats")
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Instrument server that owns the bus and multiplexes clients")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="unix socket path or host:port to listen on")
+    parser.add_argument("--backend", default=None, help="backend the instruments are opened with (visa, sim, ...)")
+    args = parser.parse_args()
+    server = InstrumentServer(args.address, args.backend)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,26 +10,37 @@ Limiter tests:
 		[-10dBm, -5dBm, 0dBm, +5dBm, +10dBm, +15dB]m
 """
 # Need to add GUI from Mac Windows
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time
 
+from common.parallel import run_device_calls
+
 from Agilent8648 import SignalGenerator
 from AgilentE4443 import SpectrumAnalyzer
 
 class LimiterTest():
     """ Defines the limiter test criteria """
     def __init__(self, siggen1_gpib, siggen2_gpib, sa_gpib,
-                 output_file:str=None):
-        """ Configures all test instance requirements """
+                 output_file:str=None, concurrent:bool=False, settle_time:float=0.1,
+                 measurement:str="trace"):
+        """ Configures all test instance requirements
+            <concurrent> configures the instruments from a thread pool instead of one after the other
+            <settle_time> is the minimum time (s) the generators get to settle before a sweep is triggered
+            <measurement> "trace" saves every sweep, "marker" only the tone and IM3 amplitudes per point
+        """
         # If output file is None: test will be saved as Limiter_test{date}.csv
         if output_file is None:
             now = datetime.now().strftime("%m%d%Y_%H%M")
             output_file = "Limiter_test{0}.csv".format(now)
-            print("Creating Write file: {0}".format(output_file))
-            self.write_file = open(output_file, "w")
-        self.siggen1 = SignalGenerator(siggen1_gpib)
-        self.siggen2 = SignalGenerator(siggen2_gpib)
-        self.spec_analyzer = SpectrumAnalyzer(sa_gpib)
+        print("Creating Write file: {0}".format(output_file))
+        self.write_file = open(output_file, "w")
+        self.siggen1 = SignalGenerator(siggen1_gpib, state_cache=True)
+        self.siggen2 = SignalGenerator(siggen2_gpib, state_cache=True)
+        self.spec_analyzer = SpectrumAnalyzer(sa_gpib, state_cache=True)
+        self.executor = ThreadPoolExecutor(max_workers=3) if concurrent else None
+        self.settle_time = settle_time
+        self.measurement = measurement
 
         #### NOTE: EDIT FREQUENCIES HERE - FREQUENCIES IN GHz! ####
         self.frequency_pairs = [[2.395, 2.405], [2.995, 3.005]]
@@ -40,6 +51,20 @@ class LimiterTest():
         """ Closes write file """
         self.write_file.close()
 
+    def close(self):
+        """ Shuts down the configuration thread pool and closes the write file if a test stopped early """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if not self.write_file.closed:
+            self.close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
     def write_sweep_data(self, data:list):
         """ writes <data> (x,y) to self.write_file
             Line 1: x
@@ -48,15 +73,29 @@ class LimiterTest():
         self.write_file.write("{0}\n".format(",".join(map(str, data[0]))))
         self.write_file.write("{0}\n\n".format(",".join(map(str, data[1]))))
 
+    def write_marker_data(self, power:(int, float), markers):
+        """ writes one line per point for marker measurements:
+            F1, F2 (Hz), power, amplitudes at F1, F2, 2F1-F2 and 2F2-F1
+        """
+        values = [markers[0][0], markers[1][0], power] + [amplitude for _, amplitude in markers]
+        self.write_file.write("{0}\n".format(",".join(map(str, values))))
+
+    def run_siggen_calls(self, method_name:str, args1:tuple, args2:tuple):
+        """ Calls <method_name> on both signal generators, concurrently when self.executor is set
+            Returns True if either call failed
+        """
+        results = run_device_calls([
+            (self.siggen1, getattr(self.siggen1, method_name), args1),
+            (self.siggen2, getattr(self.siggen2, method_name), args2)], self.executor)
+        return any(results)
+
     def disable_signal_output(self):
         """ Turns off both signal generator outputs """
-        self.siggen1.set_output_state(False)
-        self.siggen2.set_output_state(False)
+        return self.run_siggen_calls("set_output_state", (False,), (False,))
 
     def enable_signal_output(self):
         """ Turns on both signal generator outputs """
-        self.siggen1.set_output_state(True)
-        self.siggen2.set_output_state(True)
+        return self.run_siggen_calls("set_output_state", (True,), (True,))
 
     def set_freq_pair(self, freq_pair:list):
         """ Reads in <freq_pair>:
@@ -66,15 +105,11 @@ class LimiterTest():
         if len(freq_pair) != 2:
             print("Invalid freq length")
             return 1
-        s1_fail = self.siggen1.set_frequency(freq_pair[0])
-        s2_fail = self.siggen2.set_frequency(freq_pair[1])
-        return any([s1_fail, s2_fail])
+        return self.run_siggen_calls("set_frequency", (freq_pair[0],), (freq_pair[1],))
 
     def set_power(self, power:(int, float)):
         """ Sets both signal generators to <power> """
-        s1_fail = self.siggen1.set_power(power)
-        s2_fail = self.siggen2.set_power(power)
-        return any([s1_fail, s2_fail])
+        return self.run_siggen_calls("set_power", (power,), (power,))
 
     def set_sa_parameters(self, freq_pair:list, power:(float, int)):
         """ Sets the spectrum analyzer for 100MHz below F1 and 100MHz above F2
@@ -82,54 +117,75 @@ class LimiterTest():
             attenuation but this is not handled yet
         """
         # Frequencies +/- 100MHz since default unit is GHz
-        start_fail = self.spec_analyzer.set_start_freq(freq_pair[0]-.05)
-        stop_fail = self.spec_analyzer.set_stop_freq(freq_pair[1]+.05)
-        return any([start_fail, stop_fail])
+        with self.spec_analyzer.batch() as batch:
+            start_fail = self.spec_analyzer.set_start_freq(freq_pair[0]-.05)
+            stop_fail = self.spec_analyzer.set_stop_freq(freq_pair[1]+.05)
+        return any([start_fail, stop_fail, batch.status])
 
-    def test_OIP3(self):
+    def test_OIP3(self, plot:bool=True, pause:bool=True):
         """ Tests the defined <self.frequency_pairs> and <self.power_levels>
             for OIP3 measurements and writes a csv file with data and plots
-            results
+            results, <plot>/<pause> can be turned off for unattended runs
         """
 
         # Diables siggen outputs before setting things - just in case
         self.disable_signal_output()
         self.spec_analyzer.set_reference_level(0)
-        for freq_pair in self.frequency_pairs:
-            for power in self.power_levels:
-                print("Testing frequencies: {0} - {1}".format(
-                    freq_pair[0], freq_pair[1]))
-                print("Power Level: {0}dBm".format(power))
-                fail = self.set_freq_pair(freq_pair)
-                if fail:
-                    print("Setting Frequencies Failed - Stopping Test")
-                    return "FAILED at {0} - {1}dBm".format(freq_pair, power)
-                fail = self.set_power(power)
-                if fail:
-                    print("Failed setting signal generator power: {0}".format(power))
-                    return "FAILED at {0} - {1}dBm".format(freq_pair, power)
-                fail = self.set_sa_parameters(freq_pair, power)
-                if fail:
-                    print("Failed setting up spectrum analyzer")
-                    return "FAILED at {0} - {1}dBm".format(freq_pair, power)
-                self.enable_signal_output()
-                time.sleep(2)
-                [x, y] = self.spec_analyzer.get_sweep_data()
-                self.write_sweep_data([x, y])
-                label = "{0}-{1} @ {2}dBm".format(freq_pair[0],
-                        freq_pair[1], power)
-                self.spec_analyzer.plot_sweep_data([x,y], label)
-                self.disable_signal_output()
+        # Single sweep mode is held for the whole test, each point only triggers and fetches
+        with self.spec_analyzer.acquisition():
+            for freq_pair in self.frequency_pairs:
+                for power in self.power_levels:
+                    print("Testing frequencies: {0} - {1}".format(
+                        freq_pair[0], freq_pair[1]))
+                    print("Power Level: {0}dBm".format(power))
+                    fail = self.set_freq_pair(freq_pair)
+                    if fail:
+                        print("Setting Frequencies Failed - Stopping Test")
+                        return "FAILED at {0} - {1}dBm".format(freq_pair, power)
+                    fail = self.set_power(power)
+                    if fail:
+                        print("Failed setting signal generator power: {0}".format(power))
+                        return "FAILED at {0} - {1}dBm".format(freq_pair, power)
+                    fail = self.set_sa_parameters(freq_pair, power)
+                    if fail:
+                        print("Failed setting up spectrum analyzer")
+                        return "FAILED at {0} - {1}dBm".format(freq_pair, power)
+                    self.enable_signal_output()
+                    # Sweep is synchronized with *OPC?, only the generators need settling time
+                    time.sleep(self.settle_time)
+                    if self.measurement == "marker":
+                        # Only the four marker readings cross the bus instead of the whole trace
+                        markers = self.spec_analyzer.measure_two_tone(freq_pair[0], freq_pair[1])
+                        if isinstance(markers, int):
+                            print("Failed reading markers")
+                            return "FAILED at {0} - {1}dBm".format(freq_pair, power)
+                        self.write_marker_data(power, markers)
+                    else:
+                        sweep = self.spec_analyzer.get_sweep_data()
+                        if isinstance(sweep, int):
+                            print("Sweep failed")
+                            return "FAILED at {0} - {1}dBm".format(freq_pair, power)
+                        [x, y] = sweep
+                        self.write_sweep_data([x, y])
+                        label = "{0}-{1} @ {2}dBm".format(freq_pair[0],
+                                freq_pair[1], power)
+                        if plot:
+                            self.spec_analyzer.plot_sweep_data([x,y], label)
+                    self.disable_signal_output()
         print("Testing Complete")
         print("Data File: {0}".format(self.write_file))
         self.close_file()
-        _ = input("Any Key To Continue...")
+        if plot:
+            # Lets the plot thread finish rendering the last sweeps
+            self.spec_analyzer.close_plot()
+        if pause:
+            _ = input("Any Key To Continue...")
 
 def main():
     """ Main routine that starts the testing """
-    test = LimiterTest(19, 21, 18)
-    print("Starting OIP3 Test")
-    test.test_OIP3()
+    with LimiterTest(19, 21, 18) as test:
+        print("Starting OIP3 Test")
+        test.test_OIP3()
 
 if __name__=="__main__":
     main()
\ No newline at end of file
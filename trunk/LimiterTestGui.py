@@ -234,8 +234,8 @@ class AppWindow(Ui_LimiterTest):
     def start_limiter_test(self):
         """ this is where the magic will happend, it will pull in all fields from the gui and execute the limiter test """
         params = self.generate_kwargs()
-        test = Test(kwargs=params)
-        write_file = test.test_OIP3()
+        with Test(kwargs=params) as test:
+            write_file = test.test_OIP3()
         self.plot_file(write_file)
 
     def close(self):
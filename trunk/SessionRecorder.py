@@ -0,0 +1,227 @@
+# Record and replay of instrument sessions.
+# A SessionRecorder logs every command, response and timing of the devices recording to it into a gzip
+# json-lines file, and the "replay" backend serves those responses back to the same driver code offline.
+# Record: VISA_RECORD=session.jsonl.gz python3 LimiterTest.py (or device.start_recording(recorder))
+# Replay: VISA_BACKEND=replay VISA_REPLAY_FILE=session.jsonl.gz VISA_REPLAY_SPEED=0 python3 LimiterTest.py
+
+import atexit
+import base64
+import gzip
+import json
+import os
+import threading
+import time
+
+import visa
+
+RECORD_VERSION = 1
+
+
+def encode_response(response):
+    """ Returns the json fields for a response: "s" for text, "b" (base64) for bytes """
+    if isinstance(response, bytes):
+        return {"b": base64.b64encode(response).decode()}
+    if isinstance(response, str):
+        return {"s": response}
+    if response is None:
+        return {}
+    return {"v": response}
+
+
+def decode_response(record:dict):
+    """ Returns the response stored by encode_response """
+    if "b" in record:
+        return base64.b64decode(record["b"])
+    if "s" in record:
+        return record["s"]
+    return record.get("v")
+
+
+class SessionRecorder():
+    """ Writes one json line per I/O call to <path> (gzip compressed when it ends in .gz):
+        {"t": start time (s from recording start), "d": duration (s), "r": resource, "op": call,
+         "c": command, "s"/"b"/"v": response, "e": VISA error code}
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        opener = gzip.open if path.endswith(".gz") else open
+        self.file = opener(path, "wt")
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.file.write(json.dumps({"version": RECORD_VERSION, "started": time.time()}) + "\n")
+
+    def record(self, resource:str, op:str, cmd:str, start:float, duration:float, response=None, error:int=None):
+        """ Adds one I/O call to the session """
+        entry = {"t": round(start - self.start, 6), "d": round(duration, 6), "r": resource, "op": op}
+        if cmd is not None:
+            entry["c"] = cmd
+        entry.update(encode_response(response))
+        if error is not None:
+            entry["e"] = int(error)
+        line = json.dumps(entry, separators=(",", ":"))
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line + "\n")
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+class RecordingResource():
+    """ Proxy around a VISA resource that logs every call to a SessionRecorder """
+
+    def __init__(self, resource, recorder:SessionRecorder, resource_name:str):
+        self.__dict__["resource"] = resource
+        self.__dict__["recorder"] = recorder
+        self.__dict__["resource_name"] = resource_name
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resource, name, value)
+
+    def _call(self, op:str, cmd, func, args:tuple):
+        start = time.perf_counter()
+        try:
+            response = func(*args)
+        except visa.VisaIOError as e:
+            self.recorder.record(self.resource_name, op, cmd, start, time.perf_counter() - start,
+                                 error=e.error_code)
+            raise
+        self.recorder.record(self.resource_name, op, cmd, start, time.perf_counter() - start, response)
+        return response
+
+    def write(self, message:str):
+        return self._call("write", message, self.resource.write, (message,))
+
+    def query(self, message:str):
+        return self._call("query", message, self.resource.query, (message,))
+
+    def read(self):
+        return self._call("read", None, self.resource.read, ())
+
+    def read_raw(self, *args):
+        return self._call("read_raw", None, self.resource.read_raw, args)
+
+    def read_bytes(self, count:int, **kwargs):
+        return self._call("read_bytes", None, lambda count: self.resource.read_bytes(count, **kwargs), (count,))
+
+    def read_stb(self):
+        return self._call("read_stb", None, self.resource.read_stb, ())
+
+
+_SESSION_RECORDER = None
+
+
+def get_session_recorder(path:str=None):
+    """ Returns the process wide recorder for <path> (defaults to VISA_RECORD), closed at exit """
+    global _SESSION_RECORDER
+    if _SESSION_RECORDER is None:
+        _SESSION_RECORDER = SessionRecorder(path or os.environ["VISA_RECORD"])
+        atexit.register(_SESSION_RECORDER.close)
+    return _SESSION_RECORDER
+
+
+def load_session(path:str):
+    """ Returns the recorded calls of <path> grouped by resource: {resource: [record, ...]} """
+    opener = gzip.open if path.endswith(".gz") else open
+    sessions = {}
+    with opener(path, "rt") as session_file:
+        header = json.loads(session_file.readline())
+        if header.get("version") != RECORD_VERSION:
+            print("Unknown session version: {0}".format(header.get("version")))
+        for line in session_file:
+            record = json.loads(line)
+            sessions.setdefault(record["r"], []).append(record)
+    return sessions
+
+
+class ReplayResource():
+    """ Serves the recorded responses of one resource in order
+        <speed> scales the recorded instrument time: 1 is original timing, 10 is 10x faster, 0 doesn't wait
+    """
+
+    def __init__(self, resource_name:str, records:list, speed:float=1.0):
+        self.resource_name = resource_name
+        self.records = [record for record in records if record["op"] != "read_stb"]
+        self.status_records = [record for record in records if record["op"] == "read_stb"]
+        self.position = 0
+        self.speed = speed
+        self.timeout = 2000
+        self.read_termination = "\n"
+        self.write_termination = "\n"
+
+    def _next(self, op:str, cmd:str=None):
+        """ Returns the next recorded <op> call, skipping ahead to resynchronize on a mismatch """
+        for index in range(self.position, len(self.records)):
+            record = self.records[index]
+            if record["op"] == op and (cmd is None or record.get("c") == cmd):
+                if index != self.position:
+                    print("Replay of {0} skipped {1} recorded calls to find {2} {3}".format(
+                        self.resource_name, index - self.position, op, cmd or ""))
+                self.position = index + 1
+                return record
+        raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+
+    def _replay(self, record:dict):
+        """ Waits the recorded duration and returns the response, or raises the recorded error """
+        if self.speed:
+            time.sleep(record["d"] / self.speed)
+        if "e" in record:
+            raise visa.VisaIOError(record["e"])
+        return decode_response(record)
+
+    def write(self, message:str):
+        return self._replay(self._next("write", message))
+
+    def query(self, message:str):
+        return self._replay(self._next("query", message))
+
+    def read(self):
+        return self._replay(self._next("read"))
+
+    def read_raw(self, size:int=None):
+        return self._replay(self._next("read_raw"))
+
+    def read_bytes(self, count:int, break_on_termchar:bool=False):
+        return self._replay(self._next("read_bytes"))
+
+    def read_stb(self):
+        """ Status polls depend on timing, so they come from their own queue - once it runs out the
+            device reports service requested so pollers don't wait forever
+        """
+        if self.status_records:
+            return self._replay(self.status_records.pop(0))
+        return 96
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayResourceManager():
+    """ Resource manager for the "replay" backend, lists and opens the resources recorded in <path>
+        <path> and <speed> default to VISA_REPLAY_FILE and VISA_REPLAY_SPEED
+    """
+
+    def __init__(self, path:str=None, speed:float=None):
+        self.path = path or os.environ["VISA_REPLAY_FILE"]
+        self.speed = float(os.environ.get("VISA_REPLAY_SPEED", 1.0) if speed is None else speed)
+        self.sessions = load_session(self.path)
+
+    def list_resources(self, query:str="?*::INSTR"):
+        return tuple(self.sessions)
+
+    def open_resource(self, resource_name:str, **kwargs):
+        if resource_name not in self.sessions:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_resource_not_found)
+        return ReplayResource(resource_name, self.sessions[resource_name], self.speed)
+
+    def close(self):
+        pass
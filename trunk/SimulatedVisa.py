@@ -0,0 +1,818 @@
+# Simulated VISA backend - lets every driver run without GPIB hardware.
+# Select it with the VISA_BACKEND=sim environment variable or Visa_Device(..., backend="sim").
+# Each simulated instrument answers the commands its driver sends, and a LatencyModel adds per command
+# latency, bus bandwidth and sweep time so throughput can be benchmarked on a laptop.
+
+import os
+import re
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+import visa
+
+# Formats used by the simulated instruments when answering numeric queries
+SCPI_FLOAT = "{0:+.9E}"
+HP_FLOAT = "{0:+.6E}"
+
+
+def parse_number(value:str, units:dict=None):
+    """ Returns the float of a command argument, with an optional unit suffix from <units> (ex: "2.4 GHz") """
+    value = value.strip().lower()
+    if value in ("on", "off"):
+        return float(value == "on")
+    if units:
+        for unit, scale in sorted(units.items(), key=lambda item: -len(item[0])):
+            if value.endswith(unit):
+                return float(value[:-len(unit)]) * scale
+    return float(value)
+
+
+FREQ_UNITS = {"ghz": 1e9, "mhz": 1e6, "khz": 1e3, "hz": 1.0}
+POWER_UNITS = {"dbm": 1.0, "db": 1.0}
+
+
+class LatencyModel():
+    """ Timing of the simulated bus and instruments
+        <command_latency>: seconds added to every message (GPIB addressing/turnaround)
+        <bytes_per_second>: bus bandwidth for message bytes
+        <sweep_time>: seconds per sweep for analyzers
+        <realtime>: False keeps a virtual clock instead of sleeping, for fast regression runs
+        Defaults come from VISA_SIM_LATENCY, VISA_SIM_BANDWIDTH, VISA_SIM_SWEEP_TIME and VISA_SIM_REALTIME
+    """
+
+    def __init__(self, command_latency:float=None, bytes_per_second:float=None, sweep_time:float=None,
+                 realtime:bool=None):
+        env = os.environ.get
+        self.command_latency = float(env("VISA_SIM_LATENCY", 0.001) if command_latency is None else command_latency)
+        self.bytes_per_second = float(env("VISA_SIM_BANDWIDTH", 1e6) if bytes_per_second is None
+                                      else bytes_per_second)
+        self.sweep_time = float(env("VISA_SIM_SWEEP_TIME", 0.05) if sweep_time is None else sweep_time)
+        if realtime is None:
+            realtime = env("VISA_SIM_REALTIME", "1") not in ("0", "false", "False")
+        self.realtime = realtime
+        self.virtual_time = 0.0
+
+    def now(self):
+        """ Returns the current simulated time in seconds """
+        if self.realtime:
+            return time.monotonic()
+        return self.virtual_time
+
+    def sleep(self, seconds:float):
+        """ Lets <seconds> of simulated time pass """
+        if seconds <= 0:
+            return
+        if self.realtime:
+            time.sleep(seconds)
+        else:
+            self.virtual_time += seconds
+
+    def wait_until(self, timestamp:float):
+        """ Lets simulated time pass until <timestamp> """
+        self.sleep(timestamp - self.now())
+
+    def message(self, nbytes:int):
+        """ Time for one message of <nbytes> over the bus """
+        self.sleep(self.command_latency + nbytes / self.bytes_per_second)
+
+    def transfer(self, nbytes:int):
+        """ Time to move <nbytes> of response data over the bus """
+        self.sleep(nbytes / self.bytes_per_second)
+
+
+class SimulatedBench():
+    """ Shared RF environment - generator tones pass through a DUT to the simulated analyzers
+        The DUT has <dut_gain> and a third order intercept of <dut_oip3> (output referred, dBm)
+    """
+
+    def __init__(self, dut_gain:float=0.0, dut_oip3:float=30.0, noise_floor:float=-90.0, seed:int=None):
+        self.dut_gain = dut_gain
+        self.dut_oip3 = dut_oip3
+        self.noise_floor = noise_floor
+        self.rng = np.random.default_rng(seed)
+        # <source id>: (frequency Hz, power dBm, output enabled)
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def set_source(self, source, freq:float, power:float, enabled:bool):
+        """ Updates the tone of generator <source> """
+        with self.lock:
+            self.sources[source] = (freq, power, enabled)
+
+    def tones(self):
+        """ Returns [(frequency, power dBm)] at the DUT output: fundamentals and 2Fa-Fb IM3 products """
+        with self.lock:
+            active = [(freq, power + self.dut_gain) for freq, power, enabled in self.sources.values() if enabled]
+        tones = list(active)
+        for index_a, (freq_a, power_a) in enumerate(active):
+            for index_b, (freq_b, power_b) in enumerate(active):
+                if index_a != index_b and 2 * freq_a - freq_b > 0:
+                    tones.append((2 * freq_a - freq_b, 2 * power_a + power_b - 2 * self.dut_oip3))
+        return tones
+
+    def spectrum(self, freqs:np.ndarray, rbw:float, averages:int=1):
+        """ Returns the displayed power (dBm) at <freqs> for a <rbw> Hz gaussian filter
+            Noise has the ~5.6dB log display deviation, reduced by <averages>
+        """
+        bin_width = (freqs[-1] - freqs[0]) / max(len(freqs) - 1, 1)
+        # A peak detector shows a tone in its bin even when the RBW is narrower than the bin
+        width = max(rbw, bin_width)
+        noise_db = self.noise_floor + self.rng.normal(0, 5.6 / np.sqrt(max(averages, 1)), len(freqs))
+        linear = 10 ** (noise_db / 10)
+        for freq, power in self.tones():
+            offset = 2 * (freqs - freq) / width
+            near = np.abs(offset) < 10
+            if near.any():
+                linear[near] += 10 ** ((power - 3.01 * offset[near] ** 2) / 10)
+        return 10 * np.log10(linear)
+
+
+BENCH = SimulatedBench()
+
+
+class SimulatedInstrument():
+    """ Base simulated SCPI instrument - IEEE 488.2 common commands, error queue and a settings store
+        Settings in DEFAULTS are set with "<header> <value>" and read back with "<header>?",
+        subclasses add handlers for commands with side effects
+    """
+
+    IDN = "Simulated,Instrument,0,0"
+    # <header>: power on value of a plain setting
+    DEFAULTS = {}
+    # <alternate header>: header - lets long forms and driver spellings share one setting
+    ALIASES = {}
+    # Format used for numeric query responses
+    NUMBER_FORMAT = SCPI_FLOAT
+
+    def __init__(self, latency:LatencyModel=None, bench:SimulatedBench=None):
+        self.latency = latency or LatencyModel()
+        self.bench = bench or BENCH
+        self.state = dict(self.DEFAULTS)
+        self.errors = []
+        self.ese = 0
+        self.sre = 0
+        self.esr = 0
+        # Simulated time when the pending overlapped operation (sweep) completes
+        self.busy_until = 0.0
+        self.srq_handler = None
+        self.srq_event = threading.Event()
+        self.handlers = {"*IDN?": lambda args: self.IDN, "*RST": self.reset, "*CLS": self.clear_status,
+                         "*ESE": self.set_ese, "*ESE?": lambda args: str(self.ese),
+                         "*SRE": self.set_sre, "*SRE?": lambda args: str(self.sre),
+                         "*ESR?": self.read_esr, "*STB?": lambda args: str(self.status_byte()),
+                         "*OPC": self.set_opc, "*OPC?": self.query_opc, "*WAI": self.wait,
+                         "SYST:ERR?": self.read_error}
+
+    def normalize(self, header:str):
+        """ Returns the canonical form of <header> """
+        header = header.lstrip(":").upper()
+        if header.startswith("SENS:"):
+            header = header[5:]
+        query = header.endswith("?")
+        header = header.rstrip("?")
+        header = self.ALIASES.get(header, header)
+        return header + "?" if query else header
+
+    def execute(self, cmd:str):
+        """ Runs a single command, returns the response string/bytes for queries or None """
+        header, _, args = cmd.strip().partition(" ")
+        if not header:
+            return None
+        header = self.normalize(header)
+        args = args.strip()
+        if header in self.handlers:
+            return self.handlers[header](args)
+        setting = header.rstrip("?")
+        if setting in self.state:
+            if header.endswith("?"):
+                return self.format_value(self.state[setting])
+            try:
+                self.state[setting] = parse_number(args)
+            except ValueError:
+                self.state[setting] = args
+            return None
+        self.errors.append('-113,"Undefined header;{0}"'.format(cmd.strip()))
+        return None
+
+    def format_value(self, value):
+        """ Formats a setting for a query response """
+        if isinstance(value, float):
+            if value.is_integer() and abs(value) < 1e6:
+                return str(int(value))
+            return self.NUMBER_FORMAT.format(value)
+        return str(value)
+
+    def reset(self, args:str=""):
+        """ *RST - back to the default settings """
+        self.state = dict(self.DEFAULTS)
+        self.busy_until = 0.0
+
+    def clear_status(self, args:str=""):
+        """ *CLS """
+        self.esr = 0
+        self.errors = []
+        self.srq_event.clear()
+
+    def set_ese(self, args:str):
+        self.ese = int(parse_number(args))
+
+    def set_sre(self, args:str):
+        self.sre = int(parse_number(args))
+
+    def read_esr(self, args:str=""):
+        esr, self.esr = self.esr, 0
+        return str(esr)
+
+    def read_error(self, args:str=""):
+        if self.errors:
+            return self.errors.pop(0)
+        return '+0,"No error"'
+
+    def status_byte(self):
+        """ IEEE 488.2 status byte - ESB (32) from ESR/ESE, MSS (64) from the enabled summary bits """
+        status = 32 if self.esr & self.ese else 0
+        if self.errors:
+            status |= 4
+        if status & self.sre:
+            status |= 64
+        return status
+
+    def start_operation(self, duration:float):
+        """ Starts an overlapped operation that finishes <duration> seconds from now """
+        self.busy_until = max(self.busy_until, self.latency.now()) + duration
+
+    def wait(self, args:str=""):
+        """ *WAI - nothing runs until the pending operation is done """
+        self.latency.wait_until(self.busy_until)
+
+    def query_opc(self, args:str=""):
+        """ *OPC? - answers once the pending operation is done """
+        self.wait()
+        return "1"
+
+    def set_opc(self, args:str=""):
+        """ *OPC - sets the ESR operation complete bit once the pending operation is done """
+        remaining = self.busy_until - self.latency.now()
+        if remaining > 0 and self.latency.realtime:
+            timer = threading.Timer(remaining, self.operation_complete)
+            timer.daemon = True
+            timer.start()
+        else:
+            self.latency.wait_until(self.busy_until)
+            self.operation_complete()
+
+    def operation_complete(self):
+        """ Sets the operation complete bit and requests service if enabled """
+        self.esr |= 1
+        if self.status_byte() & 64:
+            self.srq_event.set()
+            if self.srq_handler is not None:
+                self.srq_handler()
+
+
+class SimulatedSignalGenerator(SimulatedInstrument):
+    """ Agilent 8648 - CW frequency, power and output state, feeds its tone to the bench """
+
+    IDN = "Hewlett-Packard,8648C,SIM00000,A.00.00"
+    DEFAULTS = {"FREQ:CW": 1e9, "POW:AMPL": -136.0, "OUTP:STAT": 0.0}
+    ALIASES = {"FREQ": "FREQ:CW", "FREQUENCY:CW": "FREQ:CW", "POW": "POW:AMPL", "OUTP": "OUTP:STAT"}
+
+    def __init__(self, latency:LatencyModel=None, bench:SimulatedBench=None):
+        super().__init__(latency, bench)
+        self.handlers.update({"FREQ:CW": self.set_frequency, "POW:AMPL": self.set_power,
+                              "OUTP:STAT": self.set_output})
+        self.update_bench()
+
+    def set_frequency(self, args:str):
+        self.state["FREQ:CW"] = parse_number(args, FREQ_UNITS)
+        self.update_bench()
+
+    def set_power(self, args:str):
+        self.state["POW:AMPL"] = parse_number(args, POWER_UNITS)
+        self.update_bench()
+
+    def set_output(self, args:str):
+        self.state["OUTP:STAT"] = float(bool(parse_number(args)))
+        self.update_bench()
+
+    def reset(self, args:str=""):
+        super().reset(args)
+        self.update_bench()
+
+    def update_bench(self):
+        self.bench.set_source(id(self), self.state["FREQ:CW"], self.state["POW:AMPL"],
+                              bool(self.state["OUTP:STAT"]))
+
+
+class SimulatedPowerSupply(SimulatedInstrument):
+    """ Agilent E36XX (E3631 style) - voltage/current settings per selected output """
+
+    IDN = "HEWLETT-PACKARD,E3631A,0,SIM"
+    OUTPUTS = ("P6V", "P25V", "N25V")
+    DEFAULTS = {"INST": "P6V", "OUTP": 0.0}
+    ALIASES = {"INST:SEL": "INST", "OUTP:STAT": "OUTP", "VOLT:LEV": "VOLT", "CURR:LEV": "CURR"}
+
+    def __init__(self, latency:LatencyModel=None, bench:SimulatedBench=None):
+        super().__init__(latency, bench)
+        self.settings = {output: {"VOLT": 0.0, "CURR": 1.0} for output in self.OUTPUTS}
+        self.handlers.update({"INST": self.select_output, "VOLT": self.set_setting("VOLT"),
+                              "CURR": self.set_setting("CURR"), "VOLT?": self.get_setting("VOLT"),
+                              "CURR?": self.get_setting("CURR"), "APPL?": self.applied,
+                              "MEAS:VOLT?": self.get_setting("VOLT"), "MEAS:CURR?": lambda args: "+0.000000E+00"})
+
+    def select_output(self, args:str):
+        if args.upper() not in self.OUTPUTS:
+            self.errors.append('-224,"Illegal parameter value"')
+            return
+        self.state["INST"] = args.upper()
+
+    def set_setting(self, name:str):
+        def handler(args:str):
+            self.settings[self.state["INST"]][name] = parse_number(args)
+        return handler
+
+    def get_setting(self, name:str):
+        def handler(args:str):
+            return SCPI_FLOAT.format(self.settings[self.state["INST"]][name])
+        return handler
+
+    def applied(self, args:str=""):
+        selected = self.settings[self.state["INST"]]
+        return '"{0:+.6f},{1:+.6f}"'.format(selected["VOLT"], selected["CURR"])
+
+
+class SimulatedSpectrumAnalyzer(SimulatedInstrument):
+    """ Agilent E4443 - start/stop/center/span, sweep control, averaging and trace transfer in
+        ASCII or binary blocks, trace data comes from the bench
+    """
+
+    IDN = "Agilent Technologies,E4443A,SIM00000,A.00.00"
+    DEFAULTS = {"FREQ:START": 3.0, "FREQ:STOP": 6.7e9, "SWE:POIN": 601.0, "INIT:CONT": 1.0,
+                "BAND": 3e6, "BAND:AUTO": 1.0, "BAND:VID": 3e6, "BAND:VID:AUTO": 1.0,
+                "POW:ATT": 10.0, "DISP:WIND:TRAC:Y:RLEV": 0.0, "AVER": 0.0, "AVER:COUN": 100.0,
+                "FORM:DATA": "ASC", "FORM:BORD": "NORM", "CALC:MARK:PEAK:SEARC:MODE": "MAX",
+                "CALC:MARK:PEAK:EXC": 6.0, "CALC:MARK:PEAK:THR": -90.0}
+    ALIASES = {"CALC:MARK:PEAK:SEARCH:MODE": "CALC:MARK:PEAK:SEARC:MODE", "CALC:MARK:PEAK:EXCURSION":
+               "CALC:MARK:PEAK:EXC", "CALC:MARK:PEAK:THRESHOLD": "CALC:MARK:PEAK:THR",
+               "FREQ:STAR": "FREQ:START", "FREQUENCY:START": "FREQ:START", "FREQUENCY:STOP": "FREQ:STOP",
+               "FREQUENCY:CENTER": "FREQ:CENT", "FREQ:CENTER": "FREQ:CENT", "FREQUENCY:SPAN": "FREQ:SPAN",
+               "SWE:POINTS": "SWE:POIN", "BAND:BWID:RES": "BAND", "BAND:RES": "BAND", "BWID": "BAND",
+               "BWID:RES": "BAND", "BAND:BWID:RES:AUTO": "BAND:AUTO", "BAND:RES:AUTO": "BAND:AUTO",
+               "BWID:RES:AUTO": "BAND:AUTO", "BAND:BWID:VID": "BAND:VID", "BWID:VID": "BAND:VID",
+               "BAND:BWID:VID:AUTO": "BAND:VID:AUTO", "BWID:VID:AUTO": "BAND:VID:AUTO",
+               "AVER:STAT": "AVER", "FORM": "FORM:DATA", "FORM:TRAC:DATA": "FORM:DATA", "FORM:TRAC": "FORM:DATA",
+               "INIT": "INIT:IMM", "TRAC": "TRAC:DATA", "POW:RF:ATT": "POW:ATT"}
+    # <format>: numpy dtype and the scale from dBm, INT,32 is in mdBm
+    BINARY_FORMATS = {"REAL,32": ("f4", 1), "REAL,64": ("f8", 1), "INT,32": ("i4", 1000)}
+    TRACE_NAMES = ("TRACE1", "TRACE2", "TRACE3")
+    TRACE_MODES = ("WRIT", "MAXH", "MINH", "VIEW", "BLAN")
+    # CALC:MARK<n>:<function>, the marker peak search settings (CALC:MARK:PEAK:...) are plain settings
+    MARKER_HEADER = re.compile(r"CALC(?:ULATE)?:MARK(?:ER)?([1-4]?):(?!PEAK)(.+)")
+
+    def __init__(self, latency:LatencyModel=None, bench:SimulatedBench=None):
+        super().__init__(latency, bench)
+        self.traces = {}
+        self.trace_modes = dict.fromkeys(self.TRACE_NAMES, "WRIT")
+        self.markers = self.new_markers()
+        for number, name in enumerate(self.TRACE_NAMES, 1):
+            for header in ("TRAC{0}:MODE".format(number), "TRACE{0}:MODE".format(number)) + (
+                    ("TRAC:MODE", "TRACE:MODE") if number == 1 else ()):
+                self.handlers[header] = self.set_trace_mode(name)
+                self.handlers[header + "?"] = lambda args, name=name: self.trace_modes[name]
+        self.handlers.update({"FREQ:CENT": self.set_center, "FREQ:CENT?": lambda args: SCPI_FLOAT.format(
+                                  self.center()),
+                              "FREQ:SPAN": self.set_span, "FREQ:SPAN?": lambda args: SCPI_FLOAT.format(self.span()),
+                              "FORM:DATA": self.set_format, "INIT:IMM": self.initiate,
+                              "SWE:TIME?": lambda args: SCPI_FLOAT.format(self.sweep_time()),
+                              "TRAC:DATA?": self.trace_data})
+
+    def execute(self, cmd:str):
+        header, _, args = cmd.strip().partition(" ")
+        match = self.MARKER_HEADER.fullmatch(header.lstrip(":").upper())
+        if match:
+            return self.marker(int(match.group(1) or 1), match.group(2), args.strip(), cmd)
+        return super().execute(cmd)
+
+    def new_markers(self):
+        """ <marker number>: {"mode": POS|OFF, "bin": trace index, "trace": TRACEn} """
+        return {number: {"mode": "OFF", "bin": 0, "trace": "TRACE1"} for number in range(1, 5)}
+
+    def marker_trace(self, marker:dict):
+        if self.state["INIT:CONT"] or marker["trace"] not in self.traces:
+            self.sweep()
+        return self.traces[marker["trace"]]
+
+    def marker(self, number:int, function:str, args:str, cmd:str):
+        """ CALC:MARK<number>:MODE/STAT/TRAC/X/Y?/MAX/MAX:NEXT/MAX:LEFT/MAX:RIGHT """
+        marker = self.markers[number]
+        function = {"MODE?": "MODE?", "STATE": "STAT", "STATE?": "STAT?", "TRACE": "TRAC", "MAXIMUM": "MAX",
+                    "MAXIMUM:NEXT": "MAX:NEXT", "MAXIMUM:LEFT": "MAX:LEFT", "MAXIMUM:RIGHT": "MAX:RIGHT",
+                    "MAX:RIGH": "MAX:RIGHT", "MAXIMUM:RIGH": "MAX:RIGHT", "X:POS": "X",
+                    "X:POSITION": "X"}.get(function, function)
+        if function == "MODE":
+            mode = args.upper()[:3]
+            marker["mode"] = "OFF" if mode == "OFF" else "POS"
+            return None
+        if function == "MODE?":
+            return marker["mode"]
+        if function == "STAT":
+            marker["mode"] = "POS" if args.upper() in ("ON", "1") else "OFF"
+            return None
+        if function == "STAT?":
+            return "0" if marker["mode"] == "OFF" else "1"
+        if function == "TRAC":
+            marker["trace"] = "TRACE{0}".format(int(parse_number(args)))
+            return None
+        if function == "X":
+            freqs = self.frequencies()
+            marker["bin"] = int(np.abs(freqs - parse_number(args, FREQ_UNITS)).argmin())
+            marker["mode"] = "POS"
+            return None
+        if function in ("MAX", "MAX:NEXT", "MAX:LEFT", "MAX:RIGHT"):
+            trace = self.marker_trace(marker)
+            if function == "MAX":
+                index = int(trace.argmax())
+            elif function == "MAX:NEXT":
+                index = self.next_peak(trace, trace[marker["bin"]])
+            else:
+                peaks = self.peaks(trace)
+                side = peaks[peaks < marker["bin"]] if function == "MAX:LEFT" else peaks[peaks > marker["bin"]]
+                index = (int(side.max()) if function == "MAX:LEFT" else int(side.min())) if len(side) else None
+            if index is None:
+                self.errors.append('202,"No peak found"')
+                return None
+            marker["bin"] = index
+            marker["mode"] = "POS"
+            return None
+        if function in ("X?", "Y?"):
+            if marker["mode"] == "OFF":
+                self.errors.append('-221,"Settings conflict;marker {0} is off"'.format(number))
+                return SCPI_FLOAT.format(9.91e37)
+            if function == "X?":
+                return SCPI_FLOAT.format(self.frequencies()[marker["bin"]])
+            return SCPI_FLOAT.format(self.marker_trace(marker)[marker["bin"]])
+        self.errors.append('-113,"Undefined header;{0}"'.format(cmd.strip()))
+        return None
+
+    def peaks(self, trace:np.ndarray):
+        """ Indexes of the peaks that rise at least the peak excursion above the valleys on both sides and are
+            above the peak threshold, in ascending order
+        """
+        excursion = self.state["CALC:MARK:PEAK:EXC"]
+        threshold = self.state["CALC:MARK:PEAK:THR"]
+        inner = trace[1:-1]
+        peaks = np.nonzero((inner > trace[:-2]) & (inner >= trace[2:]))[0] + 1
+        found = []
+        for index in peaks[trace[peaks] > threshold]:
+            value = trace[index]
+            higher = np.nonzero(trace[:index] > value)[0]
+            left = trace[higher[-1] + 1 if len(higher) else 0:index]
+            higher = np.nonzero(trace[index + 1:] > value)[0]
+            right = trace[index + 1:index + 1 + higher[0] if len(higher) else len(trace)]
+            valleys = [side.min() for side in (left, right) if len(side)]
+            if valleys and value - max(valleys) >= excursion:
+                found.append(index)
+        return np.array(found, dtype=int)
+
+    def next_peak(self, trace:np.ndarray, below:float):
+        """ Index of the highest peak (see peaks) lower than <below>, None if there is none """
+        peaks = self.peaks(trace)
+        peaks = peaks[trace[peaks] < below]
+        if not len(peaks):
+            return None
+        return int(peaks[trace[peaks].argmax()])
+
+    def center(self):
+        return (self.state["FREQ:START"] + self.state["FREQ:STOP"]) / 2
+
+    def span(self):
+        return self.state["FREQ:STOP"] - self.state["FREQ:START"]
+
+    def set_center(self, args:str):
+        center, span = parse_number(args, FREQ_UNITS), self.span()
+        self.state["FREQ:START"], self.state["FREQ:STOP"] = center - span / 2, center + span / 2
+
+    def set_span(self, args:str):
+        center, span = self.center(), parse_number(args, FREQ_UNITS)
+        self.state["FREQ:START"], self.state["FREQ:STOP"] = center - span / 2, center + span / 2
+
+    def set_format(self, args:str):
+        fmt = args.upper().replace(" ", "")
+        fmt = {"ASCII": "ASC", "REAL,32": "REAL,32", "REAL,64": "REAL,64", "INTEGER,32": "INT,32"}.get(fmt, fmt)
+        if fmt != "ASC" and fmt not in self.BINARY_FORMATS:
+            self.errors.append('-224,"Illegal parameter value"')
+            return
+        self.state["FORM:DATA"] = fmt
+
+    def resolution_bw(self):
+        if self.state["BAND:AUTO"]:
+            return max(self.span() / 106, 1.0)
+        return self.state["BAND"]
+
+    def averages(self):
+        return int(self.state["AVER:COUN"]) if self.state["AVER"] else 1
+
+    def sweep_time(self):
+        return self.latency.sweep_time
+
+    def frequencies(self):
+        return np.linspace(self.state["FREQ:START"], self.state["FREQ:STOP"], int(self.state["SWE:POIN"]))
+
+    def set_trace_mode(self, name:str):
+        def handler(args:str):
+            mode = args.strip().upper()[:4]
+            if mode not in self.TRACE_MODES:
+                self.errors.append('-224,"Illegal parameter value"')
+                return
+            self.trace_modes[name] = mode
+        return handler
+
+    def sweep(self):
+        """ Takes a sweep from the bench into every trace according to its mode: clear write, max/min hold,
+            or kept as is for view/blank
+        """
+        trace = self.bench.spectrum(self.frequencies(), self.resolution_bw(), self.averages())
+        for name in self.TRACE_NAMES:
+            mode = self.trace_modes[name]
+            previous = self.traces.get(name)
+            if previous is None or len(previous) != len(trace) or mode == "WRIT":
+                self.traces[name] = trace
+            elif mode == "MAXH":
+                self.traces[name] = np.maximum(previous, trace)
+            elif mode == "MINH":
+                self.traces[name] = np.minimum(previous, trace)
+
+    def initiate(self, args:str=""):
+        """ INIT:IMM - starts a sweep (including averaging) that completes after the sweep time """
+        self.start_operation(self.sweep_time() * self.averages())
+        self.sweep()
+
+    def trace_data(self, args:str):
+        """ TRAC:DATA? TRACEn - the last sweep, or a fresh one when sweeping continuously """
+        name = (args or "TRACE1").upper()
+        if name not in self.TRACE_NAMES:
+            self.errors.append('-224,"Illegal parameter value"')
+            return ""
+        if self.state["INIT:CONT"] or name not in self.traces:
+            self.sweep()
+        trace = self.traces[name]
+        fmt = self.state["FORM:DATA"]
+        if fmt == "ASC":
+            return ",".join(SCPI_FLOAT.format(value) for value in trace)
+        dtype, scale = self.BINARY_FORMATS[fmt]
+        byte_order = ">" if self.state["FORM:BORD"] == "NORM" else "<"
+        data = (trace * scale).astype(np.dtype(dtype).newbyteorder(byte_order)).tobytes()
+        length = str(len(data))
+        return "#{0}{1}".format(len(length), length).encode() + data
+
+    def reset(self, args:str=""):
+        super().reset(args)
+        self.traces = {}
+        self.trace_modes = dict.fromkeys(self.TRACE_NAMES, "WRIT")
+        self.markers = self.new_markers()
+
+
+class SimulatedNetworkAnalyzer(SimulatedInstrument):
+    """ Agilent 8753ES - HP native commands for start/stop/center, averaging and formatted data output """
+
+    IDN = "HEWLETT PACKARD,8753ES,0,7.74"
+    DEFAULTS = {"STAR": 30e3, "STOP": 6e9, "POIN": 201.0, "AVERO": 0.0, "AVERFACT": 16.0,
+                "REFP": 5.0, "REFV": 0.0}
+    NUMBER_FORMAT = HP_FLOAT
+
+    def __init__(self, latency:LatencyModel=None, bench:SimulatedBench=None):
+        super().__init__(latency, bench)
+        self.opc_next = False
+        self.handlers.update({"CENT": self.set_center, "CENT?": lambda args: HP_FLOAT.format(
+                                  (self.state["STAR"] + self.state["STOP"]) / 2),
+                              "SPAN?": lambda args: HP_FLOAT.format(self.state["STOP"] - self.state["STAR"]),
+                              "OPC": self.opc_prefix, "OPC?": self.query_opc, "NUMG": self.number_of_groups,
+                              "AVERREST": lambda args: None, "FORM4": lambda args: None,
+                              "OUTPFORM": self.formatted_data})
+
+    def execute(self, cmd:str):
+        """ HP native OPC prefix - the command after OPC sets operation complete when it finishes """
+        opc_next, self.opc_next = self.opc_next, False
+        response = super().execute(cmd)
+        if opc_next:
+            self.set_opc()
+        return response
+
+    def opc_prefix(self, args:str=""):
+        self.opc_next = True
+
+    def set_center(self, args:str):
+        center = parse_number(args, FREQ_UNITS)
+        span = self.state["STOP"] - self.state["STAR"]
+        self.state["STAR"], self.state["STOP"] = center - span / 2, center + span / 2
+
+    def number_of_groups(self, args:str):
+        """ NUMG n - takes n sweeps then holds """
+        self.start_operation(self.latency.sweep_time * int(parse_number(args)))
+
+    def formatted_data(self, args:str=""):
+        """ OUTPFORM in FORM4 - one "value, 0" line per point, a flat DUT response at the DUT gain """
+        points = int(self.state["POIN"])
+        values = self.bench.dut_gain + self.bench.rng.normal(0, 0.01, points)
+        return "\n".join("{0}, {1}".format(HP_FLOAT.format(value), HP_FLOAT.format(0.0)) for value in values)
+
+
+# <model>: simulated instrument class, matches the driver SIM_MODEL attributes
+MODELS = {"8648": SimulatedSignalGenerator, "E36XX": SimulatedPowerSupply, "E4443": SimulatedSpectrumAnalyzer,
+          "8753ES": SimulatedNetworkAnalyzer}
+
+
+class SimulatedResource():
+    """ Message based resource with the subset of the pyvisa resource interface the drivers use
+        Counts messages and bytes in both directions, see stats
+    """
+
+    def __init__(self, resource_name:str, instrument:SimulatedInstrument, latency:LatencyModel):
+        self.resource_name = resource_name
+        self.instrument = instrument
+        self.latency = latency
+        self.timeout = 2000
+        self.read_termination = "\n"
+        self.write_termination = "\n"
+        self._output = b""
+        self.stats = {"writes": 0, "reads": 0, "bytes_written": 0, "bytes_read": 0}
+
+    def write(self, message:str):
+        """ Sends a program message, responses to any queries in it are queued for the next read """
+        data = (message + self.write_termination).encode()
+        self.stats["writes"] += 1
+        self.stats["bytes_written"] += len(data)
+        self.latency.message(len(data))
+        responses = []
+        for cmd in message.split(";"):
+            response = self.instrument.execute(cmd)
+            if response is not None:
+                responses.append(response if isinstance(response, bytes) else response.encode())
+        if responses:
+            self._output = b";".join(responses) + self.read_termination.encode()
+        return len(data)
+
+    def read_raw(self, size:int=None):
+        """ Returns queued response bytes up to and including the termination character like a
+            termchar enabled VISA read, <size> limits how many are returned
+        """
+        if not self._output:
+            self.latency.sleep(self.timeout / 1000)
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        end = self._output.find(self.read_termination.encode()) + 1 or len(self._output)
+        if size is not None:
+            end = min(end, size)
+        data, self._output = self._output[:end], self._output[end:]
+        self.stats["reads"] += 1
+        self.stats["bytes_read"] += len(data)
+        self.latency.transfer(len(data))
+        return data
+
+    def read_bytes(self, count:int, break_on_termchar:bool=False):
+        """ Returns exactly <count> queued bytes, termination characters included
+            <break_on_termchar> stops early after a termination character like pyvisa
+        """
+        if break_on_termchar:
+            count = min(count, self._output.find(self.read_termination.encode()) + 1 or count)
+        if not self._output or len(self._output) < count:
+            self.latency.sleep(self.timeout / 1000)
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        data, self._output = self._output[:count], self._output[count:]
+        self.stats["reads"] += 1
+        self.stats["bytes_read"] += len(data)
+        self.latency.transfer(len(data))
+        return data
+
+    def read(self):
+        return self.read_raw().decode().rstrip(self.read_termination)
+
+    def query(self, message:str):
+        self.write(message)
+        return self.read()
+
+    def read_stb(self):
+        self.latency.message(1)
+        return self.instrument.status_byte()
+
+    def install_handler(self, event_type, handler, user_handle=None):
+        self.instrument.srq_handler = lambda: handler(self, event_type, None, user_handle)
+
+    def enable_event(self, event_type, mechanism, context=None):
+        pass
+
+    def wait_on_event(self, event_type, timeout:int):
+        if not self.instrument.srq_event.wait(timeout / 1000):
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        self.instrument.srq_event.clear()
+
+    def clear(self):
+        self._output = b""
+
+    def close(self):
+        pass
+
+
+class SimulatedResourceManager():
+    """ Resource manager for the simulated bus - every GPIB0 primary address answers, and the instrument
+        behind an address is created on first open from the <model> the driver asks for
+    """
+
+    def __init__(self, latency:LatencyModel=None, bench:SimulatedBench=None):
+        self.latency = latency or LatencyModel()
+        self.bench = bench or BENCH
+        # <resource name>: SimulatedInstrument, kept so reopening a resource sees the same instrument
+        self.instruments = {}
+        self.resources = []
+
+    def add_instrument(self, resource_name:str, model:str=None):
+        """ Creates the <model> instrument at <resource_name> """
+        instrument = MODELS.get(model, SimulatedInstrument)(self.latency, self.bench)
+        self.instruments[resource_name] = instrument
+        return instrument
+
+    def list_resources(self, query:str="?*::INSTR"):
+        addresses = ["GPIB0::{0}::INSTR".format(address) for address in range(1, 31)]
+        return tuple(sorted(set(addresses) | set(self.instruments)))
+
+    def open_resource(self, resource_name:str, model:str=None, **kwargs):
+        """ Opens <resource_name>, creating a <model> instrument there if there isn't one yet """
+        instrument = self.instruments.get(resource_name)
+        if instrument is None:
+            instrument = self.add_instrument(resource_name, model)
+        resource = SimulatedResource(resource_name, instrument, self.latency)
+        for name, value in kwargs.items():
+            setattr(resource, name, value)
+        self.resources.append(resource)
+        return resource
+
+    def stats(self):
+        """ Returns the message/byte counters summed over every opened resource """
+        totals = {"writes": 0, "reads": 0, "bytes_written": 0, "bytes_read": 0}
+        for resource in self.resources:
+            for name, value in resource.stats.items():
+                totals[name] += value
+        return totals
+
+    def close(self):
+        pass
+
+
+class SimulatedSocketHandler(socketserver.StreamRequestHandler):
+    """ Serves one client connection of a SimulatedSocketServer, one program message per line """
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        resource = SimulatedResource(self.server.address, self.server.instrument, self.server.latency)
+        for line in self.rfile:
+            resource.write(line.decode().rstrip("\r\n"))
+            if resource._output:
+                self.wfile.write(resource._output)
+                resource._output = b""
+
+
+class SimulatedSocketServer(socketserver.ThreadingTCPServer):
+    """ Local TCP stand-in for a LAN instrument, answers raw SCPI for a simulated <model> like port 5025 would
+        <port> 0 picks a free port, see address. The default latency model only adds sweep time since the
+        socket itself is the transport being measured
+            server = SimulatedSocketServer("E4443").start()
+            sa = AgilentE4443.SpectrumAnalyzer(server.address, interface="TCPIP", backend="socket")
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, model:str=None, host:str="127.0.0.1", port:int=0, latency:LatencyModel=None,
+                 bench:SimulatedBench=None):
+        self.latency = latency or LatencyModel(command_latency=0.0, bytes_per_second=float("inf"))
+        self.instrument = MODELS.get(model, SimulatedInstrument)(self.latency, bench or BENCH)
+        self.thread = None
+        super().__init__((host, port), SimulatedSocketHandler)
+
+    @property
+    def address(self):
+        """ "host:port" the server listens on, usable as a socket backend device address """
+        return "{0}:{1}".format(*self.server_address)
+
+    def start(self):
+        """ Serves in a daemon thread, returns the server """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def install(latency:LatencyModel=None, bench:SimulatedBench=None):
+    """ Replaces the "sim" backend's resource manager with one using <latency>/<bench>, returns it """
+    import VisaHandler
+    resource_manager = SimulatedResourceManager(latency, bench)
+    VisaHandler.register_backend("sim", lambda: resource_manager)
+    return resource_manager
@@ -0,0 +1,197 @@
+# Raw SCPI over TCP (port 5025) without going through pyvisa.
+# LAN equipped instruments (E4443 with the LAN option, E36XX LAN bridges) accept SCPI on a plain socket, which
+# skips the VISA layer entirely. Select it per device:
+#   sa = SpectrumAnalyzer("10.0.0.5", interface="TCPIP", backend="socket")      # or "10.0.0.5:5025"
+# or for every device with VISA_BACKEND=socket.
+
+import socket
+
+import visa
+
+SCPI_PORT = 5025
+RECEIVE_SIZE = 65536
+
+
+def message_length(data, termination:bytes=b"\n"):
+    """ Returns the length of the first complete response message in <data> including its termination,
+        or None if more data is needed. Definite length blocks (#<n><length><data>) are skipped over whole,
+        since binary data can contain the termination character
+    """
+    position = 0
+    while True:
+        end = data.find(termination, position)
+        block = data.find(b"#", position)
+        if block >= 0 and (end < 0 or block < end) and (block == 0 or data[block - 1] in b",;"):
+            if len(data) < block + 2:
+                return None
+            if not data[block + 1:block + 2].isdigit():
+                position = block + 1
+                continue
+            digits = int(data[block + 1:block + 2])
+            if digits == 0:
+                # Indefinite length block, runs until the termination character
+                position = block + 2
+                continue
+            if len(data) < block + 2 + digits:
+                return None
+            position = block + 2 + digits + int(data[block + 2:block + 2 + digits])
+            if len(data) < position:
+                return None
+        elif end >= 0:
+            return end + len(termination)
+        else:
+            return None
+
+
+def parse_resource_name(resource_name:str):
+    """ Returns (host, port) of TCPIP0::<host>::<port>::SOCKET """
+    parts = resource_name.split("::")
+    if len(parts) < 3 or not parts[0].upper().startswith("TCPIP"):
+        raise visa.VisaIOError(visa.constants.StatusCode.error_resource_not_found)
+    return parts[1], int(parts[2]) if parts[2].isdigit() else SCPI_PORT
+
+
+class SocketResource():
+    """ Message based resource on a raw SCPI socket with the subset of the pyvisa interface the drivers use
+        Nagle is disabled so short commands go out immediately, and reads come from a local buffer
+    """
+
+    def __init__(self, resource_name:str, timeout:int=2000):
+        self.resource_name = resource_name
+        self.read_termination = "\n"
+        self.write_termination = "\n"
+        self._buffer = bytearray()
+        host, port = parse_resource_name(resource_name)
+        try:
+            self.socket = socket.create_connection((host, port), timeout / 1000)
+        except OSError as e:
+            print("Could not connect to {0}:{1} - {2}".format(host, port, e))
+            raise visa.VisaIOError(visa.constants.StatusCode.error_resource_not_found)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.timeout = timeout
+
+    @property
+    def timeout(self):
+        """ I/O timeout in ms like a VISA resource """
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout_ms):
+        self._timeout = timeout_ms
+        self.socket.settimeout(None if timeout_ms is None else timeout_ms / 1000)
+
+    def _receive(self):
+        """ Appends the next chunk from the socket to the read buffer """
+        try:
+            data = self.socket.recv(RECEIVE_SIZE)
+        except socket.timeout:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        except OSError:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_connection_lost)
+        if not data:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_connection_lost)
+        self._buffer += data
+
+    def _fill(self, size:int):
+        """ Receives until the buffer holds at least <size> bytes """
+        while len(self._buffer) < size:
+            self._receive()
+
+    def _message_end(self):
+        """ Returns the length of the first complete response message in the buffer, receiving as needed """
+        termination = self.read_termination.encode()
+        end = message_length(self._buffer, termination)
+        while end is None:
+            self._receive()
+            end = message_length(self._buffer, termination)
+        return end
+
+    def write(self, message:str):
+        data = (message + self.write_termination).encode()
+        try:
+            self.socket.sendall(data)
+        except socket.timeout:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        except OSError:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_connection_lost)
+        return len(data)
+
+    def read_raw(self, size:int=None):
+        """ Returns one complete response message including its termination character,
+            <size> limits how many bytes are returned - the rest stays buffered for the next read
+        """
+        end = self._message_end()
+        if size is not None:
+            end = min(end, size)
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return data
+
+    def read_bytes(self, count:int, break_on_termchar:bool=False):
+        """ Returns exactly <count> bytes, <break_on_termchar> stops early after a termination character """
+        if break_on_termchar:
+            termination = self.read_termination.encode()
+            while len(self._buffer) < count and termination not in self._buffer:
+                self._receive()
+            end = self._buffer.find(termination, 0, count)
+            if end >= 0:
+                count = end + len(termination)
+        self._fill(count)
+        data = bytes(self._buffer[:count])
+        del self._buffer[:count]
+        return data
+
+    def read(self):
+        return self.read_raw().decode().rstrip(self.read_termination)
+
+    def query(self, message:str):
+        self.write(message)
+        return self.read()
+
+    def read_stb(self):
+        """ There is no serial poll on a raw socket, *STB? returns the same byte (with MSS instead of RQS) """
+        return int(self.query("*STB?"))
+
+    def clear(self):
+        """ Discards buffered and pending input, the closest a raw socket gets to a device clear """
+        self._buffer = bytearray()
+        self.socket.setblocking(False)
+        try:
+            while self.socket.recv(RECEIVE_SIZE):
+                pass
+        except OSError:
+            pass
+        finally:
+            self.timeout = self._timeout
+
+    def close(self):
+        self.socket.close()
+
+
+class SocketResourceManager():
+    """ Resource manager for the "socket" backend, opens TCPIP0::<host>::<port>::SOCKET resources
+        There is nothing to scan on a network, so devices are found by building the name from their address
+    """
+
+    def __init__(self):
+        self.resources = {}
+
+    def resource_name(self, address, interface:str="TCPIP"):
+        """ Returns the resource name of <address>: "host" or "host:port" """
+        host, _, port = str(address).partition(":")
+        return "TCPIP0::{0}::{1}::SOCKET".format(host, port or SCPI_PORT)
+
+    def list_resources(self, query:str="?*::INSTR"):
+        return tuple(self.resources)
+
+    def open_resource(self, resource_name:str, timeout:int=2000, **kwargs):
+        resource = SocketResource(resource_name, timeout)
+        for name, value in kwargs.items():
+            setattr(resource, name, value)
+        self.resources[resource_name] = resource
+        return resource
+
+    def close(self):
+        for resource in self.resources.values():
+            resource.close()
+        self.resources = {}
@@ -1,39 +1,425 @@
 # This is the base controller for VISA based devices.
 # From here all subClasses of VISA devices will inhereit base functionality to increase productivity and add features
 
-import os, sys, visa
+import os, sys, re, json, importlib, threading, time, visa
+from contextlib import contextmanager
+import numpy as np
+from VisaInstrumentation import DeviceStats, InstrumentedResource
+from SessionRecorder import RecordingResource, get_session_recorder
+from BusScheduler import PRIORITY_NORMAL, ScheduledResource, get_bus_scheduler
 # import logging
 
-RM = visa.ResourceManager()
-AVAILABLE_RESOURCES = RM.list_resources()
+# Backend used to open devices unless one is given to Visa_Device:
+# "visa" talks to real hardware through pyvisa, "sim" uses the simulated instruments in SimulatedVisa,
+# "replay" serves a session recorded with VISA_RECORD back from VISA_REPLAY_FILE,
+# "socket" talks raw SCPI to LAN instruments on port 5025 without pyvisa (see SocketTransport),
+# "server" goes through a running InstrumentServer that owns the bus (VISA_SERVER selects the address)
+DEFAULT_BACKEND = os.environ.get("VISA_BACKEND", "visa")
+# <backend>: function returning a ResourceManager-like object (list_resources/open_resource)
+BACKENDS = {
+    "visa": visa.ResourceManager,
+    "sim": lambda: importlib.import_module("SimulatedVisa").SimulatedResourceManager(),
+    "replay": lambda: importlib.import_module("SessionRecorder").ReplayResourceManager(),
+    "socket": lambda: importlib.import_module("SocketTransport").SocketResourceManager(),
+    "server": lambda: importlib.import_module("InstrumentServer").ServerResourceManager(),
+}
+# Resource managers and the bus scan are created lazily on first use - see get_resource_manager/refresh_resources
+RESOURCE_MANAGERS = {}
+AVAILABLE_RESOURCES = ()
+# Maps (interface type, address) -> resource name, ex: ("GPIB", "19") -> "GPIB0::19::INSTR"
+RESOURCE_INDEX = {}
+# When set, the resource index is persisted here between runs
+RESOURCE_CACHE_FILE = os.environ.get("VISA_RESOURCE_CACHE", None)
+# VISA_STATS=1 instruments every device as it is opened, see Visa_Device.enable_instrumentation
+INSTRUMENT_DEVICES = os.environ.get("VISA_STATS", "0") not in ("", "0")
+# VISA_RECORD=<file> records the session of every device as it is opened, see Visa_Device.start_recording
+RECORD_FILE = os.environ.get("VISA_RECORD", None)
+# VISA_SCHEDULE=1 runs every device's bus transactions through its bus scheduler, see Visa_Device.enable_scheduling
+SCHEDULE_DEVICES = os.environ.get("VISA_SCHEDULE", "0") not in ("", "0")
+# Proxies Visa_Device can wrap around its resource
+RESOURCE_WRAPPERS = (InstrumentedResource, RecordingResource, ScheduledResource)
+
+def register_backend(name:str, factory):
+    """ Adds backend <name>, <factory>() returns its resource manager - replaces any open manager """
+    BACKENDS[name] = factory
+    RESOURCE_MANAGERS.pop(name, None)
+
+
+def get_resource_manager(backend:str=None):
+    """ Returns the shared resource manager of <backend> (defaults to DEFAULT_BACKEND), creating it on first use """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in RESOURCE_MANAGERS:
+        if backend not in BACKENDS:
+            raise ValueError("Unknown VISA backend: {0}, please use one of {1}".format(backend, list(BACKENDS)))
+        RESOURCE_MANAGERS[backend] = BACKENDS[backend]()
+    return RESOURCE_MANAGERS[backend]
+
+
+def resource_key(resource:str):
+    """ Returns the (interface type, address) index key of <resource>
+        ex: GPIB0::19::INSTR -> ("GPIB", "19"), TCPIP0::10.0.0.5::5025::SOCKET -> ("TCPIP", "10.0.0.5")
+    """
+    parts = resource.split("::")
+    interface = re.match(r"[A-Za-z]*", parts[0]).group(0).upper()
+    if len(parts) > 2:
+        address = parts[1]
+    else:
+        # ASRL1::INSTR style resources carry the address in the board number
+        address = parts[0][len(interface):]
+    return (interface, address)
+
+
+def refresh_resources(persist:bool=False):
+    """ Scans the bus and rebuilds RESOURCE_INDEX, <persist> saves the index to RESOURCE_CACHE_FILE """
+    global AVAILABLE_RESOURCES
+    AVAILABLE_RESOURCES = get_resource_manager("visa").list_resources()
+    RESOURCE_INDEX.clear()
+    for resource in AVAILABLE_RESOURCES:
+        RESOURCE_INDEX.setdefault(resource_key(resource), resource)
+    if persist:
+        save_resource_cache()
+    return RESOURCE_INDEX
+
+
+def save_resource_cache(path:str=None):
+    """ Writes RESOURCE_INDEX to <path> (defaults to RESOURCE_CACHE_FILE) """
+    path = path or RESOURCE_CACHE_FILE
+    if path is None:
+        print("No resource cache file set, index not saved")
+        return 1
+    with open(path, "w") as cache:
+        json.dump([[key[0], key[1], resource] for key, resource in RESOURCE_INDEX.items()], cache)
+    return 0
+
+
+def load_resource_cache(path:str=None):
+    """ Loads a previously saved index from <path> (defaults to RESOURCE_CACHE_FILE) into RESOURCE_INDEX """
+    path = path or RESOURCE_CACHE_FILE
+    if path is None or not os.path.exists(path):
+        return 1
+    try:
+        with open(path) as cache:
+            entries = json.load(cache)
+    except (OSError, ValueError):
+        print("Could not read resource cache: {0}".format(path))
+        return 1
+    for interface, address, resource in entries:
+        RESOURCE_INDEX[(interface, address)] = resource
+    return 0
+
+
+def find_resource(address, interface:str="GPIB", refresh:bool=False, backend:str=None):
+    """ Returns the resource name for <address> on <interface>, or None if it can't be found
+        Uses the cached index first and only scans the bus on a miss or when <refresh> is set
+    """
+    key = (interface.upper(), str(address))
+    if (backend or DEFAULT_BACKEND) != "visa":
+        resource_manager = get_resource_manager(backend)
+        if hasattr(resource_manager, "resource_name"):
+            # Backends that can't scan for devices (raw sockets) build the name straight from the address
+            return resource_manager.resource_name(address, interface)
+        # Non hardware backends are cheap to list so they aren't indexed
+        for resource in resource_manager.list_resources():
+            if resource_key(resource) == key:
+                return resource
+        return None
+    if not refresh and not RESOURCE_INDEX:
+        load_resource_cache()
+    if refresh or key not in RESOURCE_INDEX:
+        refresh_resources(persist=RESOURCE_CACHE_FILE is not None)
+    return RESOURCE_INDEX.get(key)
+
+
+# IEEE 488.2 status model bits
+ESR_OPC = 1     # Standard Event Status Register - operation complete
+STB_ESB = 32    # Status Byte - standard event status summary
+STB_MSS = 64    # Status Byte - master summary status / request for service
+
+# SCPI reserves 9.91E37 for not a number and +/-9.9E37 for +/-infinity (overload/underrange)
+SCPI_NAN = 9.91e37
+SCPI_INF = 9.9e37
+
+
+def _parse_token(token:str):
+    """ Slow path for parse_values - single token to float, anything non numeric becomes NaN """
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+
+def parse_values(response:str, dtype=np.float64):
+    """ Parses a multi-value ASCII response (comma and/or newline separated) into a numpy array
+        of <dtype> in one pass. SCPI NaN/overload markers are converted to nan/inf, integer
+        dtypes are only applied when every value is finite
+    """
+    text = response.strip().strip('"').replace("\n", ",")
+    if not text:
+        return np.empty(0, dtype=dtype)
+    tokens = text.split(",")
+    try:
+        values = np.array(tokens, dtype=np.float64)
+    except ValueError:
+        values = np.array([_parse_token(token) for token in tokens], dtype=np.float64)
+    overloads = np.abs(values) >= SCPI_INF
+    if overloads.any():
+        not_a_number = values == SCPI_NAN
+        values[overloads] = np.copysign(np.inf, values[overloads])
+        values[not_a_number] = np.nan
+    if np.dtype(dtype).kind in "iu":
+        if not np.isfinite(values).all():
+            print("Non finite values in response, returning float values")
+            return values
+    return values.astype(dtype, copy=False)
+
+
+def decode_block(block:bytes, dtype:str="f4", big_endian:bool=True):
+    """ Decodes the data bytes of a binary block into a native byte order numpy array of <dtype> """
+    byte_order = ">" if big_endian else "<"
+    values = np.frombuffer(block, dtype=np.dtype(dtype).newbyteorder(byte_order))
+    return values.astype(values.dtype.newbyteorder("="), copy=False)
+
+
+def split_blocks(raw:bytes, count:int=1):
+    """ Returns the data bytes of the first <count> definite length blocks in <raw> (compound responses separate
+        them with ";"), or None if they haven't all arrived yet. An indefinite length block (#0) runs to the end
+        of the message, so it can only be the last one
+    """
+    blocks = []
+    position = 0
+    while len(blocks) < count:
+        start = raw.find(b"#", position)
+        if start < 0 or len(raw) < start + 2:
+            return None
+        digits = int(raw[start + 1:start + 2])
+        if digits == 0:
+            if len(blocks) != count - 1:
+                raise ValueError("Indefinite length block before the last of {0} blocks".format(count))
+            blocks.append(raw[start + 2:].rstrip(b"\n"))
+            return blocks
+        if len(raw) < start + 2 + digits:
+            return None
+        length = int(raw[start + 2:start + 2 + digits])
+        data_start = start + 2 + digits
+        if len(raw) < data_start + length:
+            return None
+        blocks.append(raw[data_start:data_start + length])
+        position = data_start + length
+    return blocks
+
+
+class PendingResponse():
+    """ Placeholder returned by Visa_Device.query inside a batch, <value> is set when the batch is sent
+        Reading <value> before that raises RuntimeError
+    """
+
+    def __init__(self, cmd:str):
+        self.cmd = cmd
+        self._value = None
+        self.sent = False
+
+    @property
+    def value(self):
+        if not self.sent:
+            raise RuntimeError("Response to {0} read before its batch was sent, it is only available once the "
+                               "outermost batch exits".format(self.cmd))
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self.sent = True
+
+    def __repr__(self):
+        return "PendingResponse({0!r}, value={1!r})".format(self.cmd, self._value)
+
+
+class BatchStatus():
+    """ Yielded by Visa_Device.batch, <status> is set when the outermost batch is sent:
+        0 if everything was sent, 1 if sending failed - None until then
+    """
+
+    def __init__(self):
+        self.status = None
+
+    def __repr__(self):
+        return "BatchStatus(status={0!r})".format(self.status)
 
 
 class Visa_Device():
     """ Base class for VISA device communications """
 
-    def __init__(self, gpib_address):
-        """ Creates the initial connection and checks settings before proceeding """
-        global RM, AVAILABLE_RESOURCES
-        self.FREQ_PREFIXES = {"ghz": 1e9, "mhz": 1e6, "khz": 1e3, "hz": 1e0}
-        resource = None
+    # Commands that return the instrument to a default state and clear the state cache
+    STATE_RESETS = ("*RST", "*RCL", "SYST:PRES", "PRES")
+    # <header>: headers that change on the instrument when <header> is written, subclasses extend this
+    STATE_COUPLING = {}
+    # Prefix that returns a batched SCPI command to the root of the command tree, "" for non-SCPI devices
+    COMPOUND_ROOT = ":"
+    # Message that sets the operation complete event once <cmd> finishes, see start_operation
+    OPC_COMMAND = "{0};*OPC"
+    # Instrument model used by the "sim" backend, see SimulatedVisa.MODELS
+    SIM_MODEL = None
+    # Default bus priority once scheduling is enabled, see BusScheduler
+    BUS_PRIORITY = PRIORITY_NORMAL
 
-        for resource in AVAILABLE_RESOURCES:
-            if "::{gpib_address}::".format(gpib_address=gpib_address) in resource:
-                self.resource = resource
-                break
-        if resource is None:
+    def __init__(self, gpib_address, interface:str="GPIB", state_cache:bool=False, backend:str=None):
+        """ Creates the initial connection and checks settings before proceeding
+            <state_cache> enables skipping writes that would not change a setting, see write
+            <backend> selects how the device is opened, defaults to DEFAULT_BACKEND (VISA_BACKEND)
+        """
+        self.FREQ_PREFIXES = {"ghz": 1e9, "mhz": 1e6, "khz": 1e3, "hz": 1e0}
+        self.backend = backend or DEFAULT_BACKEND
+        self.state_cache = state_cache
+        self._state = {}
+        # Per thread batch state, so another thread's commands never end up in an open batch
+        self._local = threading.local()
+        # Held by callers that need several commands to run without another thread interleaving
+        self.lock = threading.RLock()
+        # Completion event and callback of the operation started by start_operation
+        self._operation = None
+        # None until enable_srq_events has checked whether the backend supports service request events
+        self._srq_enabled = None
+        # Per command counters, only collected once enable_instrumentation is called
+        self.stats = None
+        # Bus scheduler, only used once enable_scheduling is called
+        self.scheduler = None
+        self.device = None
+        self.resource = find_resource(gpib_address, interface, backend=self.backend)
+        if self.resource is None:
             # TODO: Logging will be added later
             # logger.warning("Resource not found, please check connections and try again")
             print("Resource not found, please check connections and try again")
         else:
-            self.device = RM.open_resource(self.resource)
-            self.get_idn()
+            self.open(gpib_address, interface)
+
+    def open(self, gpib_address, interface:str="GPIB"):
+        """ Opens self.resource, a stale cached resource triggers one rescan and retry """
+        resource_manager = get_resource_manager(self.backend)
+        # The simulator needs to know which instrument to emulate, an instrument server may be running it
+        options = {"model": self.SIM_MODEL} if self.backend in ("sim", "server") else {}
+        try:
+            self.device = resource_manager.open_resource(self.resource, **options)
+        except visa.VisaIOError:
+            self.resource = find_resource(gpib_address, interface, refresh=True, backend=self.backend)
+            if self.resource is None:
+                print("Resource not found, please check connections and try again")
+                return 1
+            self.device = resource_manager.open_resource(self.resource, **options)
+        if RECORD_FILE:
+            self.start_recording(get_session_recorder(RECORD_FILE))
+        if INSTRUMENT_DEVICES:
+            self.enable_instrumentation()
+        if SCHEDULE_DEVICES:
+            self.enable_scheduling()
+        self.get_idn()
+        return 0
+
+    def enable_instrumentation(self):
+        """ Starts recording latency, byte counts, errors and timeouts per command mnemonic
+            The device resource is wrapped, so there is no cost at all while instrumentation is off
+        """
+        if self.stats is None:
+            self.stats = DeviceStats(self.resource)
+        if not isinstance(self.device, InstrumentedResource):
+            self.device = InstrumentedResource(self.device, self.stats)
+        return 0
+
+    def disable_instrumentation(self):
+        """ Stops recording, the counters collected so far are kept in self.stats """
+        return self._unwrap_resource(InstrumentedResource)
+
+    def start_recording(self, recorder):
+        """ Logs every command, response and timing of this device to <recorder> (a SessionRecorder.SessionRecorder)
+            Recordings can be served back to the drivers with the "replay" backend
+        """
+        if self._unwrap_resource(RecordingResource) == 0:
+            print("{0} was already recording, switching recorder".format(self.resource))
+        # The recorder sits closest to the resource so the other wrappers don't count in the recorded timing
+        wrappers = []
+        while isinstance(self.device, (InstrumentedResource, ScheduledResource)):
+            wrappers.append(self.device)
+            self.device = self.device.resource
+        self.device = RecordingResource(self.device, recorder, self.resource)
+        for wrapper in reversed(wrappers):
+            wrapper.__dict__["resource"] = self.device
+            self.device = wrapper
+        return 0
+
+    def stop_recording(self):
+        """ Stops logging this device, the recorder itself is left open for other devices """
+        return self._unwrap_resource(RecordingResource)
+
+    def _unwrap_resource(self, wrapper_class):
+        """ Removes the <wrapper_class> proxy from the wrappers around self.device, 1 if it isn't there """
+        outer = None
+        current = self.device
+        while not isinstance(current, wrapper_class):
+            if not isinstance(current, RESOURCE_WRAPPERS):
+                return 1
+            outer = current
+            current = current.resource
+        if outer is None:
+            self.device = current.resource
+        else:
+            outer.__dict__["resource"] = current.resource
+        return 0
+
+    def get_stats(self):
+        """ Returns a snapshot dict of the per command counters, empty if never instrumented """
+        if self.stats is None:
+            return {}
+        return self.stats.snapshot()
+
+    def enable_scheduling(self, priority:int=None, scheduler=None):
+        """ Runs every bus transaction of this device through <scheduler> (defaults to the shared scheduler of
+            its bus) at <priority> (defaults to BUS_PRIORITY), binary blocks are then read in chunks
+        """
+        if self.scheduler is not None:
+            self._unwrap_resource(ScheduledResource)
+        self.scheduler = scheduler or get_bus_scheduler(self.resource)
+        self.device = ScheduledResource(self.device, self.scheduler, self.BUS_PRIORITY if priority is None
+                                        else priority)
+        return 0
+
+    def disable_scheduling(self):
+        """ Stops scheduling, the bus utilization collected so far stays with the scheduler """
+        self.scheduler = None
+        return self._unwrap_resource(ScheduledResource)
+
+    @contextmanager
+    def bus_priority(self, priority:int):
+        """ Runs the enclosed I/O of this thread at bus <priority> (BusScheduler.PRIORITY_*), no effect unless
+            scheduling is enabled
+        """
+        if self.scheduler is None:
+            yield
+            return
+        with self.device.bus_priority(priority):
+            yield
+
+    def get_bus_report(self):
+        """ Returns the utilization report of this device's bus, empty if it isn't scheduled """
+        if self.scheduler is None:
+            return {}
+        return self.scheduler.report()
 
     def query(self, cmd):
-        """ Creates the query command for the device """
+        """ Creates the query command for the device, inside a batch a PendingResponse is returned """
+        cmd = "{0}".format(cmd)
+        if self._batch is not None:
+            pending = PendingResponse(cmd)
+            self._batch.append((cmd, pending))
+            return pending
+        return self._query(cmd)
+
+    def _query(self, cmd:str):
+        """ Sends query <cmd> straight to the device """
         try:
-            return self.device.query("{0}".format(cmd)).strip("\n")
+            # The lock keeps another thread's command from landing between the write and the read
+            with self.lock:
+                return self.device.query(cmd).strip("\n")
         except visa.VisaIOError as e:
+            self.invalidate()
             # logger.warning("Error trying to query: {0}".format(cmd))
             # logger.warning("VisaIOError: {0}".format(e))
             print("Error trying to query: {0}".format(cmd))
@@ -41,25 +427,262 @@ class Visa_Device():
             return 1
 
     def write(self, cmd):
-        """ Creates the write command for the device """
+        """ Creates the write command for the device
+            With state_cache enabled a setting written with the value it already has is skipped
+        """
+        cmd = "{0}".format(cmd)
+        if self.state_cache and self._is_unchanged(cmd):
+            return 0
+        if self._batch is not None:
+            self._batch.append((cmd, None))
+            return 0
+        return self._write(cmd)
+
+    def _write(self, cmd:str):
+        """ Sends <cmd> straight to the device """
         try:
-            self.device.write("{0}".format(cmd))
+            # A write while another thread waits on a response would interrupt that query (IEEE 488.2)
+            with self.lock:
+                self.device.write(cmd)
             return 0
         except visa.VisaIOError as e:
+            self.invalidate()
             # logger.warning("Error trying to write: {0}".format(cmd))
             # logger.warning("VisaIOError: {0}".format(e))
             print("Error trying to write: {0}".format(cmd))
             print("VisaIOError: {0}".format(e))
             return 1
 
+    def _is_unchanged(self, cmd:str):
+        """ Returns True if <cmd> sets a setting to its cached value, otherwise records the new value """
+        if ";" in cmd:
+            # Compound messages aren't tracked, anything in them could have changed
+            self.invalidate()
+            return False
+        header, _, value = cmd.strip().partition(" ")
+        header = header.lstrip(":").upper()
+        if header.endswith("?"):
+            return False
+        if header in self.STATE_RESETS:
+            self.invalidate()
+            return False
+        value = value.strip()
+        if not value:
+            # Commands without a value are actions (*WAI, INIT:IMM...), always sent
+            return False
+        if self._state.get(header) == value:
+            return True
+        for coupled in self.STATE_COUPLING.get(header, ()):
+            self._state.pop(coupled, None)
+        self._state[header] = value
+        return False
+
+    def invalidate(self, header:str=None):
+        """ Clears the state cache for <header>, or all settings if None """
+        if header is None:
+            self._state.clear()
+        else:
+            self._state.pop(header.lstrip(":").upper(), None)
+
+    def _check_no_batch(self, name:str):
+        """ Raises RuntimeError if the calling thread has a batch open, for calls that need their response right
+            away or go to the bus directly, which would send them ahead of the batched commands
+        """
+        if self._batch is not None:
+            raise RuntimeError("{0} can't be used inside a batch".format(name))
+
+    @property
+    def _batch(self):
+        """ Commands queued by the batch the calling thread has open, None outside a batch """
+        return getattr(self._local, "batch", None)
+
+    @_batch.setter
+    def _batch(self, commands):
+        self._local.batch = commands
+
+    @contextmanager
+    def batch(self):
+        """ Joins the writes and queries made inside the with block into one program message
+            Queries return a PendingResponse whose value is filled in when the block exits, ex:
+                with device.batch() as batch:
+                    device.write("FREQ:START 1e9")
+                    span = device.query("FREQ:SPAN?")
+                batch.status, span.value
+            Writes inside a batch return 0, whether the batch was sent is in the yielded BatchStatus
+            Nested batches join the outer batch, responses are only available once the outermost batch exits
+            Calls that need a response right away (get_num, query_values, binary block queries, wait_for_complete...)
+            raise RuntimeError inside a batch
+            A batch only collects the commands of the thread that opened it
+        """
+        if self._batch is not None:
+            yield self._local.batch_status
+            return
+        self._batch = []
+        self._local.batch_status = BatchStatus()
+        try:
+            yield self._local.batch_status
+        except Exception:
+            # Nothing was sent, but the state cache assumed it was
+            self._batch = None
+            self.invalidate()
+            raise
+        commands, self._batch = self._batch, None
+        self._local.batch_status.status = self._send_batch(commands)
+
+    def _join_commands(self, cmds:list):
+        """ Joins <cmds> into one program message, common (*) commands don't take the root prefix """
+        message = cmds[0]
+        for cmd in cmds[1:]:
+            if cmd.startswith(("*", ":")):
+                message += ";" + cmd
+            else:
+                message += ";" + self.COMPOUND_ROOT + cmd
+        return message
+
+    def _send_batch(self, commands:list):
+        """ Sends the batched <commands> and hands each reply back to its PendingResponse """
+        if not commands:
+            return 0
+        message = self._join_commands([cmd for cmd, _ in commands])
+        pending = [response for _, response in commands if response is not None]
+        if not pending:
+            return self._write(message)
+        reply = self._query(message)
+        if reply == 1:
+            replies = [1] * len(pending)
+        else:
+            replies = [value.strip() for value in reply.split(";")]
+            if len(replies) != len(pending):
+                print("Expected {0} responses, received {1}: {2}".format(len(pending), len(replies), reply))
+                replies = [1] * len(pending)
+        for response, value in zip(pending, replies):
+            response.value = value
+        return 1 if reply == 1 else 0
+
+    def query_many(self, cmds:list):
+        """ Sends <cmds> queries in one program message and returns the list of responses
+            Must not be called inside a batch
+        """
+        self._check_no_batch("query_many")
+        with self.batch():
+            pending = [self.query(cmd) for cmd in cmds]
+        return [response.value for response in pending]
+
     def read(self):
         """ Reads from the buffer, if there is nothing it will return 0 """
+        self._check_no_batch("read")
         try:
-            return self.device.read()
+            with self.lock:
+                return self.device.read()
         except visa.VisaIOError:
             # Not worth logging anything as this could happen often
             return 0
 
+    def read_block(self):
+        """ Reads an IEEE 488.2 definite length block (#<n><length><data>) and returns the data bytes,
+            keeps reading until the full block has arrived since binary data can contain the termination char
+        """
+        blocks = self.read_blocks(1)
+        if blocks == 1:
+            return 1
+        return blocks[0]
+
+    def read_blocks(self, count:int=1):
+        """ Reads the response to a compound binary query, <count> definite length blocks separated by ";",
+            and returns the list of their data bytes
+        """
+        self._check_no_batch("read_blocks")
+        chunk_size = self._chunk_size()
+        if chunk_size:
+            return self._read_block_chunks(count, chunk_size)
+        try:
+            raw = self.device.read_raw()
+            blocks = split_blocks(raw, count)
+            while blocks is None:
+                raw += self.device.read_raw()
+                blocks = split_blocks(raw, count)
+            return blocks
+        except (visa.VisaIOError, ValueError) as e:
+            self.invalidate()
+            print("Error trying to read binary block")
+            print("Error: {0}".format(e))
+            return 1
+
+    def _chunk_size(self):
+        """ Bytes per bus transaction for long reads of a scheduled device, None when reads aren't chunked """
+        if self.scheduler is None:
+            return None
+        return getattr(self.device, "block_chunk_size", None)
+
+    def _read_message_chunks(self, chunk_size:int):
+        """ Reads one response message <chunk_size> bytes per bus transaction, see _read_block_chunks """
+        # pyvisa leaves read_termination None unless it is set, END still ends the message then
+        termination = (getattr(self.device, "read_termination", None) or "\n").encode()
+        chunks = []
+        while True:
+            chunk = self.device.read_bytes(chunk_size, break_on_termchar=True)
+            chunks.append(chunk)
+            # A short chunk ended on END or the termination character
+            if len(chunk) < chunk_size or chunk.endswith(termination):
+                return b"".join(chunks)
+
+    def _read_block_chunks(self, count:int, chunk_size:int):
+        """ read_blocks for scheduled devices, the data is read <chunk_size> bytes per bus transaction so
+            higher priority commands to other devices can go in between
+        """
+        try:
+            blocks = []
+            for _ in range(count):
+                while self.device.read_bytes(1) != b"#":
+                    # Skip anything in front of the block header, including the ";" between blocks
+                    pass
+                digits = int(self.device.read_bytes(1))
+                if digits == 0:
+                    blocks.append(self.device.read_raw().rstrip(b"\n"))
+                    return blocks
+                length = int(self.device.read_bytes(digits))
+                chunks = []
+                remaining = length
+                while remaining:
+                    chunk = self.device.read_bytes(min(chunk_size, remaining))
+                    chunks.append(chunk)
+                    remaining -= len(chunk)
+                blocks.append(b"".join(chunks))
+            # Termination character after the last block
+            self.device.read_raw()
+            return blocks
+        except (visa.VisaIOError, ValueError) as e:
+            self.invalidate()
+            print("Error trying to read binary block")
+            print("Error: {0}".format(e))
+            return 1
+
+    def query_binary(self, cmd, dtype:str="f4", big_endian:bool=True):
+        """ Sends <cmd> and decodes the binary block response into a numpy array of <dtype>
+            <big_endian> True matches the SCPI NORMal byte order, False matches SWAPped
+        """
+        self._check_no_batch("query_binary")
+        with self.lock:
+            if self._write(cmd):
+                return 1
+            block = self.read_block()
+        if block == 1:
+            return 1
+        return decode_block(block, dtype, big_endian)
+
+    def query_binary_many(self, cmds:list, dtype:str="f4", big_endian:bool=True):
+        """ Sends the binary queries <cmds> as one program message and returns a list of numpy arrays,
+            one per query - see query_binary
+        """
+        self._check_no_batch("query_binary_many")
+        with self.lock:
+            if self._write(self._join_commands(cmds)):
+                return 1
+            blocks = self.read_blocks(len(cmds))
+        if blocks == 1:
+            return 1
+        return [decode_block(block, dtype, big_endian) for block in blocks]
+
     def flush_buffer(self):
         """ While read returns non-zero values, it continues to read until its empty in order to
             ensure you are read the most up to date response - useful with write and separate read commands
@@ -88,6 +711,146 @@ class Visa_Device():
         """ Waits for all pending operations to complete before moving forward """
         return self.write("*WAI")
 
+    @contextmanager
+    def io_timeout(self, timeout_ms:int=None):
+        """ Temporarily sets the I/O timeout to <timeout_ms> for long operations, None leaves it as is """
+        if timeout_ms is None or self.device is None:
+            yield self
+            return
+        previous = self.device.timeout
+        self.device.timeout = timeout_ms
+        try:
+            yield self
+        finally:
+            self.device.timeout = previous
+
+    def wait_for_complete(self, cmd:str=None, timeout_ms:int=None):
+        """ Sends <cmd> followed by *OPC? and blocks until the operation completes or <timeout_ms>
+            Returns 0 when complete, 1 on timeout/error
+        """
+        self._check_no_batch("wait_for_complete")
+        message = "*OPC?" if cmd is None else "{0};*OPC?".format(cmd)
+        with self.io_timeout(timeout_ms):
+            complete = self.query(message)
+        if complete != 1 and complete.strip().lstrip("+") == "1":
+            return 0
+        return 1
+
+    def poll_for_complete(self, cmd:str, timeout_ms:int=None, poll_interval:float=0.05):
+        """ Sends <cmd> followed by *OPC and serial polls from the calling thread until it completes or <timeout_ms>
+            (defaults to the I/O timeout), returns 0 when complete, 1 on timeout/error
+            Unlike wait_for_complete the bus is free between polls, so other devices on a scheduled bus get it
+        """
+        self._check_no_batch("poll_for_complete")
+        if timeout_ms is None:
+            timeout_ms = self.device.timeout
+        # Status setup isn't a tracked setting, so it bypasses the state cache
+        setup_fail = self._write("*CLS;*ESE {0};*SRE {1}".format(ESR_OPC, STB_ESB))
+        if setup_fail or self._write(self.OPC_COMMAND.format(cmd)):
+            return 1
+        deadline = time.perf_counter() + timeout_ms / 1000
+        while not self.get_status_byte() & STB_ESB:
+            if time.perf_counter() >= deadline:
+                return 1
+            time.sleep(poll_interval)
+        return 0
+
+    def set_event_status_enable(self, mask:int=ESR_OPC):
+        """ Sets the Standard Event Status Enable register - *ESE """
+        return self.write("*ESE {0}".format(int(mask)))
+
+    def set_service_request_enable(self, mask:int=STB_ESB):
+        """ Sets the Service Request Enable register - *SRE """
+        return self.write("*SRE {0}".format(int(mask)))
+
+    def get_status_byte(self, serial_poll:bool=True):
+        """ Returns the status byte, by serial poll by default since it works while the device is busy,
+            otherwise with *STB?
+        """
+        if not serial_poll:
+            return int(self.get_num(self.query("*STB?")))
+        try:
+            # Backends without a serial poll (raw sockets) read the status byte in-band with *STB?, which
+            # can't go between another thread's query and its reply
+            with self.lock:
+                return self.device.read_stb()
+        except visa.VisaIOError as e:
+            print("Error trying to serial poll")
+            print("VisaIOError: {0}".format(e))
+            return 0
+
+    def get_event_status(self):
+        """ Reads and clears the Standard Event Status Register - *ESR? """
+        return int(self.get_num(self.query("*ESR?")))
+
+    def enable_srq_events(self):
+        """ Installs a VISA service request handler for the device, returns 0 if events are available """
+        if self._srq_enabled is not None:
+            return 0 if self._srq_enabled else 1
+        try:
+            self.device.install_handler(visa.constants.EventType.service_request, self._on_srq)
+            self.device.enable_event(visa.constants.EventType.service_request,
+                                     visa.constants.EventMechanism.handler)
+        except (visa.VisaIOError, AttributeError, NotImplementedError) as e:
+            print("Service request events not available, using serial poll: {0}".format(e))
+            self._srq_enabled = False
+            return 1
+        self._srq_enabled = True
+        return 0
+
+    def _on_srq(self, *args):
+        """ VISA service request handler, completes the pending operation when the device requests service """
+        status = self.get_status_byte()
+        if status & STB_MSS:
+            self._complete_operation()
+        return visa.constants.StatusCode.success
+
+    def _complete_operation(self):
+        """ Marks the pending operation complete and calls its callback """
+        operation, self._operation = self._operation, None
+        if operation is None:
+            return
+        event, callback = operation
+        event.set()
+        if callback is not None:
+            callback(self)
+
+    def _poll_operation(self, event:threading.Event, poll_interval:float):
+        """ Serial polls until the pending operation completes, used when SRQ events are not available """
+        while self._operation is not None and self._operation[0] is event:
+            if self.get_status_byte() & STB_ESB:
+                self._complete_operation()
+                return
+            event.wait(poll_interval)
+
+    def start_operation(self, cmd:str, callback=None, poll_interval:float=0.05):
+        """ Starts <cmd> and returns without waiting, the device requests service when it completes
+            Returns a threading.Event that is set on completion, <callback>(device) is also called then
+            Falls back to serial polling on a background thread when SRQ events are not available
+        """
+        self._check_no_batch("start_operation")
+        event = threading.Event()
+        self._operation = (event, callback)
+        use_srq = self.enable_srq_events() == 0
+        # Status setup isn't a tracked setting, so it bypasses the state cache
+        setup_fail = self._write("*CLS;*ESE {0};*SRE {1}".format(ESR_OPC, STB_ESB))
+        fail = setup_fail or self._write(self.OPC_COMMAND.format(cmd))
+        if fail:
+            self._operation = None
+            return None
+        if not use_srq:
+            threading.Thread(target=self._poll_operation, args=(event, poll_interval), daemon=True).start()
+        return event
+
+    def wait_for_srq(self, timeout_ms:int):
+        """ Blocks until the device requests service or <timeout_ms>, returns 0 on service request """
+        try:
+            self.device.wait_on_event(visa.constants.EventType.service_request, timeout_ms)
+        except visa.VisaIOError:
+            return 1
+        self._complete_operation()
+        return 0
+
     def close(self):
         """ Closes the device connection """
         self.device.close()
@@ -112,12 +875,45 @@ class Visa_Device():
 
     def get_num(self, num:str):
         """ Returns the <(int, float)> of freq value """
+        if isinstance(num, PendingResponse):
+            raise RuntimeError("Response to {0} can't be parsed inside a batch, use its value after the batch "
+                               "exits".format(num.cmd))
         try:
             return float(num)
         except ValueError:
             print("Could not return numeric type for {0}".format(num))
             return num
 
+    def get_nums(self, response:str, dtype=np.float64):
+        """ Returns a numpy array of <dtype> for a comma separated response, see parse_values """
+        if isinstance(response, PendingResponse):
+            raise RuntimeError("Response to {0} can't be parsed inside a batch, use its value after the batch "
+                               "exits".format(response.cmd))
+        if not isinstance(response, str):
+            print("Could not return numeric values for {0}".format(response))
+            return 1
+        return parse_values(response, dtype)
+
+    def query_values(self, cmd, dtype=np.float64):
+        """ Queries <cmd> and parses a multi-value response into a numpy array of <dtype>
+            On a scheduled device the response is read in chunks like binary blocks, since it can be a whole trace
+        """
+        self._check_no_batch("query_values")
+        chunk_size = self._chunk_size()
+        if not chunk_size:
+            return self.get_nums(self.query(cmd), dtype)
+        with self.lock:
+            if self._write(cmd):
+                return 1
+            try:
+                response = self._read_message_chunks(chunk_size).decode()
+            except visa.VisaIOError as e:
+                self.invalidate()
+                print("Error trying to read: {0}".format(cmd))
+                print("VisaIOError: {0}".format(e))
+                return 1
+        return self.get_nums(response.strip(), dtype)
+
     def _conversion(self, conv):
         """ This is a base convsersion routine that takes bool/str (on/off) and returns int(0/1) """
         if isinstance(conv, int):
@@ -0,0 +1,149 @@
+# Per-command latency, byte and error counters for VISA devices.
+# Visa_Device.enable_instrumentation wraps the device resource in an InstrumentedResource, so an
+# uninstrumented device has no extra code in its I/O path at all.
+
+import threading
+import time
+
+import visa
+
+# Latency histogram bucket upper bounds in seconds, the last bucket catches everything slower
+LATENCY_BUCKETS = (1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0,
+                   float("inf"))
+
+
+def command_mnemonic(message:str):
+    """ Returns the command headers of <message> without arguments, ex: "TRAC:DATA? TRACE1" -> "TRAC:DATA?" """
+    headers = [cmd.strip().split(" ", 1)[0].lstrip(":").upper() for cmd in message.split(";")]
+    return ";".join(header for header in headers if header)
+
+
+def bucket_label(bound:float):
+    """ Returns the histogram label of a bucket bound, ex: 0.002 -> "<=2ms" """
+    if bound == float("inf"):
+        return ">{0:g}s".format(LATENCY_BUCKETS[-2])
+    if bound < 1:
+        return "<={0:g}ms".format(bound * 1000)
+    return "<={0:g}s".format(bound)
+
+
+class CommandStats():
+    """ Counters and latency histogram for one command mnemonic """
+
+    __slots__ = ("calls", "errors", "timeouts", "bytes_out", "bytes_in", "total_time", "max_time", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, elapsed:float, bytes_out:int=0, bytes_in:int=0):
+        """ Records one I/O call """
+        self.calls += 1
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self.histogram[index] += 1
+                break
+
+    def snapshot(self):
+        """ Returns the counters as a dict """
+        return {"calls": self.calls, "errors": self.errors, "timeouts": self.timeouts, "bytes_out": self.bytes_out,
+                "bytes_in": self.bytes_in, "total_time": self.total_time, "max_time": self.max_time,
+                "mean_time": self.total_time / self.calls if self.calls else 0.0,
+                "histogram": {bucket_label(bound): count for bound, count in zip(LATENCY_BUCKETS, self.histogram)
+                              if count}}
+
+
+class DeviceStats():
+    """ CommandStats per mnemonic for one device """
+
+    def __init__(self, resource_name:str=None):
+        self.resource_name = resource_name
+        self.commands = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, mnemonic:str, elapsed:float, bytes_out:int=0, bytes_in:int=0, error:Exception=None):
+        """ Adds one I/O call of <mnemonic>, <error> is the VisaIOError it raised if any """
+        with self.lock:
+            stats = self.commands.get(mnemonic)
+            if stats is None:
+                stats = self.commands[mnemonic] = CommandStats()
+            stats.add(elapsed, bytes_out, bytes_in)
+            if error is not None:
+                stats.errors += 1
+                if getattr(error, "error_code", None) == visa.constants.StatusCode.error_timeout:
+                    stats.timeouts += 1
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """ Returns {"resource", "since", "totals", "commands": {mnemonic: counters}} """
+        with self.lock:
+            commands = {mnemonic: stats.snapshot() for mnemonic, stats in self.commands.items()}
+        totals = {name: sum(command[name] for command in commands.values())
+                  for name in ("calls", "errors", "timeouts", "bytes_out", "bytes_in", "total_time")}
+        return {"resource": self.resource_name, "since": self.started, "totals": totals, "commands": commands}
+
+
+class InstrumentedResource():
+    """ Proxy around a VISA resource that records every write/read/query in a DeviceStats
+        Reads are recorded under the mnemonic of the last write, since they fetch its response
+    """
+
+    def __init__(self, resource, stats:DeviceStats):
+        self.__dict__["resource"] = resource
+        self.__dict__["stats"] = stats
+        self.__dict__["last_mnemonic"] = "READ"
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def __setattr__(self, name, value):
+        # timeout and other resource attributes live on the wrapped resource
+        setattr(self.resource, name, value)
+
+    def _call(self, mnemonic:str, func, args:tuple, bytes_out:int):
+        start = time.perf_counter()
+        try:
+            response = func(*args)
+        except visa.VisaIOError as e:
+            self.stats.record(mnemonic, time.perf_counter() - start, bytes_out, 0, e)
+            raise
+        bytes_in = len(response) if isinstance(response, (str, bytes)) else 0
+        self.stats.record(mnemonic, time.perf_counter() - start, bytes_out, bytes_in)
+        return response
+
+    def write(self, message:str):
+        mnemonic = command_mnemonic(message)
+        self.__dict__["last_mnemonic"] = mnemonic
+        return self._call(mnemonic, self.resource.write, (message,), len(message) + 1)
+
+    def query(self, message:str):
+        mnemonic = command_mnemonic(message)
+        self.__dict__["last_mnemonic"] = mnemonic
+        return self._call(mnemonic, self.resource.query, (message,), len(message) + 1)
+
+    def read(self):
+        return self._call(self.last_mnemonic, self.resource.read, (), 0)
+
+    def read_raw(self, *args):
+        return self._call(self.last_mnemonic, self.resource.read_raw, args, 0)
+
+    def read_bytes(self, count:int, **kwargs):
+        return self._call(self.last_mnemonic, lambda count: self.resource.read_bytes(count, **kwargs), (count,), 0)
+
+    def read_stb(self):
+        return self._call("*STB (serial poll)", self.resource.read_stb, (), 0)
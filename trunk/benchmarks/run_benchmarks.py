@@ -0,0 +1,195 @@
+# Throughput benchmarks for the drivers and the OIP3 test loop, run against the simulated backend.
+# Run from trunk:
+#   python3 -m benchmarks.run_benchmarks [--output DIR] [--compare FILE]
+# Results are saved as json and compared with the previous run in the output directory.
+
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+TRUNK = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TRUNK not in sys.path:
+    sys.path.insert(0, TRUNK)
+
+import SimulatedVisa
+import VisaHandler
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+TRACE_SIZES = [101, 601, 8192]
+IMPORT_MODULES = ["VisaHandler", "Agilent8648", "AgilentE36XX", "AgilentE4443", "Agilent8753ES", "LimiterTest"]
+
+
+def best_time(func, repeat:int=20):
+    """ Returns the best wall time of <repeat> calls to <func> in seconds """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_parse():
+    """ Parse/decode time per trace size: legacy per point loop, parse_values, and binary blocks """
+    results = {}
+    for points in TRACE_SIZES:
+        trace = np.random.default_rng(0).normal(-80, 5, points)
+        text = ",".join(SimulatedVisa.SCPI_FLOAT.format(value) for value in trace)
+        real32 = trace.astype(">f4").tobytes()
+        int32 = (trace * 1000).astype("<i4").tobytes()
+        results[str(points)] = {
+            "ascii_bytes": len(text),
+            "real32_bytes": len(real32),
+            "ascii_loop_s": best_time(lambda: [float(value) for value in text.split(",")]),
+            "ascii_parse_values_s": best_time(lambda: VisaHandler.parse_values(text)),
+            "real32_decode_s": best_time(lambda: VisaHandler.decode_block(real32, "f4", True)),
+            "int32_decode_s": best_time(lambda: VisaHandler.decode_block(int32, "i4", False) * 1e-3),
+        }
+    return results
+
+
+def bench_oip3(data_format:str, settle_time:float, latency:dict):
+    """ Runs LimiterTest.test_OIP3 on the simulator, returns round trips/bytes per point and points/s """
+    from LimiterTest import LimiterTest
+    resource_manager = SimulatedVisa.install(SimulatedVisa.LatencyModel(**latency))
+    VisaHandler.DEFAULT_BACKEND = "sim"
+    with tempfile.TemporaryDirectory() as output_dir:
+        test = LimiterTest(19, 21, 18, output_file=os.path.join(output_dir, "bench.csv"), settle_time=settle_time)
+        test.spec_analyzer.set_data_format(data_format)
+        points = len(test.frequency_pairs) * len(test.power_levels)
+        before = resource_manager.stats()
+        start = time.perf_counter()
+        test.test_OIP3(plot=False, pause=False)
+        elapsed = time.perf_counter() - start
+    after = resource_manager.stats()
+    delta = {name: after[name] - before[name] for name in after}
+    return {
+        "points": points,
+        "elapsed_s": elapsed,
+        "points_per_s": points / elapsed,
+        "round_trips_per_point": (delta["writes"] + delta["reads"]) / points,
+        "writes_per_point": delta["writes"] / points,
+        "reads_per_point": delta["reads"] / points,
+        "bytes_per_point": (delta["bytes_written"] + delta["bytes_read"]) / points,
+    }
+
+
+def bench_imports(repeat:int=3):
+    """ Import time of each module in a fresh interpreter, minus the bare interpreter startup """
+    env = dict(os.environ, VISA_BACKEND="sim", MPLBACKEND="Agg")
+    code = "import time; start = time.perf_counter(); import {0}; print(time.perf_counter() - start)"
+    results = {}
+    for module in IMPORT_MODULES:
+        times = []
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, "-c", code.format(module)], cwd=TRUNK, env=env,
+                                     capture_output=True, text=True)
+            if process.returncode != 0:
+                print("Import of {0} failed: {1}".format(module, process.stderr.strip().splitlines()[-1:]))
+                break
+            times.append(float(process.stdout.strip().splitlines()[-1]))
+        results[module] = min(times) if times else None
+    return results
+
+
+def bench_startup(latency:dict):
+    """ Time to open each simulated driver (discovery, open and *IDN?) """
+    import Agilent8648
+    import AgilentE36XX
+    import AgilentE4443
+    import Agilent8753ES
+    drivers = {"SignalGenerator": (Agilent8648.SignalGenerator, 19), "PowerSupply": (AgilentE36XX.PowerSupply, 5),
+               "SpectrumAnalyzer": (AgilentE4443.SpectrumAnalyzer, 18),
+               "NetworkAnalzyer": (Agilent8753ES.NetworkAnalzyer, 16)}
+    results = {}
+    for name, (driver, address) in drivers.items():
+        SimulatedVisa.install(SimulatedVisa.LatencyModel(**latency))
+        start = time.perf_counter()
+        driver(address, backend="sim")
+        results[name] = time.perf_counter() - start
+    return results
+
+
+def git_revision():
+    """ Returns the current git commit or None """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=TRUNK, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results:dict, prefix:str=""):
+    """ Returns {"a.b.c": value} for every numeric leaf of <results> """
+    flat = {}
+    for key, value in results.items():
+        name = "{0}.{1}".format(prefix, key) if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(previous:dict, current:dict):
+    """ Prints the change of every metric between two result files """
+    old = flatten(previous["results"])
+    new = flatten(current["results"])
+    print("Compared with {0} ({1})".format(previous["meta"]["timestamp"], previous["meta"]["revision"]))
+    for name in sorted(new):
+        if name in old and old[name]:
+            change = 100.0 * (new[name] - old[name]) / old[name]
+            print("  {0:60s} {1:12.6g} -> {2:12.6g} ({3:+.1f}%)".format(name, old[name], new[name], change))
+
+
+def run(args):
+    """ Runs every benchmark and returns the result dictionary """
+    latency = {"command_latency": args.latency, "bytes_per_second": args.bandwidth, "sweep_time": args.sweep_time,
+               "realtime": True}
+    results = {"parse": bench_parse(), "imports_s": bench_imports(), "startup_s": bench_startup(latency)}
+    results["oip3"] = {data_format: bench_oip3(data_format, args.settle_time, latency)
+                       for data_format in ["ASC", "REAL,32", "INT,32"]}
+    meta = {"timestamp": datetime.now().isoformat(timespec="seconds"), "revision": git_revision(),
+            "python": platform.python_version(), "numpy": np.__version__, "latency": latency,
+            "settle_time": args.settle_time}
+    return {"meta": meta, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Driver and OIP3 loop throughput benchmarks (simulated backend)")
+    parser.add_argument("--output", default=RESULTS_DIR, help="directory the json results are saved to")
+    parser.add_argument("--compare", default=None, help="result file to compare with, defaults to the latest")
+    parser.add_argument("--latency", type=float, default=0.001, help="simulated seconds per message")
+    parser.add_argument("--bandwidth", type=float, default=1e6, help="simulated bus bytes per second")
+    parser.add_argument("--sweep-time", type=float, default=0.05, help="simulated sweep time in seconds")
+    parser.add_argument("--settle-time", type=float, default=0.1, help="LimiterTest generator settle time")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    previous_file = args.compare
+    if previous_file is None:
+        previous_runs = sorted(glob.glob(os.path.join(args.output, "bench_*.json")))
+        previous_file = previous_runs[-1] if previous_runs else None
+
+    current = run(args)
+    output_file = os.path.join(args.output, "bench_{0}.json".format(datetime.now().strftime("%Y%m%d_%H%M%S")))
+    with open(output_file, "w") as results_file:
+        json.dump(current, results_file, indent=2)
+    print(json.dumps(current["results"], indent=2))
+    print("Results saved to {0}".format(output_file))
+    if previous_file is not None:
+        with open(previous_file) as results_file:
+            compare(json.load(results_file), current)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Host side streaming average of spectrum analyzer traces.
+# Each trace updates a running mean and variance per bin (Welford), so averaging can stop as soon as the
+# confidence interval on the bins of interest is tight enough instead of always taking a fixed count.
+# "power" averages in mW (what the analyzer's power average does), "log" averages the dBm values directly
+# (video/log average, reads low on noise).
+
+import numpy as np
+
+DOMAINS = ["power", "log"]
+
+
+class StreamingAverager():
+    """ Running mean/variance per bin of a stream of traces (dBm), in the power or log <domain> """
+
+    def __init__(self, domain:str="power"):
+        if domain not in DOMAINS:
+            raise ValueError("Invalid averaging domain: {0}, please use one of {1}".format(domain, DOMAINS))
+        self.domain = domain
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._mean = None
+        self._m2 = None
+
+    def _to_domain(self, trace):
+        trace = np.asarray(trace, dtype=float)
+        return 10 ** (trace / 10) if self.domain == "power" else trace
+
+    def _to_db(self, values):
+        if self.domain != "power":
+            return values
+        with np.errstate(divide="ignore"):
+            return 10 * np.log10(values)
+
+    def add(self, trace):
+        """ Adds one trace (dBm) to the average, returns the new count """
+        values = self._to_domain(trace)
+        if self._mean is None:
+            self._mean = np.zeros_like(values)
+            self._m2 = np.zeros_like(values)
+        elif values.shape != self._mean.shape:
+            raise ValueError("Trace has {0} points, the average has {1}".format(values.shape, self._mean.shape))
+        self.count += 1
+        delta = values - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (values - self._mean)
+        return self.count
+
+    def mean(self):
+        """ Returns the averaged trace in dBm, None before the first trace """
+        if not self.count:
+            return None
+        return self._to_db(self._mean.copy())
+
+    def variance(self):
+        """ Returns the sample variance per bin, in mW^2 for the power domain and dB^2 for the log domain,
+            None before the first trace
+        """
+        if not self.count:
+            return None
+        if self.count < 2:
+            return np.full_like(self._mean, np.inf)
+        return self._m2 / (self.count - 1)
+
+    def confidence_interval(self, bins=None, z:float=1.96):
+        """ Returns the half width (dB) of the <z> sigma confidence interval of the mean of <bins> (all by default)
+            For the power domain it is the upper dB error of the linear interval, which is the wider side
+        """
+        if not self.count:
+            return None
+        half_width = z * np.sqrt(self.variance() / self.count)
+        mean = self._mean
+        if bins is not None:
+            half_width, mean = half_width[bins], mean[bins]
+        if self.domain == "power":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                half_width = 10 * np.log10(1 + half_width / mean)
+        return half_width
+
+    def converged(self, tolerance_db:float, bins=None, min_count:int=2, z:float=1.96):
+        """ Returns True once at least <min_count> traces are averaged and the confidence interval of every
+            bin in <bins> is within +/- <tolerance_db>
+        """
+        if self.count < max(min_count, 2):
+            return False
+        return bool(np.all(self.confidence_interval(bins, z) <= tolerance_db))
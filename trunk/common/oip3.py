@@ -0,0 +1,110 @@
+# Two tone intermod (IMD) and third order intercept analysis of spectrum analyzer traces.
+# Everything works on stacks of traces (points x frequency) at once, ex: a whole LimiterTest run:
+#   freqs, traces = read_sweep_file("Limiter_test.csv")
+#   powers, _ = tone_powers(freqs, traces, tones)          # tones in Hz, one (F1, F2) pair per trace
+#   oip3 = output_intercept(powers)
+#   iip3, oip3, slopes = slope_fit_intercept(input_power, powers)
+# Tone and product order is always F1, F2, 2F1-F2, 2F2-F1 (same as SpectrumAnalyzer.measure_two_tone).
+
+import numpy as np
+
+# Column of each tone in the (..., 4) power arrays
+F1, F2, IM3_LOW, IM3_HIGH = range(4)
+
+
+def read_sweep_file(path:str):
+    """ Reads a LimiterTest trace csv (x line, y line, blank line per sweep)
+        Returns (freqs, traces) arrays (sweeps x points)
+    """
+    with open(path) as data_file:
+        lines = [line for line in data_file.read().splitlines() if line.strip()]
+    values = np.array([np.array(line.split(","), dtype=float) for line in lines])
+    return values[0::2], values[1::2]
+
+
+def product_frequencies(tones):
+    """ Returns the (..., 4) array F1, F2, 2F1-F2, 2F2-F1 of <tones> (..., 2) """
+    tones = np.asarray(tones, dtype=float)
+    f1, f2 = tones[..., 0], tones[..., 1]
+    return np.stack([f1, f2, 2 * f1 - f2, 2 * f2 - f1], axis=-1)
+
+
+def tone_powers(freqs, traces, tones, window:float=None):
+    """ Windowed peak search for the two tones and their third order products on every trace
+        <freqs> is the frequency axis (points,) shared by all traces or one axis per trace (traces x points),
+        <traces> (traces x points) or a single trace, <tones> the (F1, F2) pair in Hz, or one pair per trace
+        <window> is the search half width in Hz, defaults to a quarter of the tone spacing
+        Returns (powers, peak_freqs), each (traces x 4), nan where a window holds no points
+    """
+    traces = np.atleast_2d(np.asarray(traces, dtype=float))
+    freqs = np.broadcast_to(np.asarray(freqs, dtype=float), traces.shape)
+    tones = np.broadcast_to(np.asarray(tones, dtype=float), (traces.shape[0], 2))
+    targets = product_frequencies(tones)
+    if window is None:
+        window = np.abs(tones[:, 1] - tones[:, 0]) / 4
+    window = np.broadcast_to(np.asarray(window, dtype=float), (traces.shape[0],))
+    # (traces x 4 x points) mask of the bins inside each search window
+    inside = np.abs(freqs[:, None, :] - targets[:, :, None]) <= window[:, None, None]
+    windowed = np.where(inside, traces[:, None, :], -np.inf)
+    peaks = windowed.argmax(axis=-1)
+    powers = np.take_along_axis(windowed, peaks[..., None], axis=-1)[..., 0]
+    peak_freqs = np.take_along_axis(np.broadcast_to(freqs[:, None, :], windowed.shape), peaks[..., None],
+                                    axis=-1)[..., 0]
+    empty = ~inside.any(axis=-1)
+    powers[empty] = np.nan
+    peak_freqs[empty] = np.nan
+    return powers, peak_freqs
+
+
+def output_intercept(powers):
+    """ Returns the OIP3 (..., 2) of the lower (F1, 2F1-F2) and upper (F2, 2F2-F1) side of <powers> (..., 4):
+        OIP3 = P_fund + (P_fund - P_im3) / 2
+    """
+    powers = np.asarray(powers, dtype=float)
+    fundamental = powers[..., [F1, F2]]
+    return fundamental + (fundamental - powers[..., [IM3_LOW, IM3_HIGH]]) / 2
+
+
+def input_intercept(powers, input_power):
+    """ Returns the IIP3 (..., 2) of the lower and upper side, <input_power> is the power per tone (dBm)
+        at the DUT input: IIP3 = P_in + (P_fund - P_im3) / 2
+    """
+    powers = np.asarray(powers, dtype=float)
+    input_power = np.asarray(input_power, dtype=float)[..., None]
+    return input_power + (powers[..., [F1, F2]] - powers[..., [IM3_LOW, IM3_HIGH]]) / 2
+
+
+def slope_fit_intercept(input_power, powers, fit_slopes:bool=False):
+    """ Fits the fundamental with a 1:1 line and the IM3 products with a 3:1 line over a power sweep and
+        returns the intersection as (iip3, oip3, slopes)
+        <input_power> (..., sweep) dBm per tone, <powers> (..., sweep, 4), points that aren't finite are skipped
+        so compressed or noise floor points can be masked out with nan beforehand
+        <fit_slopes> fits the slopes too instead of fixing them at 1 and 3
+        iip3/oip3 are (..., 2) for the lower and upper side, slopes (..., 2, 2) the (fundamental, IM3) slope
+        of each side
+    """
+    powers = np.asarray(powers, dtype=float)
+    input_power = np.broadcast_to(np.asarray(input_power, dtype=float), powers.shape[:-1])
+    # (..., 2 sides, sweep) for the fundamental and its product
+    fundamental = np.moveaxis(powers[..., [F1, F2]], -1, -2)
+    im3 = np.moveaxis(powers[..., [IM3_LOW, IM3_HIGH]], -1, -2)
+    x = np.broadcast_to(input_power[..., None, :], fundamental.shape)
+
+    def fit(y, slope):
+        valid = np.isfinite(y) & np.isfinite(x)
+        count = valid.sum(axis=-1)
+        x_mean = np.where(valid, x, 0).sum(axis=-1) / count
+        y_mean = np.where(valid, y, 0).sum(axis=-1) / count
+        if fit_slopes:
+            dx = np.where(valid, x - x_mean[..., None], 0)
+            dy = np.where(valid, y - y_mean[..., None], 0)
+            slope = (dx * dy).sum(axis=-1) / (dx * dx).sum(axis=-1)
+        slope = np.broadcast_to(slope, y_mean.shape)
+        return slope, y_mean - slope * x_mean
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fundamental_slope, fundamental_offset = fit(fundamental, 1.0)
+        im3_slope, im3_offset = fit(im3, 3.0)
+        iip3 = (fundamental_offset - im3_offset) / (im3_slope - fundamental_slope)
+    oip3 = fundamental_slope * iip3 + fundamental_offset
+    return iip3, oip3, np.stack([fundamental_slope, im3_slope], axis=-1)
@@ -0,0 +1,31 @@
+# Runs independent per-instrument commands from a thread pool
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _run_device_group(device, calls:list):
+    """ Runs <calls> for a single <device> in order while holding the device lock """
+    with device.lock:
+        return [method(*args) for method, args in calls]
+
+
+def run_device_calls(calls:list, executor:ThreadPoolExecutor=None):
+    """ Runs <calls> - a list of (device, method, args) - and returns the results in the same order
+        With an <executor> each device's calls run concurrently with the other devices,
+        calls to the same device are kept together and run in the order given
+    """
+    groups = {}
+    for index, (device, method, args) in enumerate(calls):
+        groups.setdefault(id(device), (device, [], []))
+        groups[id(device)][1].append((method, args))
+        groups[id(device)][2].append(index)
+    results = [None] * len(calls)
+    if executor is None:
+        outcomes = [(indexes, _run_device_group(device, group)) for device, group, indexes in groups.values()]
+    else:
+        futures = [(indexes, executor.submit(_run_device_group, device, group))
+                   for device, group, indexes in groups.values()]
+        outcomes = [(indexes, future.result()) for indexes, future in futures]
+    for indexes, group_results in outcomes:
+        for index, result in zip(indexes, group_results):
+            results[index] = result
+    return results
@@ -0,0 +1,105 @@
+# Background trace plotting.
+# Rendering runs on its own thread with the Agg canvas (no GUI backend, no pyplot state), so a measurement loop
+# only hands traces over a queue and never waits on matplotlib. One figure is reused for the whole run and only
+# the latest <max_lines> traces are kept on it, so memory stays flat however long the run is.
+
+import queue
+import threading
+from collections import deque
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+class PlotService():
+    """ Renders traces sent with plot() to <path> (png, pdf, ... from the extension) from a background thread
+        Plots are dropped instead of blocking once <max_pending> are waiting to be rendered
+    """
+
+    def __init__(self, path:str="sweep_plot.png", max_lines:int=8, max_pending:int=16, xlabel:str="Freq",
+                 ylabel:str="dBm"):
+        self.path = path
+        self.max_lines = max_lines
+        self.queue = queue.Queue(max_pending)
+        self.rendered = 0
+        self.dropped = 0
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+        self.axes.set_xlabel(xlabel)
+        self.axes.set_ylabel(ylabel)
+        self.lines = deque()
+        self.thread = None
+
+    def start(self):
+        """ Starts the render thread, returns self """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="plot service", daemon=True)
+            self.thread.start()
+        return self
+
+    def plot(self, x, y, label:str=None, title:str=None):
+        """ Queues a trace to be added to the figure, returns False if it was dropped """
+        return self._put(("plot", (x, y, label, title)))
+
+    def save(self, path:str):
+        """ Queues a copy of the figure to be written to <path>, ex: a pdf at the end of a run
+            Unlike plot it waits for room in the queue instead of being dropped
+        """
+        self.queue.put(("save", path))
+
+    def _put(self, request:tuple):
+        try:
+            self.queue.put_nowait(request)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout:float=None):
+        """ Renders what is still queued and stops the render thread """
+        if self.thread is not None:
+            self.queue.put(("stop", None))
+            self.thread.join(timeout)
+            self.thread = None
+
+    def _run(self):
+        running = True
+        while running:
+            requests = [self.queue.get()]
+            # Everything that queued up while rendering goes into a single render
+            while True:
+                try:
+                    requests.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            changed = False
+            for kind, args in requests:
+                if kind == "plot":
+                    self._add_line(*args)
+                    changed = True
+                elif kind == "save":
+                    self._render(args)
+                else:
+                    running = False
+            if changed:
+                self._render(self.path)
+
+    def _add_line(self, x, y, label:str, title:str):
+        line, = self.axes.plot(x, y, label=label)
+        self.lines.append(line)
+        while len(self.lines) > self.max_lines:
+            self.lines.popleft().remove()
+        if title is not None:
+            self.axes.set_title(title)
+        self.axes.relim()
+        self.axes.autoscale_view()
+
+    def _render(self, path:str):
+        try:
+            if any(line.get_label() and not line.get_label().startswith("_") for line in self.lines):
+                self.axes.legend()
+            self.figure.savefig(path)
+            self.rendered += 1
+        except (OSError, ValueError) as e:
+            print("Could not save plot to {0}: {1}".format(path, e))
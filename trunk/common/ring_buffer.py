@@ -0,0 +1,71 @@
+# Preallocated ring buffer of traces shared between an acquisition thread and its readers.
+# The producer copies each sweep into the next slot of one (capacity x points) array, readers get copies of the
+# latest traces or of everything written since their last read, so they never wait on the instrument.
+
+import threading
+import time
+
+import numpy as np
+
+
+class TraceRingBuffer():
+    """ Holds the last <capacity> traces of <points> values with their timestamps
+        Counters: written (traces pushed), dropped (overwritten before read_new got to them), errors (failed
+        sweeps reported by the producer)
+    """
+
+    def __init__(self, capacity:int, points:int, dtype:str="f8"):
+        self.capacity = capacity
+        self.points = points
+        self.traces = np.zeros((capacity, points), dtype=dtype)
+        self.timestamps = np.zeros(capacity)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        # Sequence number of the next trace read_new returns
+        self._read = 0
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def push(self, trace, timestamp:float=None):
+        """ Copies <trace> into the next slot, returns its sequence number """
+        with self.lock:
+            slot = self.written % self.capacity
+            np.copyto(self.traces[slot], trace, casting="unsafe")
+            self.timestamps[slot] = time.time() if timestamp is None else timestamp
+            self.written += 1
+            return self.written - 1
+
+    def add_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def _copy(self, first:int, last:int):
+        """ Returns (timestamps, traces) copies of sequence numbers [first, last), oldest first """
+        slots = np.arange(first, last) % self.capacity
+        return self.timestamps[slots], self.traces[slots]
+
+    def latest(self, count:int=1):
+        """ Returns (timestamps, traces) of the latest <count> traces (fewer if not written yet), oldest first """
+        with self.lock:
+            return self._copy(max(self.written - min(count, self.capacity), 0), self.written)
+
+    def read_new(self):
+        """ Returns (timestamps, traces) of every trace written since the previous read_new, oldest first
+            Traces that were overwritten in the meantime are counted as dropped
+        """
+        with self.lock:
+            oldest = self.written - len(self)
+            if self._read < oldest:
+                self.dropped += oldest - self._read
+                self._read = oldest
+            first, self._read = self._read, self.written
+            return self._copy(first, self.written)
+
+    def get_stats(self):
+        """ Returns {"written", "dropped", "errors", "unread"} """
+        with self.lock:
+            return {"written": self.written, "dropped": self.dropped, "errors": self.errors,
+                    "unread": min(self.written - self._read, self.capacity)}
@@ -0,0 +1,102 @@
+# Time vs frequency (waterfall) capture stored in memory mapped .npy files.
+# A capture preallocates <max_sweeps> rows on disk and fills them as sweeps arrive, so minutes of sweeps neither
+# grow python lists nor have to fit in memory. <path> is the base name of three files:
+#   <path>.npy (sweeps x points amplitudes), <path>_times.npy (sweep timestamps), <path>_freqs.npy (freq axis)
+# Captures can be reopened read only with SpectrogramStore.open, also while they are still being written (it sees the
+# sweeps written up to then).
+
+import threading
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+class SpectrogramStore():
+    """ Memory mapped store of up to <max_sweeps> sweeps on the frequency axis <freqs> """
+
+    def __init__(self, path:str, max_sweeps:int=None, freqs=None, dtype:str="f4", mode:str="w+"):
+        """ Creates a new capture, or with <mode> "r"/"r+" opens an existing one (see open) """
+        self.path = path
+        self.lock = threading.Lock()
+        if mode == "w+":
+            freqs = np.asarray(freqs, dtype=float)
+            np.save(self._file("_freqs"), freqs)
+            self.data = open_memmap(self._file(), mode="w+", dtype=dtype, shape=(max_sweeps, len(freqs)))
+            self.times = open_memmap(self._file("_times"), mode="w+", dtype="f8", shape=(max_sweeps,))
+            # Unwritten rows have no timestamp, that is how a reopened capture knows its length
+            self.times[:] = np.nan
+            self.count = 0
+        else:
+            self.data = np.load(self._file(), mmap_mode=mode)
+            self.times = np.load(self._file("_times"), mmap_mode=mode)
+            self.count = int(np.isfinite(self.times).sum())
+        self.freqs = np.load(self._file("_freqs"))
+        self.max_sweeps = len(self.times)
+
+    @classmethod
+    def open(cls, path:str, mode:str="r"):
+        """ Opens the capture at <path>, read only by default """
+        return cls(path, mode=mode)
+
+    def _file(self, suffix:str=""):
+        return "{0}{1}.npy".format(self.path, suffix)
+
+    def __len__(self):
+        return self.count
+
+    def is_full(self):
+        return self.count >= self.max_sweeps
+
+    def append(self, trace, timestamp:float):
+        """ Writes <trace> to the next row, returns False once the capture is full """
+        with self.lock:
+            if self.count >= self.max_sweeps:
+                return False
+            self.data[self.count] = trace
+            # Timestamp last so a reader never sees a row before its data
+            self.times[self.count] = timestamp
+            self.count += 1
+        return True
+
+    def sweeps(self):
+        """ Returns (timestamps, amplitudes) views of the rows written so far """
+        count = self.count
+        return self.times[:count], self.data[:count]
+
+    def decimated(self, max_rows:int=500, max_cols:int=None, mode:str="max"):
+        """ Returns (timestamps, freqs, amplitudes) reduced to at most <max_rows> x <max_cols> for display
+            Each output cell is the "max" (keeps short spikes visible) or "mean" of the block of sweeps and bins
+            it covers, timestamps and freqs are those of the first row/bin of each block
+        """
+        reduce = {"max": np.maximum, "mean": np.add}[mode]
+        times, data = self.sweeps()
+        freqs = self.freqs
+        if not len(times):
+            return times, freqs, np.empty((0, len(freqs)), dtype=self.data.dtype)
+        for axis, limit in ((0, max_rows), (1, max_cols)):
+            size = data.shape[axis]
+            if limit is None or size <= limit:
+                continue
+            step = -(-size // limit)
+            starts = np.arange(0, size, step)
+            data = reduce.reduceat(data, starts, axis=axis)
+            if mode == "mean":
+                counts = np.diff(np.append(starts, size))
+                data = data / (counts[:, None] if axis == 0 else counts[None, :])
+            if axis == 0:
+                times = times[starts]
+            else:
+                freqs = freqs[starts]
+        return np.array(times), freqs, np.array(data)
+
+    def flush(self):
+        """ Writes the sweeps to disk, does nothing for a read only or closed capture """
+        if self.data is not None and self.data.flags.writeable:
+            self.data.flush()
+            self.times.flush()
+
+    def close(self):
+        """ Flushes and releases the memory maps """
+        self.flush()
+        self.data = None
+        self.times = None
@@ -0,0 +1,5 @@
+# The drivers import each other as top level modules (from VisaHandler import ...), run against trunk/
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+# NetworkAnalzyer against the simulated backend
+import pytest
+import visa
+
+import SimulatedVisa
+from Agilent8753ES import NetworkAnalzyer
+
+
+class WholeDumpResource():
+    """ Returns everything queued in one read, like a GPIB read that only ends on END """
+
+    def __init__(self, resource, fail_queries:bool=False):
+        self.__dict__["resource"] = resource
+        self.__dict__["fail_queries"] = fail_queries
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def read(self):
+        data, self.resource._output = self.resource._output, b""
+        if not data:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        return data.decode().rstrip("\n")
+
+    def query(self, message:str):
+        if self.fail_queries:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        return self.resource.query(message)
+
+
+@pytest.fixture
+def network_analyzer():
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(realtime=False), SimulatedVisa.SimulatedBench(seed=1))
+    return NetworkAnalzyer(16, backend="sim")
+
+
+def test_formatted_data_line_per_read(network_analyzer):
+    data = network_analyzer.get_formatted_data()
+    assert data.shape == (201, 2)
+    assert (data[:, 1] == 0).all()
+
+
+def test_formatted_data_in_one_read(network_analyzer):
+    network_analyzer.device = WholeDumpResource(network_analyzer.device)
+    data = network_analyzer.get_formatted_data()
+    assert data.shape == (201, 2)
+    assert (data[:, 1] == 0).all()
+
+
+def test_formatted_data_fails_without_point_count(network_analyzer):
+    network_analyzer.device = WholeDumpResource(network_analyzer.device, fail_queries=True)
+    assert network_analyzer.get_formatted_data() == 1
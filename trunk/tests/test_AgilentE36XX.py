@@ -0,0 +1,28 @@
+# PowerSupply against the simulated backend
+import numpy as np
+import pytest
+
+import SimulatedVisa
+from AgilentE36XX import PowerSupply
+
+
+@pytest.fixture
+def power_supply():
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(realtime=False))
+    return PowerSupply(5, backend="sim")
+
+
+def test_get_applied_settings(power_supply):
+    power_supply.write("INST P25V")
+    power_supply.write("VOLT 5")
+    power_supply.write("CURR 0.5")
+    assert np.array_equal(power_supply.get_applied_settings(0), [0.0, 1.0])
+    assert np.array_equal(power_supply.get_applied_settings(1), [5.0, 0.5])
+    assert np.array_equal(power_supply.get_applied_settings("p25v"), [5.0, 0.5])
+
+
+def test_set_port_rejects_unknown_outputs(power_supply):
+    assert power_supply.set_port(3) == 1
+    assert power_supply.set_port("P12V") == 1
+    assert power_supply.set_port(2) == 0
+    assert power_supply.query("INST?") == "N25V"
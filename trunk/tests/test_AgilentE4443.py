@@ -0,0 +1,115 @@
+# SpectrumAnalyzer against the simulated backend
+import time
+
+import pytest
+
+import SimulatedVisa
+from AgilentE4443 import SpectrumAnalyzer
+
+
+class QueryInterruptedResource():
+    """ Wraps a resource and, like an IEEE 488.2 instrument, discards a pending response when a new message is
+        written before it has been read - counted in <interrupted>
+    """
+
+    def __init__(self, resource):
+        self.__dict__["resource"] = resource
+        self.__dict__["pending"] = False
+        self.__dict__["interrupted"] = 0
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        else:
+            setattr(self.resource, name, value)
+
+    def write(self, message:str):
+        if self.pending:
+            self.interrupted += 1
+            self.resource._output = b""
+        result = self.resource.write(message)
+        self.pending = bool(self.resource._output)
+        if self.pending:
+            # Leave the response waiting long enough for another thread to get in
+            time.sleep(0.002)
+        return result
+
+    def _read(self, read, *args, **kwargs):
+        data = read(*args, **kwargs)
+        self.pending = bool(self.resource._output)
+        return data
+
+    def read(self):
+        return self._read(self.resource.read)
+
+    def read_raw(self, *args, **kwargs):
+        return self._read(self.resource.read_raw, *args, **kwargs)
+
+    def read_bytes(self, *args, **kwargs):
+        return self._read(self.resource.read_bytes, *args, **kwargs)
+
+    def query(self, message:str):
+        self.write(message)
+        return self.read()
+
+
+class NoEventsResource():
+    """ Resource without VISA events, like a raw socket """
+
+    def __init__(self, resource):
+        self.__dict__["resource"] = resource
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def install_handler(self, *args):
+        raise NotImplementedError("No events")
+
+
+@pytest.fixture
+def spectrum_analyzer():
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(realtime=False), SimulatedVisa.SimulatedBench(seed=1))
+    return SpectrumAnalyzer(18, backend="sim")
+
+
+@pytest.fixture
+def realtime_analyzer():
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(command_latency=0, sweep_time=0.05, realtime=True),
+                          SimulatedVisa.SimulatedBench(seed=1))
+    return SpectrumAnalyzer(18, backend="sim")
+
+
+def test_start_sweep_completes_by_service_request(realtime_analyzer):
+    completed = []
+    event = realtime_analyzer.start_sweep(callback=completed.append)
+    assert event.wait(2)
+    assert realtime_analyzer._srq_enabled is True
+    assert completed == [realtime_analyzer]
+
+
+def test_start_sweep_polls_without_events(realtime_analyzer):
+    realtime_analyzer.device = NoEventsResource(realtime_analyzer.device)
+    completed = []
+    event = realtime_analyzer.start_sweep(callback=completed.append)
+    assert event.wait(2)
+    assert realtime_analyzer._srq_enabled is False
+    assert completed == [realtime_analyzer]
+
+
+def test_foreground_writes_wait_for_background_sweep(spectrum_analyzer):
+    resource = QueryInterruptedResource(spectrum_analyzer.device)
+    spectrum_analyzer.device = resource
+    ring_buffer = spectrum_analyzer.start_background_acquisition(capacity=16)
+    deadline = time.perf_counter() + 5
+    writes = 0
+    while ring_buffer.get_stats()["written"] < 5 and time.perf_counter() < deadline:
+        assert spectrum_analyzer.set_start_freq(2.3 + writes % 2 * 0.01) == 0
+        writes += 1
+    spectrum_analyzer.stop_background_acquisition()
+    assert writes > 0
+    assert resource.interrupted == 0
+    assert ring_buffer.get_stats()["errors"] == 0
+    assert ring_buffer.get_stats()["written"] >= 5
@@ -0,0 +1,24 @@
+# AsyncVisaDevice against the simulated backend
+import asyncio
+
+import SimulatedVisa
+from AgilentE4443 import AsyncSpectrumAnalyzer
+
+
+def test_async_batch_sends_one_message():
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(realtime=False), SimulatedVisa.SimulatedBench(seed=1))
+
+    async def run():
+        async with await AsyncSpectrumAnalyzer.open(18, backend="sim") as sa:
+            writes = sa.device.device.stats["writes"]
+            async with sa.batch() as batch:
+                assert await sa.write("FREQ:START 2.3e9") == 0
+                assert await sa.write("FREQ:STOP 2.5e9") == 0
+                start = await sa.query("FREQ:START?")
+                assert batch.status is None
+            assert batch.status == 0
+            assert sa.device.device.stats["writes"] - writes == 1
+            assert float(start.value) == 2.3e9
+            assert float(await sa.query("FREQ:STOP?")) == 2.5e9
+
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+# BusScheduler priority ordering
+import threading
+import time
+
+import pytest
+
+from BusScheduler import PRIORITY_BULK, PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_TRIGGER, BusScheduler
+
+
+def test_waiters_get_the_bus_in_priority_order():
+    scheduler = BusScheduler("GPIB9")
+    order = []
+
+    def transaction(name, priority):
+        with scheduler.transaction(priority):
+            order.append(name)
+
+    scheduler.acquire(PRIORITY_NORMAL)
+    threads = []
+    for name, priority in (("bulk", PRIORITY_BULK), ("normal 1", PRIORITY_NORMAL), ("critical", PRIORITY_CRITICAL),
+                           ("trigger", PRIORITY_TRIGGER), ("normal 2", PRIORITY_NORMAL)):
+        thread = threading.Thread(target=transaction, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        # Queue them in this order
+        deadline = time.perf_counter() + 2
+        while len(scheduler.waiting) < len(threads) and time.perf_counter() < deadline:
+            time.sleep(0.001)
+    scheduler.release()
+    for thread in threads:
+        thread.join(2)
+    assert order == ["critical", "trigger", "normal 1", "normal 2", "bulk"]
+    report = scheduler.report()["priorities"]
+    assert report["normal"]["transactions"] == 3
+    assert report["bulk"]["transactions"] == 1
+
+
+def test_nested_transactions_and_foreign_release():
+    scheduler = BusScheduler("GPIB9")
+    with scheduler.transaction(PRIORITY_BULK):
+        with scheduler.transaction(PRIORITY_CRITICAL):
+            assert scheduler.depth == 2
+        assert scheduler.owner == threading.get_ident()
+        errors = []
+
+        def release():
+            try:
+                scheduler.release()
+            except RuntimeError as e:
+                errors.append(e)
+        thread = threading.Thread(target=release)
+        thread.start()
+        thread.join(2)
+        assert len(errors) == 1
+    assert scheduler.owner is None
+    with pytest.raises(RuntimeError):
+        scheduler.release()
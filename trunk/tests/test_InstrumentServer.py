@@ -0,0 +1,15 @@
+# InstrumentServer request coalescing
+import pytest
+
+from InstrumentServer import is_pure_query
+
+
+@pytest.mark.parametrize("message", ["*IDN?", "FREQ:START?", "CALC:MARK1:X?;:CALC:MARK1:Y?", ":TRAC:DATA? TRACE1"])
+def test_pure_queries_coalesce(message):
+    assert is_pure_query(message)
+
+
+@pytest.mark.parametrize("message", ["SYST:ERR?", ":syst:err?", "SYSTEM:ERROR:NEXT?", "*ESR?", "*STB?",
+                                     "STAT:OPER:EVEN?", "FREQ:START?;*ESR?", "FREQ:START 1e9;*OPC?"])
+def test_stateful_queries_and_writes_dont_coalesce(message):
+    assert not is_pure_query(message)
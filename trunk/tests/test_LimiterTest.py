@@ -0,0 +1,20 @@
+# LimiterTest against the simulated backend
+import VisaHandler
+import SimulatedVisa
+from LimiterTest import LimiterTest
+
+
+def test_close_shuts_down_the_thread_pool(tmp_path, monkeypatch):
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(realtime=False), SimulatedVisa.SimulatedBench(seed=1))
+    monkeypatch.setattr(VisaHandler, "DEFAULT_BACKEND", "sim")
+    output_file = tmp_path / "limiter.csv"
+    with LimiterTest(19, 21, 18, output_file=str(output_file), concurrent=True, settle_time=0,
+                     measurement="marker") as test:
+        test.frequency_pairs = [[2.395, 2.405]]
+        test.power_levels = [0, 10]
+        test.test_OIP3(plot=False, pause=False)
+        executor = test.executor
+    assert test.executor is None
+    assert executor._shutdown
+    assert test.write_file.closed
+    assert len(output_file.read_text().splitlines()) == 2
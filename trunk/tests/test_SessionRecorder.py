@@ -0,0 +1,52 @@
+# Record a simulated session and replay it through the same driver code
+import numpy as np
+import pytest
+
+import SimulatedVisa
+import VisaHandler
+from AgilentE4443 import SpectrumAnalyzer
+from SessionRecorder import ReplayResourceManager, SessionRecorder, load_session
+
+
+def measure(spectrum_analyzer):
+    """ The calls that are recorded and replayed """
+    start = spectrum_analyzer.query("FREQ:START?")
+    ascii_trace = spectrum_analyzer.get_trace_values()
+    spectrum_analyzer.set_data_format("REAL,32")
+    binary_trace = spectrum_analyzer.get_trace_values()
+    return start, ascii_trace, binary_trace, spectrum_analyzer.get_status_byte()
+
+
+@pytest.fixture
+def recording(tmp_path):
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(realtime=False), SimulatedVisa.SimulatedBench(seed=1))
+    path = str(tmp_path / "session.jsonl.gz")
+    spectrum_analyzer = SpectrumAnalyzer(18, backend="sim")
+    recorder = SessionRecorder(path)
+    spectrum_analyzer.start_recording(recorder)
+    # What opening the analyzer sends, the replayed analyzer is opened from the recording
+    spectrum_analyzer.get_idn()
+    spectrum_analyzer.set_data_format("ASC", "NORM")
+    recorded = (spectrum_analyzer.idn,) + measure(spectrum_analyzer)
+    spectrum_analyzer.stop_recording()
+    recorder.close()
+    return path, recorded
+
+
+def test_recording_logs_every_call(recording):
+    path, _ = recording
+    records = load_session(path)["GPIB0::18::INSTR"]
+    assert [record["op"] for record in records][:2] == ["query", "write"]
+    assert records[0]["c"] == "*IDN?"
+    assert any("b" in record for record in records)
+    assert records[-1]["op"] == "read_stb"
+
+
+def test_replay_returns_recorded_responses(recording, monkeypatch):
+    path, recorded = recording
+    monkeypatch.setitem(VisaHandler.RESOURCE_MANAGERS, "replay", ReplayResourceManager(path, speed=0))
+    spectrum_analyzer = SpectrumAnalyzer(18, backend="replay")
+    idn, start, ascii_trace, binary_trace, status = (spectrum_analyzer.idn,) + measure(spectrum_analyzer)
+    assert (idn, start, status) == (recorded[0], recorded[1], recorded[4])
+    assert np.array_equal(ascii_trace, recorded[2])
+    assert np.array_equal(binary_trace, recorded[3])
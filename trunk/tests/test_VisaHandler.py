@@ -0,0 +1,143 @@
+# Visa_Device against the simulated backend
+import numpy as np
+import pytest
+
+import SimulatedVisa
+from AgilentE4443 import SpectrumAnalyzer
+from VisaHandler import decode_block, parse_values, split_blocks
+
+
+class NoTerminationResource():
+    """ Resource without a read termination set, like a pyvisa GPIB resource that was never configured """
+
+    read_termination = None
+
+    def __init__(self, resource):
+        self.__dict__["resource"] = resource
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+
+@pytest.fixture
+def spectrum_analyzer():
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(realtime=False), SimulatedVisa.SimulatedBench(seed=1))
+    return SpectrumAnalyzer(18, backend="sim")
+
+
+def test_scheduled_query_values_without_read_termination(spectrum_analyzer):
+    points = len(spectrum_analyzer.get_freq_points())
+    spectrum_analyzer.enable_scheduling()
+    spectrum_analyzer.device.block_chunk_size = 256
+    spectrum_analyzer.device.__dict__["resource"] = NoTerminationResource(spectrum_analyzer.device.resource)
+    values = spectrum_analyzer.query_values("TRAC:DATA? TRACE1")
+    assert isinstance(values, np.ndarray)
+    assert values.shape == (points,)
+
+
+def test_batch_sends_one_message(spectrum_analyzer):
+    stats = spectrum_analyzer.device.stats
+    writes = stats["writes"]
+    with spectrum_analyzer.batch() as batch:
+        assert spectrum_analyzer.write("FREQ:START 2.3e9") == 0
+        assert spectrum_analyzer.write("FREQ:STOP 2.5e9") == 0
+        start = spectrum_analyzer.query("FREQ:START?")
+        stop = spectrum_analyzer.query("FREQ:STOP?")
+        with pytest.raises(RuntimeError):
+            start.value
+    assert batch.status == 0
+    assert stats["writes"] - writes == 1
+    assert float(start.value) == 2.3e9
+    assert float(stop.value) == 2.5e9
+
+
+def test_batch_refuses_immediate_responses(spectrum_analyzer):
+    writes = spectrum_analyzer.device.stats["writes"]
+    with pytest.raises(RuntimeError):
+        with spectrum_analyzer.batch():
+            spectrum_analyzer.get_point_count()
+    with pytest.raises(RuntimeError):
+        with spectrum_analyzer.batch():
+            spectrum_analyzer.write("FREQ:START 2.3e9")
+            spectrum_analyzer.query_binary("TRAC:DATA? TRACE1")
+    with pytest.raises(RuntimeError):
+        with spectrum_analyzer.batch():
+            # Its own batch joins the outer one, so the responses aren't there yet
+            spectrum_analyzer.get_averaging()
+    with pytest.raises(RuntimeError):
+        with spectrum_analyzer.batch():
+            spectrum_analyzer.wait_for_complete("INIT:IMM")
+    # Nothing was sent by the failed batches
+    assert spectrum_analyzer.device.stats["writes"] == writes
+    assert spectrum_analyzer._batch is None
+    assert spectrum_analyzer.get_averaging() == 0
+
+
+def test_state_cache_skips_unchanged_settings():
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(realtime=False), SimulatedVisa.SimulatedBench(seed=1))
+    spectrum_analyzer = SpectrumAnalyzer(18, backend="sim", state_cache=True)
+    stats = spectrum_analyzer.device.stats
+    writes = stats["writes"]
+    for _ in range(3):
+        assert spectrum_analyzer.write("FREQ:START 2.3e9") == 0
+    assert stats["writes"] - writes == 1
+    # Center and span move start and stop, so the cached start no longer applies
+    spectrum_analyzer.write("FREQ:CENT 3e9")
+    spectrum_analyzer.write("FREQ:START 2.3e9")
+    assert stats["writes"] - writes == 3
+    # Actions are always sent, a reset forgets every setting
+    spectrum_analyzer.write("INIT:IMM")
+    spectrum_analyzer.write("INIT:IMM")
+    spectrum_analyzer.write("*RST")
+    spectrum_analyzer.write("FREQ:START 2.3e9")
+    assert stats["writes"] - writes == 7
+    spectrum_analyzer.invalidate("FREQ:START")
+    spectrum_analyzer.write("FREQ:START 2.3e9")
+    assert stats["writes"] - writes == 8
+
+
+def test_decode_block_byte_orders():
+    values = np.array([1.5, -2.25, 1e-3], dtype="f4")
+    assert np.array_equal(decode_block(values.astype(">f4").tobytes(), "f4"), values)
+    assert np.array_equal(decode_block(values.astype("<f4").tobytes(), "f4", big_endian=False), values)
+    decoded = decode_block(np.array([-90000, 5], dtype=">i4").tobytes(), "i4")
+    assert decoded.dtype == np.dtype("i4")
+    assert decoded.tolist() == [-90000, 5]
+
+
+def test_split_blocks():
+    # The data of the first block contains both separators
+    first, second = b"ab;#\ncd", b"\x00\x01"
+    raw = b"#17" + first + b";#12" + second + b"\n"
+    assert split_blocks(raw, 2) == [first, second]
+    assert split_blocks(raw, 1) == [first]
+    # Not all there yet
+    assert split_blocks(raw[:6], 1) is None
+    assert split_blocks(raw[:12], 2) is None
+    assert split_blocks(b"#0abc\n", 1) == [b"abc"]
+    with pytest.raises(ValueError):
+        split_blocks(b"#0abc;#11a\n", 2)
+
+
+def test_query_binary_matches_ascii(spectrum_analyzer):
+    ascii_points = len(spectrum_analyzer.query_values("TRAC:DATA? TRACE1"))
+    assert spectrum_analyzer.write("FORM REAL,32") == 0
+    values = spectrum_analyzer.query_binary("TRAC:DATA? TRACE1")
+    assert values.dtype == np.dtype("f4")
+    assert len(values) == ascii_points
+    both = spectrum_analyzer.query_binary_many(["TRAC:DATA? TRACE1", "TRAC:DATA? TRACE2"])
+    assert [len(trace) for trace in both] == [ascii_points, ascii_points]
+
+
+def test_parse_values():
+    assert parse_values("1.5,-2,3e9\n").tolist() == [1.5, -2.0, 3e9]
+    assert parse_values("1, 2\n3, 4").tolist() == [1, 2, 3, 4]
+    assert parse_values("").size == 0
+    values = parse_values("9.91E37,9.9E37,-9.9E37,abc,1")
+    assert np.isnan(values[0]) and np.isnan(values[3])
+    assert values[1:3].tolist() == [np.inf, -np.inf]
+    assert values[4] == 1
+    ints = parse_values("1,2,3", dtype=np.int32)
+    assert ints.dtype == np.int32
+    # Integers can't hold nan, the float values come back instead
+    assert parse_values("1,9.91E37", dtype=np.int32).dtype == np.float64
@@ -0,0 +1,57 @@
+# common.averaging.StreamingAverager and early stopping averaged sweeps
+import numpy as np
+import pytest
+
+import SimulatedVisa
+from AgilentE4443 import SpectrumAnalyzer
+from common.averaging import StreamingAverager
+
+
+def test_matches_batch_statistics():
+    traces = np.random.default_rng(1).normal(-50, 2, (20, 8))
+    log = StreamingAverager("log")
+    power = StreamingAverager("power")
+    for trace in traces:
+        log.add(trace)
+        power.add(trace)
+    assert log.count == power.count == 20
+    assert np.allclose(log.mean(), traces.mean(axis=0))
+    assert np.allclose(log.variance(), traces.var(axis=0, ddof=1))
+    linear = 10 ** (traces / 10)
+    assert np.allclose(power.mean(), 10 * np.log10(linear.mean(axis=0)))
+    assert np.allclose(power.variance(), linear.var(axis=0, ddof=1))
+    # Power averaging reads higher than log averaging on noise
+    assert (power.mean() > log.mean()).all()
+
+
+def test_empty_and_invalid():
+    averager = StreamingAverager()
+    assert averager.mean() is None
+    assert averager.variance() is None
+    assert averager.confidence_interval() is None
+    assert not averager.converged(10)
+    averager.add(np.zeros(4))
+    assert np.isinf(averager.variance()).all()
+    with pytest.raises(ValueError):
+        averager.add(np.zeros(5))
+    with pytest.raises(ValueError):
+        StreamingAverager("video")
+
+
+def test_converged_needs_min_count_and_tolerance():
+    averager = StreamingAverager("log")
+    for trace in ([0.0, 0.0], [0.1, 5.0], [-0.1, -5.0]):
+        averager.add(trace)
+    assert not averager.converged(1.0, min_count=4)
+    assert averager.converged(1.0, bins=[0], min_count=3)
+    assert not averager.converged(1.0, min_count=3)
+
+
+def test_averaged_sweep_stops_early():
+    SimulatedVisa.install(SimulatedVisa.LatencyModel(realtime=False), SimulatedVisa.SimulatedBench(seed=1))
+    spectrum_analyzer = SpectrumAnalyzer(18, backend="sim")
+    freqs, averaged, count = spectrum_analyzer.get_averaged_sweep_data(max_count=32, tolerance_db=100, min_count=4)
+    assert count == 4
+    assert averaged.shape == freqs.shape
+    _, _, count = spectrum_analyzer.get_averaged_sweep_data(max_count=6, tolerance_db=1e-6, min_count=2)
+    assert count == 6
@@ -0,0 +1,62 @@
+# common.oip3 two tone analysis
+import numpy as np
+
+from common.oip3 import input_intercept, output_intercept, product_frequencies, slope_fit_intercept, tone_powers
+
+GAIN = 10.0
+IIP3 = 20.0
+
+
+def ideal_powers(input_power):
+    """ (sweep x 4) F1, F2, 2F1-F2, 2F2-F1 output powers of an amplifier with GAIN and IIP3 """
+    input_power = np.asarray(input_power, dtype=float)
+    fundamental = input_power + GAIN
+    im3 = 3 * input_power - 2 * IIP3 + GAIN
+    return np.stack([fundamental, fundamental, im3, im3], axis=-1)
+
+
+def test_product_frequencies():
+    assert product_frequencies([2.395e9, 2.405e9]).tolist() == [2.395e9, 2.405e9, 2.385e9, 2.415e9]
+
+
+def test_tone_powers_windowed_peak_search():
+    freqs = np.linspace(2.35e9, 2.45e9, 1001)
+    traces = np.full((2, len(freqs)), -100.0)
+    expected = [[0.0, -1.0, -60.0, -61.0], [5.0, 4.0, -45.0, -46.0]]
+    for trace, levels in zip(traces, expected):
+        # Tones slightly off nominal, still inside the windows
+        for freq, level in zip((2.3952e9, 2.4048e9, 2.3856e9, 2.4144e9), levels):
+            trace[np.abs(freqs - freq).argmin()] = level
+    # A spur outside every window
+    traces[:, 0] = 20.0
+    powers, peak_freqs = tone_powers(freqs, traces, (2.395e9, 2.405e9))
+    assert powers.tolist() == expected
+    assert np.allclose(peak_freqs[0], [2.3952e9, 2.4048e9, 2.3856e9, 2.4144e9])
+    # No bin within 1kHz of the tones
+    powers, _ = tone_powers(freqs + 5e4, traces[0], (2.395e9, 2.405e9), window=1e3)
+    assert np.isnan(powers).all()
+
+
+def test_intercepts_of_an_ideal_amplifier():
+    input_power = np.array([-10.0, -5.0, 0.0])
+    powers = ideal_powers(input_power)
+    assert np.allclose(output_intercept(powers), IIP3 + GAIN)
+    assert np.allclose(input_intercept(powers, input_power), IIP3)
+    for fit_slopes in (False, True):
+        iip3, oip3, slopes = slope_fit_intercept(input_power, powers, fit_slopes)
+        assert np.allclose(iip3, IIP3)
+        assert np.allclose(oip3, IIP3 + GAIN)
+        assert np.allclose(slopes, [[1, 3], [1, 3]])
+
+
+def test_slope_fit_skips_masked_points():
+    input_power = np.array([-10.0, -5.0, 0.0, 5.0])
+    powers = ideal_powers(input_power)
+    # Compressed fundamentals at the last point, masked with nan before the fit
+    powers[-1, :2] -= 6
+    iip3, _, _ = slope_fit_intercept(input_power, powers)
+    assert not np.allclose(iip3, IIP3)
+    powers[-1] = np.nan
+    iip3, oip3, _ = slope_fit_intercept(input_power, powers, fit_slopes=True)
+    assert np.allclose(iip3, IIP3)
+    assert np.allclose(oip3, IIP3 + GAIN)
@@ -0,0 +1,47 @@
+# common.ring_buffer.TraceRingBuffer
+import numpy as np
+
+from common.ring_buffer import TraceRingBuffer
+
+
+def push(ring_buffer, first, last):
+    for sequence in range(first, last):
+        assert ring_buffer.push(np.full(2, sequence), float(sequence)) == sequence
+
+
+def test_wraparound_keeps_the_latest_traces():
+    ring_buffer = TraceRingBuffer(4, 2)
+    push(ring_buffer, 0, 3)
+    times, traces = ring_buffer.latest(10)
+    assert times.tolist() == [0.0, 1.0, 2.0]
+    push(ring_buffer, 3, 10)
+    assert len(ring_buffer) == 4
+    times, traces = ring_buffer.latest(10)
+    assert times.tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert traces[:, 0].tolist() == [6, 7, 8, 9]
+    times, _ = ring_buffer.latest(2)
+    assert times.tolist() == [8.0, 9.0]
+
+
+def test_read_new_counts_overwritten_traces():
+    ring_buffer = TraceRingBuffer(4, 2)
+    push(ring_buffer, 0, 2)
+    times, _ = ring_buffer.read_new()
+    assert times.tolist() == [0.0, 1.0]
+    assert ring_buffer.read_new()[0].size == 0
+    # 2..7 written, 2 and 3 are overwritten before they are read
+    push(ring_buffer, 2, 8)
+    assert ring_buffer.get_stats()["unread"] == 4
+    times, traces = ring_buffer.read_new()
+    assert times.tolist() == [4.0, 5.0, 6.0, 7.0]
+    assert traces[:, 1].tolist() == [4, 5, 6, 7]
+    ring_buffer.add_error()
+    assert ring_buffer.get_stats() == {"written": 8, "dropped": 2, "errors": 1, "unread": 0}
+
+
+def test_reads_are_copies():
+    ring_buffer = TraceRingBuffer(2, 2)
+    push(ring_buffer, 0, 1)
+    _, traces = ring_buffer.latest()
+    push(ring_buffer, 1, 3)
+    assert traces[0].tolist() == [0, 0]
@@ -0,0 +1,50 @@
+# common.spectrogram.SpectrogramStore
+import numpy as np
+
+from common.spectrogram import SpectrogramStore
+
+
+def test_store_fills_and_reopens(tmp_path):
+    path = str(tmp_path / "capture")
+    freqs = np.linspace(1e9, 2e9, 8)
+    store = SpectrogramStore(path, 3, freqs)
+    for sweep in range(4):
+        assert store.append(np.full(8, sweep), 10.0 + sweep) == (sweep < 3)
+    assert store.is_full()
+    store.flush()
+    reopened = SpectrogramStore.open(path)
+    times, data = reopened.sweeps()
+    assert len(reopened) == 3
+    assert np.array_equal(times, [10.0, 11.0, 12.0])
+    assert np.array_equal(data[:, 0], [0, 1, 2])
+    assert np.array_equal(reopened.freqs, freqs)
+    store.close()
+
+
+def test_partial_capture_reopens_with_written_rows(tmp_path):
+    path = str(tmp_path / "capture")
+    store = SpectrogramStore(path, 10, np.arange(4))
+    store.append(np.arange(4), 1.0)
+    store.flush()
+    assert len(SpectrogramStore.open(path)) == 1
+    store.close()
+
+
+def test_decimated(tmp_path):
+    store = SpectrogramStore(str(tmp_path / "capture"), 6, np.arange(4))
+    for sweep in range(6):
+        store.append(np.arange(4) + 10 * sweep, float(sweep))
+    times, freqs, data = store.decimated(max_rows=3, max_cols=2)
+    assert np.array_equal(times, [0.0, 2.0, 4.0])
+    assert np.array_equal(freqs, [0, 2])
+    assert np.array_equal(data, [[11, 13], [31, 33], [51, 53]])
+    _, _, data = store.decimated(max_rows=3, max_cols=2, mode="mean")
+    assert np.allclose(data, [[5.5, 7.5], [25.5, 27.5], [45.5, 47.5]])
+    store.close()
+
+
+def test_flush_after_close(tmp_path):
+    store = SpectrogramStore(str(tmp_path / "capture"), 2, np.arange(4))
+    store.close()
+    store.flush()
+    store.close()